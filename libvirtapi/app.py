@@ -8,11 +8,26 @@ from flask_cors import CORS
 import eventlet
 from eventlet import wsgi
 from libvirtapi import config as cfg
+from libvirtapi.libvirtoperations import connpool
+from libvirtapi.libvirtoperations import events
+from libvirtapi.libvirtoperations import exporter
+from libvirtapi.libvirtoperations import ledger
+from libvirtapi.libvirtoperations import metrics
+from libvirtapi.libvirtoperations import novnc
+from libvirtapi.libvirtoperations import offload
+from libvirtapi.libvirtoperations import rpctrace
+from libvirtapi.libvirtoperations import scheduler
+from libvirtapi.libvirtoperations.flavor import FLAVORS
+from libvirtapi.libvirtoperations.jobs import JOBS
+from libvirtapi.libvirtoperations.hosts import HOSTS
+from libvirtapi.libvirtoperations.libvirtapi import LibvirtManager
+from libvirtapi.libvirtoperations.libvirtapi import fleet_managers
 
 from libvirtapi.blueprints.libvirtapi.vm.views import bp as vm_bp
 from libvirtapi.blueprints.libvirtapi.volume.views import bp as volume_bp
 from libvirtapi.blueprints.libvirtapi.image.views import bp as image_bp
 from libvirtapi.blueprints.libvirtapi.monitor.views import bp as monitor_bp
+from libvirtapi.blueprints.libvirtapi.job.views import bp as job_bp
 
 CONF = cfg.CONF
 FILE_FORMAT = ("[%(asctime)s.%(msecs)03d][%(pathname)s:%(funcName)s]"
@@ -24,10 +39,35 @@ def create_app(simple_context=False):
     app = Flask("libvirtapi")
 
     configure_app(app)
+    offload.configure(CONF.getboolean("default", "libvirt_offload"),
+                      CONF.getint("default", "libvirt_offload_threads"),
+                      CONF.getfloat("default", "libvirt_call_timeout"),
+                      CONF.get("default", "libvirt_call_timeouts"))
+    HOSTS.load(CONF)
+    scheduler.SCHEDULER.load(CONF)
+    scheduler.start_refresher(
+        CONF.getint("default", "scheduler_refresh_interval"))
+    ledger.start_reconciler(
+        fleet_managers, CONF.getint("default", "resource_reconcile_interval"))
+    connpool.start_health_checker(
+        CONF.getint("default", "libvirt_health_check_interval"))
+    JOBS.configure(CONF.getint("default", "job_workers"),
+                   CONF.getint("default", "job_history_size"))
+    rpctrace.configure(CONF.getint("default", "rpc_trace_history"))
+    flavor_init()
+    events.BROKER.queue_size = CONF.getint("default", "event_queue_size")
+    events.start_publisher(fleet_managers)
+    metrics.start_sampler(fleet_managers,
+                          CONF.getint("default", "metrics_interval"),
+                          CONF.getint("default", "metrics_history"))
+    exporter.start_exporter(fleet_managers,
+                            CONF.getint("default", "prometheus_interval"))
+    novnc.start_writer(CONF.get("default", "novnc_token_file"))
     app.register_blueprint(vm_bp)
     app.register_blueprint(volume_bp)
     app.register_blueprint(image_bp)
     app.register_blueprint(monitor_bp)
+    app.register_blueprint(job_bp)
     if not simple_context:
         CORS(app)
 
@@ -52,6 +92,16 @@ def log_init(app):
         app.logger.removeHandler(handler)
 
 
+def flavor_init():
+    FLAVORS.load(CONF)
+    try:
+        with LibvirtManager() as lib:
+            FLAVORS.validate(lib.conn)
+    except Exception as e:
+        # libvirt 暂不可用时不阻止启动，规格在创建虚拟机时由 libvirt 校验
+        LOG.warning("skip flavor validation: %s" % e)
+
+
 def configure_app(app):
     config_file = os.getenv(
         "LIBVIRTAPI_CONFIG_FILE") or "/etc/libvirtapi/libvirtapi.conf"
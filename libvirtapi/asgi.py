@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+可选的 asyncio 入口，需要安装 uvicorn：
+
+start-libvirtapi-asgi
+
+虚拟机列表、虚拟机信息、主机列表由原生的异步处理函数提供，
+libvirt 调用在线程池中执行，多台主机的查询用 asyncio.gather 并发等待；
+其余 /libvirtapi/* 路由转发给 Flask 应用，同样在线程池中执行，
+请求体和响应体按块传递，上传下载镜像和 SSE 不需要整体缓存。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+try:
+    import uvicorn
+    HAS_UVICORN = True
+except ImportError:
+    HAS_UVICORN = False
+
+from libvirtapi import config as cfg
+from libvirtapi.app import create_app
+from libvirtapi.exs import CustomException
+from libvirtapi.libvirtoperations.hosts import HOSTS
+from libvirtapi.libvirtoperations.libvirtapi import LibvirtManager
+from libvirtapi.libvirtoperations.libvirtapi import locate_vm
+from libvirtapi.libvirtoperations.libvirtapi import merge_pages
+from libvirtapi.libvirtoperations.libvirtapi import parse_list_params
+from libvirtapi.libvirtoperations.libvirtapi import query_page
+from libvirtapi.utils.prometheus import REQUEST_LATENCY
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+_END = object()
+
+
+class Request():
+    def __init__(self, scope):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query_string = scope.get("query_string", b"")
+        # 与 Flask request.args.get 一致，同名参数取第一个
+        self.args = {}
+        for key, value in parse_qsl(self.query_string.decode("latin1")):
+            self.args.setdefault(key, value)
+        self.headers = dict((name.decode("latin1").lower(),
+                             value.decode("latin1"))
+                            for name, value in scope.get("headers", []))
+
+
+def json_response(data, status=200, headers=None):
+    body = json.dumps(data, sort_keys=True).encode("utf-8")
+    headers = list(headers or [])
+    headers.append(("Content-Type", "application/json"))
+    return status, headers, body
+
+
+def error_response(e, error_description=""):
+    """
+    与 utils.error_handler 相同的返回格式
+    """
+    code = getattr(e, "code", None)
+    code = code if isinstance(code, int) and code else 500
+    message = str(e)
+    if error_description:
+        message = "%s: %s" % (error_description, message)
+    LOG.error(message, exc_info=code >= 500)
+    return json_response({"error": message}, code)
+
+
+class BodyReader():
+    """
+    wsgi.input，在线程池中调用，从事件循环中按块读取请求体
+    """
+
+    def __init__(self, loop, receive):
+        self._loop = loop
+        self._receive = receive
+        self._buffer = b""
+        self._done = False
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(
+            self._receive(), self._loop).result()
+        if message["type"] == "http.request":
+            self._buffer += message.get("body", b"")
+            self._done = not message.get("more_body", False)
+        else:
+            # http.disconnect
+            self._done = True
+
+    def read(self, size=-1):
+        while not self._done and (size is None or size < 0 or
+                                  len(self._buffer) < size):
+            self._fill()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        while not self._done and b"\n" not in self._buffer and \
+                (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        end = self._buffer.find(b"\n") + 1 or len(self._buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+class AsgiApp():
+    """
+    ASGI 3 应用。
+
+    app = AsgiApp(create_app(), workers=32)
+    """
+
+    def __init__(self, wsgi_app, workers=32):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # (method, pattern, handler, Flask 路由模板)
+        self.routes = [
+            ("GET", re.compile(r"^/libvirtapi/vm/?$"), self.list_vms,
+             "/libvirtapi/vm"),
+            ("GET", re.compile(r"^/libvirtapi/vm/(?P<name>[^/]+)$"),
+             self.get_vm, "/libvirtapi/vm/<string:name>"),
+            ("GET", re.compile(r"^/libvirtapi/hosts$"), self.list_hosts,
+             "/libvirtapi/hosts"),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        for method, pattern, handler, rule in self.routes:
+            match = pattern.match(scope["path"])
+            if match and scope["method"] == method:
+                await self.dispatch(scope, send, handler, rule,
+                                    match.groupdict())
+                return
+        await self.call_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def run(self, func, *args):
+        return asyncio.get_event_loop().run_in_executor(
+            self.executor, func, *args)
+
+    async def dispatch(self, scope, send, handler, rule, params):
+        start = time.time()
+        req = Request(scope)
+        LOG.info("[%s]: %s: %s", (scope.get("client") or ("",))[0],
+                 req.method, req.path)
+        try:
+            status, headers, body = await handler(req, **params)
+        except CustomException as e:
+            # 参数错误、主机不存在等，与 Flask 视图的返回一致
+            status, headers, body = json_response({"error": e.message},
+                                                  e.code)
+        except Exception as e:
+            status, headers, body = error_response(
+                e, "%s %s error" % (req.method, rule))
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(k.encode("latin1"), v.encode("latin1"))
+                                for k, v in headers] +
+                    [(b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+        REQUEST_LATENCY.observe((req.method, rule, str(status)),
+                                time.time() - start)
+
+    async def list_vms(self, req):
+        """
+        与 ListVMs.get 相同的参数和返回，各主机的查询并发执行
+        """
+        args = req.args
+        limit, fields = parse_list_params(args)
+        host = args.get("host")
+        hosts = [HOSTS.get(host)] if host else HOSTS.list()
+        pages, errors = await HOSTS.gather(
+            lambda h: query_page(h, args.get("state"), args.get("name"),
+                                 fields, limit, args.get("marker")),
+            hosts, self.executor)
+        page = merge_pages(pages, errors, fields, limit)
+
+        headers = []
+        if page["next_marker"]:
+            headers.append(("X-Next-Marker", page["next_marker"]))
+        if page["errors"]:
+            headers.append(("X-Unreachable-Hosts", ",".join(page["errors"])))
+        status, headers, body = json_response(page["vms"], headers=headers)
+        if page["version"] is not None:
+            etag = "%s-%s" % (page["version"], hashlib.md5(
+                req.query_string).hexdigest()[:8])
+        else:
+            # 清单缓存不可用，按内容计算 ETag
+            etag = hashlib.md5(body).hexdigest()
+        headers.append(("ETag", '"%s"' % etag))
+        if '"%s"' % etag in req.headers.get("if-none-match", ""):
+            return 304, headers, b""
+        return status, headers, body
+
+    async def get_vm(self, req, name):
+        host = await self.run(locate_vm, name, req.args.get("host"))
+
+        def get_vm_info():
+            with LibvirtManager(host=host) as lib:
+                return lib.get_vm_info(name)
+
+        vm = await self.run(get_vm_info)
+        if not vm:
+            return json_response({"error": "not found vm info"}, 400)
+        return json_response(vm)
+
+    async def list_hosts(self, req):
+        def host_info(host):
+            with LibvirtManager(host=host.name) as lib:
+                return lib.get_host_info()
+
+        infos, _ = await HOSTS.gather(host_info, executor=self.executor)
+        hosts = []
+        for host in HOSTS.list():
+            item = host.to_dict()
+            item["info"] = infos.get(host.name)
+            hosts.append(item)
+        return json_response(hosts)
+
+    def environ(self, scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode(
+                "utf-8").decode("latin1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+            "REMOTE_ADDR": client[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin1").upper().replace("-", "_")
+            value = value.decode("latin1")
+            if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                name = "HTTP_" + name
+            if name in environ:
+                value = environ[name] + "," + value
+            environ[name] = value
+        return environ
+
+    async def call_wsgi(self, scope, receive, send):
+        """
+        在线程池中执行 Flask 应用，响应按块发送
+        """
+        loop = asyncio.get_event_loop()
+        environ = self.environ(scope, BodyReader(loop, receive))
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(k.encode("latin1"), v.encode("latin1"))
+                                   for k, v in headers]
+
+        def first():
+            result = self.wsgi_app(environ, start_response)
+            return result, iter(result)
+
+        result, iterator = await self.run(first)
+        started = False
+        try:
+            while True:
+                chunk = await self.run(next, iterator, _END)
+                if not started:
+                    # 生成器形式的响应在第一次迭代时才调用 start_response
+                    await send({"type": "http.response.start",
+                                "status": response["status"],
+                                "headers": response["headers"]})
+                    started = True
+                if chunk is _END:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk,
+                                "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                await self.run(result.close)
+
+
+def create_asgi_app():
+    app = create_app()
+    return AsgiApp(app, CONF.getint("default", "asgi_workers"))
+
+
+def main():
+    if not HAS_UVICORN:
+        print("start-libvirtapi-asgi requires uvicorn: pip install uvicorn")
+        sys.exit(1)
+    app = create_asgi_app()
+    uvicorn.run(app, host="0.0.0.0", port=CONF.getint("default", "asgi_port"),
+                log_config=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,70 @@
-import logging
-from flask.views import MethodView
-from flask import request
-
-
-LOG = logging.getLogger(__name__)
-http_method_funcs = frozenset(
-    ["get", "post", "head", "options", "delete", "put", "trace", "patch"]
-)
-
-
-class BaseView(MethodView):
-    def __getattribute__(self, item):
-        # 记录日志
-        # 认证
-        if str(item).lower() in http_method_funcs:
-            LOG.info("[%s]: %s: %s", request.remote_addr, request.method, request.path)
-        return super().__getattribute__(item)
\ No newline at end of file
+import logging
+import time
+from flask.views import MethodView
+from flask import make_response, request
+
+from libvirtapi import config as cfg
+from libvirtapi.libvirtoperations import rpctrace
+from libvirtapi.utils.prometheus import REQUEST_LATENCY
+
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+http_method_funcs = frozenset(
+    ["get", "post", "head", "options", "delete", "put", "trace", "patch"]
+)
+
+
+def _status_code(rv):
+    if isinstance(rv, tuple):
+        if len(rv) > 1 and isinstance(rv[1], int):
+            return rv[1]
+        rv = rv[0]
+    return getattr(rv, "status_code", 200)
+
+
+class BaseView(MethodView):
+    def __getattribute__(self, item):
+        # 记录日志
+        # 认证
+        if str(item).lower() in http_method_funcs:
+            LOG.info("[%s]: %s: %s", request.remote_addr, request.method, request.path)
+        return super().__getattribute__(item)
+
+    def dispatch_request(self, *args, **kwargs):
+        # 按路由模板统计耗时，避免路径参数导致标签无限增长
+        start = time.time()
+        status = 500
+        trace = None
+        if CONF.getboolean("default", "rpc_trace"):
+            trace = rpctrace.start_trace(
+                "%s %s" % (request.method, request.full_path.rstrip("?")))
+        try:
+            rv = super().dispatch_request(*args, **kwargs)
+            status = _status_code(rv)
+            if trace is not None:
+                rv = self._add_trace_headers(rv)
+            return rv
+        finally:
+            if trace is not None:
+                summary = rpctrace.end_trace()
+                if summary["rpc_count"] >= CONF.getint(
+                        "default", "rpc_trace_log_threshold"):
+                    LOG.warning("%s made %s libvirt calls in %.3fs, "
+                                "slowest: %s" % (
+                                    summary["request"], summary["rpc_count"],
+                                    summary["rpc_time"], summary["slowest"]))
+            endpoint = request.url_rule.rule if request.url_rule else ""
+            REQUEST_LATENCY.observe((request.method, endpoint, str(status)),
+                                    time.time() - start)
+
+    def _add_trace_headers(self, rv):
+        trace = rpctrace.current_trace()
+        resp = make_response(rv)
+        elapsed = time.time() - trace.start
+        resp.headers["X-Libvirt-Rpc-Count"] = str(trace.count)
+        resp.headers["X-Libvirt-Rpc-Time"] = "%.6f" % trace.total
+        resp.headers["Server-Timing"] = \
+            'libvirt;dur=%.3f;desc="%d calls", total;dur=%.3f' % (
+                trace.total * 1000, trace.count, elapsed * 1000)
+        return resp
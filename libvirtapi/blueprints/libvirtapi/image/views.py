@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import logging
-from flask import Blueprint, jsonify
+import re
+from flask import Blueprint, Response, jsonify, request
 
+from libvirtapi.exs import CustomException
 from libvirtapi.libvirtoperations.libvirtapi import LibvirtManager
+from libvirtapi.libvirtoperations.libvirtapi import UPLOAD_OFFSETS
 from libvirtapi.utils.utils import error_handler
 
 from libvirtapi.blueprints.baseview import BaseView
@@ -37,12 +40,187 @@ class Image(BaseView):
         ]
         """
         try:
-            lib = LibvirtManager()
-            images = lib.list_images()
-            return jsonify(images), 200
+            with LibvirtManager() as lib:
+                images = lib.list_images()
+                return jsonify(images), 200
         except Exception as e:
             return error_handler(e, "list images error")
 
 
+def parse_range(header, size):
+    """
+    解析 "bytes=start-end" 形式的 Range 请求头，返回 (start, length)
+    """
+    match = re.match(r"^bytes=(\d*)-(\d*)$", header.strip())
+    if not match or match.groups() == ("", ""):
+        raise CustomException("incorrect header Range: %s" % header, 416)
+    start, end = match.groups()
+    if start == "":
+        # bytes=-N 表示最后 N 个字节
+        start = max(size - int(end), 0)
+        end = size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        raise CustomException("incorrect header Range: %s" % header, 416)
+    return start, end - start + 1
+
+
+def parse_content_range(header):
+    """
+    解析 "bytes start-end/total" 形式的 Content-Range 请求头，
+    返回 (start, total)，total 为 * 时返回 None
+    """
+    match = re.match(r"^bytes (\d+)-(\d+)/(\d+|\*)$", header.strip())
+    if not match:
+        raise CustomException("incorrect header Content-Range: %s" % header, 400)
+    start, _, total = match.groups()
+    return int(start), None if total == "*" else int(total)
+
+
+class ImageData(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def head(self, name):
+        """
+        @api {head} /libvirtapi/image/:name 查询镜像大小和断点续传位置
+        @apiName image_head
+        @apiGroup image
+        @apiExample 查询镜像
+        HEAD /libvirtapi/image/centos7.qcow2
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        Content-Length: 8589934592
+        Accept-Ranges: bytes
+        X-Upload-Offset: 1073741824
+        """
+        try:
+            with LibvirtManager() as lib:
+                size = lib.image_size(name)
+            if size is None:
+                return "", 404
+            headers = {"Content-Length": str(size), "Accept-Ranges": "bytes"}
+            if name in UPLOAD_OFFSETS:
+                headers["X-Upload-Offset"] = str(UPLOAD_OFFSETS[name])
+            return Response(status=200, headers=headers)
+        except Exception as e:
+            return error_handler(e, "get image info failed")
+
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def get(self, name):
+        """
+        @api {get} /libvirtapi/image/:name 下载镜像
+        @apiName image_download
+        @apiGroup image
+        @apiParam {string} sparse 可选，默认 true，按空洞传输稀疏镜像
+        @apiExample 下载镜像，支持 Range 断点续传
+        GET /libvirtapi/image/centos7.qcow2
+        Range: bytes=1073741824-
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 206 Partial Content
+        Content-Type: application/octet-stream
+        Content-Range: bytes 1073741824-8589934591/8589934592
+        """
+        try:
+            with LibvirtManager() as lib:
+                size = lib.image_size(name)
+            if size is None:
+                return jsonify({"error": "not found image %s" % name}), 404
+
+            sparse = request.args.get("sparse", "true").lower() != "false"
+            status = 200
+            offset, length = 0, size
+            headers = {"Accept-Ranges": "bytes"}
+            if request.headers.get("Range"):
+                offset, length = parse_range(request.headers["Range"], size)
+                status = 206
+                headers["Content-Range"] = "bytes %s-%s/%s" % (
+                    offset, offset + length - 1, size)
+            headers["Content-Length"] = str(length)
+
+            def generate():
+                # 流式响应期间占用一个 libvirt 连接
+                with LibvirtManager() as lib:
+                    for chunk in lib.download_image(name, offset, length,
+                                                    sparse):
+                        yield chunk
+
+            return Response(generate(), status=status, headers=headers,
+                            mimetype="application/octet-stream",
+                            direct_passthrough=True)
+        except Exception as e:
+            return error_handler(e, "download image failed")
+
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def put(self, name):
+        """
+        @api {put} /libvirtapi/image/:name 上传镜像
+        @apiName image_upload
+        @apiGroup image
+        @apiParam {string} sparse 可选，默认 true，全零块以空洞写入
+        @apiExample 上传镜像，续传时携带 Content-Range
+        PUT /libvirtapi/image/centos7.qcow2
+        Content-Type: application/octet-stream
+        Content-Length: 7516192768
+        Content-Range: bytes 1073741824-8589934591/8589934592
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        {
+            "name": "centos7.qcow2",
+            "offset": 1073741824,
+            "bytes": 7516192768,
+            "seconds": 35.2,
+            "throughput": 203.6
+        }
+        """
+        try:
+            length = request.content_length
+            if length is None:
+                return jsonify({"error": "not found header Content-Length"}), 411
+
+            offset, total = 0, None
+            if request.headers.get("Content-Range"):
+                offset, total = parse_content_range(
+                    request.headers["Content-Range"])
+
+            sparse = request.args.get("sparse", "true").lower() != "false"
+            with LibvirtManager() as lib:
+                result = lib.upload_image(name, request.stream, length,
+                                          offset, total, sparse)
+            return jsonify(result), 200
+        except Exception as e:
+            return error_handler(e, "upload image failed")
+
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def delete(self, name):
+        """
+        @api {delete} /libvirtapi/image/:name 删除镜像
+        @apiName image_delete
+        @apiGroup image
+        @apiExample 删除镜像，仍被虚拟机或 overlay 使用时返回 409
+        DELETE /libvirtapi/image/centos7.qcow2
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        {
+            "message": true
+        }
+        """
+        try:
+            with LibvirtManager() as lib:
+                if lib.get_volume(name, "images") is None:
+                    return jsonify({"error": "image %s not found" % name}), 404
+                UPLOAD_OFFSETS.pop(name, None)
+                result = lib.delete_volume(name, "images")
+                return jsonify({"message": result}), 200
+        except Exception as e:
+            return error_handler(e, "delete image failed")
+
+
 bp.add_url_rule('/libvirtapi/image',
                 view_func=Image.as_view("list_image"))
+bp.add_url_rule('/libvirtapi/image/<string:name>',
+                view_func=ImageData.as_view("image_data"))
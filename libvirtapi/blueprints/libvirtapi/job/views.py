@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from flask import Blueprint, jsonify
+
+from libvirtapi.utils.utils import error_handler
+from libvirtapi.libvirtoperations.libvirtapi import LibvirtManager
+from libvirtapi.libvirtoperations.jobs import JOBS
+
+from libvirtapi.blueprints.baseview import BaseView
+
+
+bp = Blueprint("job", __name__)
+LOG = logging.getLogger(__name__)
+
+
+class ListJobs(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def get(self):
+        """
+        @api {get} /libvirtapi/jobs 请求后台任务列表
+        @apiName listjobs
+        @apiGroup job
+        @apiSuccess {object} job
+        @apiExample 请求后台任务列表
+        GET /libvirtapi/jobs
+        Content-Type: application/json
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        [
+            {
+                ...
+            }
+            ...
+        ]
+        """
+        try:
+            return jsonify([job.to_dict() for job in JOBS.list()]), 200
+        except Exception as e:
+            return error_handler(e, "list jobs error")
+
+
+class Job(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def get(self, job_id):
+        """
+        @api {get} /libvirtapi/jobs/:id 请求后台任务进度
+        @apiName job
+        @apiGroup job
+        @apiSuccess {object} job
+        @apiExample 请求后台任务进度
+        GET /libvirtapi/jobs/6f1c8a34-2b1e-4c55-9a43-3c1a2b9f7e10
+        Content-Type: application/json
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        {
+            "id": "6f1c8a34-2b1e-4c55-9a43-3c1a2b9f7e10",
+            "type": "create_vm",
+            "target": "test",
+            "status": "running",
+            "phase": "clone",
+            "bytes_copied": 536870912,
+            "bytes_total": 1073741824,
+            "created": "2019-11-11 11:11:11",
+            "elapsed": 12.5,
+            "error": null,
+            "result": null
+        }
+        """
+        try:
+            job = JOBS.get(job_id)
+            if not job:
+                return jsonify({"error": "not found job %s" % job_id}), 404
+            with LibvirtManager(host=job.host) as lib:
+                return jsonify(lib.job_info(job)), 200
+        except Exception as e:
+            return error_handler(e, "get job info failed")
+
+
+bp.add_url_rule('/libvirtapi/jobs', view_func=ListJobs.as_view("list_jobs"))
+bp.add_url_rule('/libvirtapi/jobs/<string:job_id>',
+                view_func=Job.as_view("job"))
@@ -1,16 +1,33 @@
 # -*- coding: utf-8 -*-
 
+import json
 import logging
-from flask import Blueprint, jsonify
+import time
+
+import eventlet
+from flask import Blueprint, Response, jsonify, request
+
+from libvirtapi import config as cfg
 
 from libvirtapi.utils.utils import get_body_json, error_handler
 from libvirtapi.libvirtoperations.libvirtapi import LibvirtManager
+from libvirtapi.libvirtoperations.libvirtapi import locate_vm
+from libvirtapi.libvirtoperations.connpool import list_connection_pools
+from libvirtapi.libvirtoperations.events import BROKER, vm_summary
+from libvirtapi.libvirtoperations.hosts import HOSTS
+from libvirtapi.libvirtoperations.metrics import COLLECTOR
+from libvirtapi.libvirtoperations.exporter import EXPORTER
+from libvirtapi.libvirtoperations import rpctrace
 
 from libvirtapi.blueprints.baseview import BaseView
 
 
 bp = Blueprint("monitor", __name__)
 LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+# 订阅者队列为空时的轮询间隔，只让出当前协程，不阻塞 eventlet hub
+EVENT_POLL_INTERVAL = 0.2
 
 
 class Resource(BaseView):
@@ -35,11 +52,329 @@ class Resource(BaseView):
         ]
         """
         try:
-            lib = LibvirtManager()
-            res = lib.get_resources()
-            return jsonify(res), 200
+            with LibvirtManager() as lib:
+                res = lib.get_resources()
+                return jsonify(res), 200
         except Exception as e:
             return error_handler(e, "list resource error")
 
 
+class Hosts(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def get(self):
+        """
+        @api {get} /libvirtapi/hosts 请求主机列表
+        @apiName hosts
+        @apiGroup resource
+        @apiDescription 并发查询配置文件 libvirt_hosts 中的每台主机，
+        查询失败的主机 status 为 down。
+        @apiSuccess {object} host
+        @apiExample 请求主机列表
+        GET /libvirtapi/hosts
+        Content-Type: application/json
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        [
+            {
+                "name": "node1",
+                "uri": "qemu+tcp://192.168.0.240/system",
+                "status": "up",
+                "error": null,
+                "info": {
+                    "cpus": 32,
+                    "phymemory": 137438953472,
+                    ...
+                }
+            }
+        ]
+        """
+        try:
+            def host_info(host):
+                with LibvirtManager(host=host.name) as lib:
+                    return lib.get_host_info()
+
+            infos, _ = HOSTS.map(host_info)
+            hosts = []
+            for host in HOSTS.list():
+                item = host.to_dict()
+                item["info"] = infos.get(host.name)
+                hosts.append(item)
+            return jsonify(hosts), 200
+        except Exception as e:
+            return error_handler(e, "list hosts error")
+
+
+class Connection(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def get(self):
+        """
+        @api {get} /libvirtapi/connections 请求 libvirt 连接池状态
+        @apiName connections
+        @apiGroup resource
+        @apiSuccess {object} connection
+        @apiExample 请求 libvirt 连接池状态
+        GET /libvirtapi/connections
+        Content-Type: application/json
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        [
+            {
+                "uri": "qemu+tcp://192.168.0.240/system",
+                "size": 8,
+                "opened": 2,
+                "in_use": 1,
+                "idle": 1,
+                "waiting": 0,
+                "checkouts": 120,
+                "created": 2,
+                "discarded": 0,
+                "wait_time_total": 0.001,
+                "wait_time_avg": 0.00001,
+                "wait_time_max": 0.0004
+            }
+        ]
+        """
+        try:
+            pools = [pool.metrics() for pool in list_connection_pools()]
+            return jsonify(pools), 200
+        except Exception as e:
+            return error_handler(e, "list connections error")
+
+
+class VMMetrics(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def get(self, name):
+        """
+        @api {get} /libvirtapi/vm/:name/metrics 请求虚拟机性能数据
+        @apiName vmmetrics
+        @apiGroup resource
+        @apiParam {number} [window=300] 时间窗口，单位秒
+        @apiParam {string} [host] 虚拟机所在主机，不指定时自动查找
+        @apiSuccess {object} metrics
+        @apiExample 请求虚拟机最近 10 分钟的性能数据
+        GET /libvirtapi/vm/test/metrics?window=600
+        Content-Type: application/json
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        {
+            "name": "test",
+            "interval": 10,
+            "window": 600,
+            "samples": [
+                {
+                    "time": 1573441871.2,
+                    "cpu_percent": 12.5,
+                    "disk_read_iops": 20.0,
+                    "disk_write_iops": 3.1,
+                    "disk_read_bps": 81920.0,
+                    "disk_write_bps": 12697.6,
+                    "net_rx_bps": 1024.0,
+                    "net_tx_bps": 512.0,
+                    "net_rx_pps": 10.0,
+                    "net_tx_pps": 6.0,
+                    "mem_balloon": 2147483648,
+                    "mem_rss": 1073741824,
+                    "mem_unused": 536870912
+                }
+                ...
+            ],
+            "average": {
+                "cpu_percent": 10.3,
+                ...
+            }
+        }
+        """
+        try:
+            window = request.args.get("window", "300")
+            if not window.isdigit() or int(window) <= 0:
+                return jsonify({"error": "incorrect param window"}), 400
+            host = HOSTS.get(locate_vm(name, request.args.get("host")))
+            metrics = COLLECTOR.window(name, int(window), host.name)
+            if metrics is None:
+                return jsonify({"error": "not found metrics of vm %s, "
+                                         "vm not running or not sampled yet"
+                                         % name}), 404
+            return jsonify(metrics), 200
+        except Exception as e:
+            return error_handler(e, "get vm metrics error")
+
+
+class Metrics(BaseView):
+    def get(self):
+        """
+        @api {get} /metrics Prometheus 指标
+        @apiName metrics
+        @apiGroup resource
+        @apiDescription 主机、存储池、虚拟机指标来自后台定时刷新的快照，
+        请求耗时直方图实时输出。
+        @apiExample Prometheus 指标
+        GET /metrics
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        Content-Type: text/plain; version=0.0.4
+
+        # HELP libvirtapi_host_cpus Host logical cpus
+        # TYPE libvirtapi_host_cpus gauge
+        libvirtapi_host_cpus 32
+        ...
+        """
+        try:
+            return Response(EXPORTER.render(),
+                            mimetype="text/plain; version=0.0.4")
+        except Exception as e:
+            return error_handler(e, "export metrics error")
+
+
+class RequestTraces(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def get(self):
+        """
+        @api {get} /libvirtapi/debug/requests 请求最近请求的 libvirt 调用统计
+        @apiName requesttraces
+        @apiGroup resource
+        @apiParam {number} [limit=20] 返回条数
+        @apiParam {string} [sort=time] 排序字段: time、rpc_count、rpc_time、duration
+        @apiSuccess {object} trace
+        @apiExample 请求 libvirt 调用最多的请求
+        GET /libvirtapi/debug/requests?sort=rpc_count&limit=5
+        Content-Type: application/json
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        [
+            {
+                "request": "GET /libvirtapi/vm",
+                "time": "2019-11-11 11:11:11",
+                "duration": 0.153,
+                "rpc_count": 42,
+                "rpc_time": 0.121,
+                "slowest": [
+                    {"call": "virConnect.getAllDomainStats", "time": 0.031},
+                    ...
+                ],
+                "calls": {
+                    "virDomain.XMLDesc": {"count": 20, "time": 0.06},
+                    ...
+                }
+            }
+        ]
+        """
+        try:
+            limit = request.args.get("limit", "20")
+            sort = request.args.get("sort", "time")
+            if not limit.isdigit():
+                return jsonify({"error": "incorrect param limit"}), 400
+            if sort not in ("time", "rpc_count", "rpc_time", "duration"):
+                return jsonify({"error": "incorrect param sort"}), 400
+            traces = rpctrace.recent()
+            if sort != "time":
+                traces.sort(key=lambda trace: trace[sort], reverse=True)
+            return jsonify(traces[:int(limit)]), 200
+        except Exception as e:
+            return error_handler(e, "list request traces error")
+
+
+def sync_inventory(host):
+    with LibvirtManager(host=host.name) as lib:
+        lib.inventory.sync(lib)
+        return lib.inventory.list()
+
+
+def sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append("id: %s" % event_id)
+    lines.append("event: %s" % event)
+    lines.append("data: %s" % json.dumps(data))
+    return "\n".join(lines) + "\n\n"
+
+
+def event_stream(sub, snapshot, keepalive):
+    try:
+        yield sse("snapshot", snapshot)
+        last = time.time()
+        while True:
+            events = sub.drain()
+            if sub.overflowed:
+                # 客户端跟不上，丢弃积压并通知其重新拉取
+                sub.overflowed = False
+                events = []
+                yield sse("resync", {"dropped": sub.dropped})
+                last = time.time()
+            for event_id, event, data in events:
+                yield sse(event, data, event_id)
+                last = time.time()
+            if not events:
+                if time.time() - last >= keepalive:
+                    yield ": keepalive\n\n"
+                    last = time.time()
+                eventlet.sleep(EVENT_POLL_INTERVAL)
+    finally:
+        BROKER.unsubscribe(sub)
+
+
+class Events(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def get(self):
+        """
+        @api {get} /libvirtapi/events 订阅虚拟机状态和资源变化
+        @apiName events
+        @apiGroup resource
+        @apiDescription Server-Sent Events。首个事件 snapshot 为当前全量数据，
+        之后推送 vm、resources 增量事件；客户端消费过慢时收到 resync，
+        需重新请求 /libvirtapi/vm 和 /libvirtapi/resources。
+        @apiExample 订阅虚拟机状态和资源变化
+        GET /libvirtapi/events
+        Accept: text/event-stream
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        Content-Type: text/event-stream
+
+        event: snapshot
+        data: {"vms": [...], "resources": {...}}
+
+        id: 12
+        event: vm
+        data: {"action": "changed", "vm": {"name": "test", "state": "Running", ...}}
+
+        id: 13
+        event: resources
+        data: {"vcpus": 10, "memory": 20480, "reserved_vcpus": 0, ...}
+        """
+        try:
+            # 先订阅再取快照，快照之后的变化不会丢失
+            sub = BROKER.subscribe()
+            try:
+                vms, errors = HOSTS.map(sync_inventory)
+                snapshot = {"vms": [vm_summary(vm) for host_vms in vms.values()
+                                    for vm in host_vms],
+                            "resources": BROKER.resources(),
+                            "errors": errors}
+            except Exception:
+                BROKER.unsubscribe(sub)
+                raise
+            resp = Response(
+                event_stream(sub, snapshot,
+                             CONF.getint("default", "event_keepalive_interval")),
+                mimetype="text/event-stream")
+            resp.headers["Cache-Control"] = "no-cache"
+            resp.headers["X-Accel-Buffering"] = "no"
+            return resp
+        except Exception as e:
+            return error_handler(e, "subscribe events error")
+
+
 bp.add_url_rule('/libvirtapi/resources', view_func=Resource.as_view("resources"))
+bp.add_url_rule('/libvirtapi/hosts', view_func=Hosts.as_view("hosts"))
+bp.add_url_rule('/libvirtapi/connections',
+                view_func=Connection.as_view("connections"))
+bp.add_url_rule('/libvirtapi/vm/<string:name>/metrics',
+                view_func=VMMetrics.as_view("vm_metrics"))
+bp.add_url_rule('/libvirtapi/debug/requests',
+                view_func=RequestTraces.as_view("request_traces"))
+bp.add_url_rule('/metrics', view_func=Metrics.as_view("metrics"))
+bp.add_url_rule('/libvirtapi/events', view_func=Events.as_view("events"))
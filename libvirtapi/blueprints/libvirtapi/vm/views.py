@@ -1,16 +1,78 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
 import logging
-from flask import Blueprint, jsonify
+import math
+from flask import Blueprint, Response, jsonify, request
 
+from libvirtapi import config as cfg
 from libvirtapi.utils.utils import get_body_json, error_handler
+from libvirtapi.exs import CustomException
 from libvirtapi.libvirtoperations.libvirtapi import LibvirtManager
+from libvirtapi.libvirtoperations.libvirtapi import parse_list_params
+from libvirtapi.libvirtoperations.libvirtapi import fleet_page_vms
+from libvirtapi.libvirtoperations.libvirtapi import locate_vm
+from libvirtapi.libvirtoperations.libvirtapi import vm_exists
+from libvirtapi.libvirtoperations.hosts import HOSTS
+from libvirtapi.libvirtoperations.libvirtapi import create_vm_job
+from libvirtapi.libvirtoperations.libvirtapi import create_vm_batch_job
+from libvirtapi.libvirtoperations.libvirtapi import vm_actions_job
+from libvirtapi.libvirtoperations.libvirtapi import shutdown_vms_job
+from libvirtapi.libvirtoperations.libvirtapi import POWER_ACTIONS
+from libvirtapi.libvirtoperations.jobs import JOBS
+from libvirtapi.libvirtoperations.flavor import FLAVORS
+from libvirtapi.libvirtoperations.hugepages import page_size_kib
+from libvirtapi.libvirtoperations.novnc import NOVNC
+from libvirtapi.libvirtoperations.scheduler import SCHEDULER, RequestSpec
 
 from libvirtapi.blueprints.baseview import BaseView
 
 
 bp = Blueprint("vm", __name__)
 LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+
+def _number_param(params, name, default, cast=int, minimum=None):
+    """
+    读取数值参数，未指定时返回 default；不是有限的数值或小于 minimum 时
+    抛出 400，与其他参数检查一致
+    """
+    value = params.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        value = cast(value)
+    except (TypeError, ValueError):
+        raise CustomException("incorrect param %s" % name, 400)
+    if not math.isfinite(value) or \
+            (minimum is not None and value < minimum):
+        raise CustomException("incorrect param %s" % name, 400)
+    return value
+
+
+def _request_spec(body, vcpus, mem, count=1):
+    """
+    创建参数 -> 调度请求，mem 单位 GiB，count 台虚拟机合计。
+    overlay 卷按需分配，只有 clone 完整复制镜像时计入存储池空间。
+    规格使用大页时每台虚拟机的内存须为页大小的整数倍。
+    """
+    flavor = FLAVORS.get(body.get("flavor"))
+    hugepages = page_size_kib(flavor.options["hugepages"])
+    if hugepages and (mem / count * 1024 ** 2) % hugepages:
+        raise CustomException("mem must be a multiple of hugepage size %s KiB"
+                              % hugepages, 400)
+    disk = 0
+    provision = body.get("provision") or CONF.get("default", "provision_mode")
+    if provision == "clone":
+        disk = float(body["volume_size"]) * 1024 ** 3 * count
+    cpu_policy = body.get("cpu_policy") or CONF.get("default", "cpu_policy")
+    return RequestSpec(vcpus, mem * 1024, disk,
+                       host=body.get("host") or None,
+                       group=body.get("group") or None,
+                       group_policy=body.get("group_policy"),
+                       dedicated=cpu_policy == "dedicated",
+                       hugepages=hugepages)
 
 
 class ListVMs(BaseView):
@@ -21,12 +83,24 @@ class ListVMs(BaseView):
         @api {get} /libvirtapi/vm 请求虚拟机列表
         @apiName listvms
         @apiGroup vm
+        @apiParam {number} [limit] 每页数量，按名称排序
+        @apiParam {string} [marker] 上一页最后一台虚拟机的名称
+        @apiParam {string} [state] 按状态过滤，如 Running、Stopped
+        @apiParam {string} [name] 按名称前缀过滤
+        @apiParam {string} [fields] 返回的字段，逗号分隔，如 name,state
+        @apiParam {string} [host] 只查询指定主机，默认并发查询所有主机
         @apiSuccess {object} vm
         @apiExample 请求虚拟机列表
         GET /libvirtapi/vm
         Content-Type: application/json
+        @apiExample 分页请求运行中的虚拟机名称和状态
+        GET /libvirtapi/vm?state=Running&fields=name,state&limit=50&marker=hl-node1
+        If-None-Match: "..."
         @apiSuccessExample 成功响应:
         HTTP/1.1 200 OK
+        ETag: "..."
+        X-Next-Marker: hl-node51
+        X-Unreachable-Hosts: node2
         [
             {
                 "autostart": "no",
@@ -52,9 +126,39 @@ class ListVMs(BaseView):
         ]
         """
         try:
-            lib = LibvirtManager()
-            vms = lib.list_vms()
-            return jsonify(vms), 200
+            args = request.args
+            try:
+                limit, fields = parse_list_params(args)
+            except CustomException as e:
+                return jsonify({"error": e.message}), e.code
+
+            page = fleet_page_vms(host=args.get("host"),
+                                  state=args.get("state"),
+                                  name_prefix=args.get("name"),
+                                  fields=fields,
+                                  limit=limit,
+                                  marker=args.get("marker"))
+
+            if page["version"] is None:
+                # 清单缓存不可用，按内容计算 ETag
+                resp = jsonify(page["vms"])
+                resp.add_etag()
+            else:
+                # 同一缓存版本、同一查询条件的结果相同，命中时不再序列化
+                etag = "%s-%s" % (page["version"], hashlib.md5(
+                    request.query_string).hexdigest()[:8])
+                if etag in request.if_none_match:
+                    resp = Response(status=304)
+                    resp.set_etag(etag)
+                    return resp
+                resp = jsonify(page["vms"])
+                resp.set_etag(etag)
+            if page["next_marker"]:
+                resp.headers["X-Next-Marker"] = page["next_marker"]
+            if page["errors"]:
+                # 部分主机查询失败时返回其余主机的结果
+                resp.headers["X-Unreachable-Hosts"] = ",".join(page["errors"])
+            return resp.make_conditional(request)
         except Exception as e:
             return error_handler(e, "list vms error")
 
@@ -75,9 +179,10 @@ class VMXML(BaseView):
         HTTP/1.1 200 OK
         """
         try:
-            lib = LibvirtManager()
-            vm = lib.get_xml(name)
-            return vm, 200
+            host = locate_vm(name, request.args.get("host"))
+            with LibvirtManager(host=host) as lib:
+                vm = lib.get_xml(name)
+                return vm, 200
         except Exception as e:
             return error_handler(e, "get vm_xml info failed")
 
@@ -119,11 +224,12 @@ class VM(BaseView):
         }
         """
         try:
-            lib = LibvirtManager()
-            vm = lib.get_vm_info(name)
-            if not vm:
-                return jsonify({"error": "not found vm info"}), 400
-            return jsonify(vm), 200
+            host = locate_vm(name, request.args.get("host"))
+            with LibvirtManager(host=host) as lib:
+                vm = lib.get_vm_info(name)
+                if not vm:
+                    return jsonify({"error": "not found vm info"}), 400
+                return jsonify(vm), 200
         except Exception as e:
             return error_handler(e, "get vm info failed")
 
@@ -144,13 +250,24 @@ class VM(BaseView):
             "vcpu": "1",
             "image": "/var/lib/libvirt/images/CentOS-7-x86_64-Minimal-1708.iso",
             "mem": "2",
-            "volume_size": "20"
+            "volume_size": "20",
+            "provision": "overlay",  // 可选，clone 完整复制镜像，overlay 以镜像为 backing file 创建 qcow2 卷
+            "flavor": "default",     // 可选，配置文件中 [flavor:NAME] 定义的规格
+            "host": "node1",         // 可选，libvirt_hosts 中的主机名，不指定时由调度器选择
+            "group": "web",          // 可选，虚拟机所属的组
+            "group_policy": "anti-affinity", // 可选，anti-affinity 或 soft-anti-affinity
+            "cpu_policy": "dedicated"        // 可选，dedicated 每个 vCPU 独占一个隔离 CPU，shared 不独占
         }
 
-        @apiSuccessExample 成功响应: 创建的主机详细信息
-        HTTP/1.1 200 OK
+        @apiSuccessExample 成功响应: 创建任务已提交
+        HTTP/1.1 202 Accepted
         {
-            ...
+            "name": "test",
+            "host": "node1",
+            "numa_node": 0,
+            "cpus": [4, 5],
+            "job": "6f1c8a34-2b1e-4c55-9a43-3c1a2b9f7e10",
+            "location": "/libvirtapi/jobs/6f1c8a34-2b1e-4c55-9a43-3c1a2b9f7e10"
         }
         """
         try:
@@ -176,17 +293,43 @@ class VM(BaseView):
             if not volume_size:
                 return jsonify({"error": "not found param volume_size"}), 400
 
-            lib = LibvirtManager()
-            if float(mem) * 1024 > float(lib.get_free_mem()):
-                return jsonify({"error": "可用内存不足，平台总可用内存 %s MB，当前可用 %s MB" %
-                                         (lib.get_total_mem(), lib.get_free_mem())}), 400
-
-            if int(vcpu) > int(lib.get_free_cpu()):
-                return jsonify({"error": "可用CPU不足，实时CPU总数 %s ，当前可用 %s " %
-                                         (lib.get_total_cpu(), lib.get_free_cpu())}), 400
-
-            vm = lib.create_vm(body)
-            return jsonify(vm), 200
+            if body.get("provision") not in (None, "clone", "overlay"):
+                return jsonify({"error": "incorrect param provision"}), 400
+
+            if body.get("group_policy") not in (None, "anti-affinity",
+                                                "soft-anti-affinity"):
+                return jsonify({"error": "incorrect param group_policy"}), 400
+
+            if body.get("cpu_policy") not in (None, "dedicated", "shared"):
+                return jsonify({"error": "incorrect param cpu_policy"}), 400
+
+            try:
+                FLAVORS.get(body.get("flavor"))
+                if body.get("host"):
+                    HOSTS.get(body.get("host"))
+            except CustomException as e:
+                return jsonify({"error": e.message}), e.code
+
+            # 虚拟机名称在所有主机中唯一，按名称路由
+            if vm_exists(name):
+                return jsonify({"error": "instance %s is exist." % name}), 400
+
+            try:
+                placement = SCHEDULER.schedule(
+                    _request_spec(body, int(vcpu), float(mem)))
+            except CustomException as e:
+                return jsonify({"error": e.message}), e.code
+            body["host"] = placement["host"]
+            body["placement"] = placement["placement"]
+
+            # 创建在后台任务中执行，通过 /libvirtapi/jobs/:id 查询进度
+            job = JOBS.submit("create_vm", name, create_vm_job,
+                              body, placement["reservation"])
+            return jsonify({"name": name, "host": placement["host"],
+                            "numa_node": placement["numa_node"],
+                            "cpus": placement["cpus"],
+                            "job": job.id,
+                            "location": "/libvirtapi/jobs/%s" % job.id}), 202
         except Exception as e:
             return error_handler(e, "create vm info failed")
 
@@ -210,13 +353,159 @@ class VM(BaseView):
             if not name:
                 return jsonify({"error": "not found param name"}), 400
 
-            lib = LibvirtManager()
-            ret = lib.delete(name)
-            return jsonify(ret), 200
+            host = locate_vm(name, request.args.get("host"))
+            with LibvirtManager(host=host) as lib:
+                ret = lib.delete(name)
+                return jsonify(ret), 200
         except Exception as e:
             return error_handler(e, "delete vm info failed")
 
 
+class BatchVM(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def post(self):
+        """
+        @api {post} /libvirtapi/vm/batch 批量创建虚拟机
+        @apiName batch_vm
+        @apiGroup vm
+        @apiSuccess {object} job
+        @apiExample 批量创建虚拟机
+        POST /libvirtapi/vm/batch
+        Content-Type: application/json
+        body:
+        {
+            "template": {
+                "vcpu": "1",
+                "image": "centos7.qcow2",
+                "mem": "2",
+                "volume_size": "20",
+                "provision": "overlay",
+                "flavor": "default",
+                "host": "node1",    // 可选，不指定时由调度器选择
+                "group": "web"      // 可选
+            },
+            "prefix": "web",        // 与 names 二选一，生成 web-1 ... web-N
+            "count": 20,
+            "names": ["web-a", "web-b"],
+            "parallelism": 4,       // 可选，并发克隆数
+            "atomic": false         // 可选，任一失败时回滚整批
+        }
+
+        @apiSuccessExample 成功响应: 批量创建任务已提交，任务结果为每台虚拟机的创建结果
+        HTTP/1.1 202 Accepted
+        {
+            "names": ["web-1", "web-2"],
+            "host": "node1",
+            "job": "6f1c8a34-2b1e-4c55-9a43-3c1a2b9f7e10",
+            "location": "/libvirtapi/jobs/6f1c8a34-2b1e-4c55-9a43-3c1a2b9f7e10"
+        }
+        """
+        try:
+            body = get_body_json()
+
+            template = body.get("template")
+            if not template:
+                return jsonify({"error": "not found param template"}), 400
+            for param in ("vcpu", "image", "mem", "volume_size"):
+                if not template.get(param):
+                    return jsonify({"error": "not found param template.%s" % param}), 400
+            _number_param(template, "vcpu", None, minimum=1)
+            _number_param(template, "mem", None, float, minimum=0)
+            _number_param(template, "volume_size", None, float, minimum=0)
+            if template.get("provision") not in (None, "clone", "overlay"):
+                return jsonify({"error": "incorrect param template.provision"}), 400
+            if template.get("cpu_policy") not in (None, "dedicated", "shared"):
+                return jsonify({"error": "incorrect param template.cpu_policy"}), 400
+            try:
+                FLAVORS.get(template.get("flavor"))
+                if template.get("host"):
+                    HOSTS.get(template.get("host"))
+            except CustomException as e:
+                return jsonify({"error": e.message}), e.code
+
+            names = body.get("names")
+            if not names:
+                prefix = body.get("prefix")
+                count = _number_param(body, "count", 0)
+                if not prefix or count <= 0:
+                    return jsonify({"error": "not found param names or prefix/count"}), 400
+                names = ["%s-%s" % (prefix, i) for i in range(1, count + 1)]
+            if len(set(names)) != len(names):
+                return jsonify({"error": "duplicate names"}), 400
+
+            max_parallelism = CONF.getint("default", "batch_max_parallelism")
+            parallelism = min(_number_param(body, "parallelism",
+                                            max_parallelism, minimum=1),
+                              max_parallelism)
+
+            exists = [name for name in names if vm_exists(name)]
+            if exists:
+                return jsonify({"error": "instance %s is exist." % ", ".join(exists)}), 400
+
+            # 整批放在同一台主机上，一次准入检查，不绑定 NUMA 节点
+            try:
+                spec = _request_spec(
+                    template, int(template["vcpu"]) * len(names),
+                    float(template["mem"]) * len(names), count=len(names))
+                spec.numa = False
+                placement = SCHEDULER.schedule(spec)
+            except CustomException as e:
+                return jsonify({"error": e.message}), e.code
+            template = dict(template, host=placement["host"])
+
+            # 整批占用的独占 CPU 按顺序分给每台虚拟机
+            placements = None
+            if placement["cpus"]:
+                vcpu = int(template["vcpu"])
+                allocator = HOSTS.get(placement["host"]).cpus
+                placements = dict(
+                    (name, allocator.cputune_xml(
+                        placement["cpus"][i * vcpu:(i + 1) * vcpu]))
+                    for i, name in enumerate(names))
+
+            job = JOBS.submit("create_vm_batch", ",".join(names),
+                              create_vm_batch_job, names, template,
+                              parallelism, placement["reservation"],
+                              bool(body.get("atomic")), placements)
+            return jsonify({"names": names, "host": placement["host"],
+                            "job": job.id,
+                            "location": "/libvirtapi/jobs/%s" % job.id}), 202
+        except Exception as e:
+            return error_handler(e, "batch create vm failed")
+
+
+class Flavor(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def get(self):
+        """
+        @api {get} /libvirtapi/flavor 请求虚拟机规格列表
+        @apiName flavors
+        @apiGroup vm
+        @apiSuccess {object} flavor
+        @apiExample 请求虚拟机规格列表
+        GET /libvirtapi/flavor
+        Content-Type: application/json
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        [
+            {
+                "name": "default",
+                "valid": true,
+                "disk_bus": "ide",
+                "video_model": "qxl",
+                "nic_bridge": "br0",
+                ...
+            }
+        ]
+        """
+        try:
+            return jsonify(FLAVORS.list()), 200
+        except Exception as e:
+            return error_handler(e, "list flavors error")
+
+
 class VMAction(BaseView):
     # TODO: 后续开启认证
     # @auth.login_required
@@ -230,18 +519,14 @@ class VMAction(BaseView):
         POST /libvirtapi/vm/test/action
         Content-Type: application/json
         {
-            "action" : action (start, shutdown, reboot, destroy)
+            "action" : action (start, shutdown, reboot, hard_reboot, destroy, suspend, resume),
+            "host": "node1"  // 可选，默认按名称查找所在主机
         }
         @apiSuccessExample 成功响应:
         HTTP/1.1 202 OK
         {}
         """
         try:
-            START = "start"
-            REBOOT = "reboot"
-            SHUTDOWN = "shutdown"
-            DESTROY = "destroy"
-
             if not name:
                 return jsonify({"error": "not found param name"}), 400
 
@@ -250,29 +535,206 @@ class VMAction(BaseView):
 
             if not action:
                 return jsonify({"error": "not found param action"}), 400
+            if action not in POWER_ACTIONS:
+                return jsonify({"error": "incorrect action"}), 400
 
-            lib = LibvirtManager()
-
-            if action == START:
-                LOG.info("%s vm: %s" % (action, name))
-                lib.start(name)
-            elif action == REBOOT:
-                LOG.info("%s vm: %s" % (action, name))
-                # FIXME: soft reboot
-                # lib.reboot(name)
-                lib.hard_reboot(name)
-            elif action == DESTROY:
-                LOG.info("%s vm: %s" % (action, name))
-                lib.destroy(name)
-            elif action == SHUTDOWN:
+            host = locate_vm(name, body.get("host"))
+            with LibvirtManager(host=host) as lib:
                 LOG.info("%s vm: %s" % (action, name))
-                lib.shutdown(name)
-            else:
+                getattr(lib, POWER_ACTIONS[action][0])(name)
+                return jsonify({"name": name}), 202
+        except Exception as e:
+            return error_handler(e, "opertate vm failed")
+
+
+class VMActions(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def post(self):
+        """
+        @api {post} /libvirtapi/vm/actions 批量虚拟机操作
+        @apiName vm_actions
+        @apiGroup vm
+        @apiSuccess {object} job
+        @apiExample 批量虚拟机操作
+        POST /libvirtapi/vm/actions
+        Content-Type: application/json
+        {
+            "names": ["web-1", "web-2"],
+            "action": "shutdown",   // start, shutdown, reboot, hard_reboot, destroy, suspend, resume
+            "host": "node1",        // 可选，默认按名称查找所在主机
+            "parallelism": 8,       // 可选，并发数
+            "wait": true,           // 可选，等待生命周期事件直到到达目标状态
+            "timeout": 300          // 可选，wait 的超时秒数
+        }
+
+        @apiSuccessExample 成功响应: 任务结果为每台虚拟机的操作结果
+        HTTP/1.1 202 Accepted
+        {
+            "names": ["web-1", "web-2"],
+            "job": "6f1c8a34-2b1e-4c55-9a43-3c1a2b9f7e10",
+            "location": "/libvirtapi/jobs/6f1c8a34-2b1e-4c55-9a43-3c1a2b9f7e10"
+        }
+
+        任务结果:
+        [
+            {"name": "web-1", "host": "node1", "action": "shutdown",
+             "status": "done", "state": "Stopped", "error": null},
+            {"name": "web-2", "host": "node1", "action": "shutdown",
+             "status": "timeout", "state": "Running", "error": null}
+        ]
+        """
+        try:
+            body = get_body_json()
+
+            names = body.get("names")
+            if not names or not isinstance(names, list):
+                return jsonify({"error": "not found param names"}), 400
+            if len(set(names)) != len(names):
+                return jsonify({"error": "duplicate names"}), 400
+            action = body.get("action")
+            if not action:
+                return jsonify({"error": "not found param action"}), 400
+            if action not in POWER_ACTIONS:
                 return jsonify({"error": "incorrect action"}), 400
+            host = body.get("host")
+            if host:
+                try:
+                    HOSTS.get(host)
+                except CustomException as e:
+                    return jsonify({"error": e.message}), e.code
+
+            max_parallelism = CONF.getint("default", "vm_action_max_parallelism")
+            parallelism = min(_number_param(body, "parallelism",
+                                            max_parallelism, minimum=1),
+                              max_parallelism)
+            timeout = _number_param(
+                body, "timeout", CONF.getfloat("default", "vm_action_timeout"),
+                float, minimum=0)
+
+            job = JOBS.submit("vm_actions", ",".join(names), vm_actions_job,
+                              names, action, parallelism, host,
+                              bool(body.get("wait")), timeout)
+            return jsonify({"names": names, "job": job.id,
+                            "location": "/libvirtapi/jobs/%s" % job.id}), 202
+        except Exception as e:
+            return error_handler(e, "vm actions failed")
+
 
-            return jsonify({"name": name}), 202
+class ShutdownVMs(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def post(self):
+        """
+        @api {post} /libvirtapi/vm/shutdown 批量正常关机
+        @apiName shutdown_vms
+        @apiGroup vm
+        @apiSuccess {object} job
+        @apiExample 批量正常关机
+        POST /libvirtapi/vm/shutdown
+        Content-Type: application/json
+        {
+            "names": ["web-1", "web-2", "db-1"], // 可选，不指定时关闭 host 上所有运行中的虚拟机
+            "host": "node1",                     // names 为空时必填
+            "priorities": {"db-1": 10},          // 可选，值小的先关机，默认 0
+            "parallelism": 8,                    // 可选，同一优先级的并发数
+            "acpi_timeout": 60,                  // 可选，ACPI 关机等待秒数，0 表示跳过
+            "agent_timeout": 30                  // 可选，guest agent 关机等待秒数，0 表示跳过
+        }
+
+        依次尝试 ACPI 关机、guest agent 关机，超时后强制关机。
+
+        @apiSuccessExample 成功响应: 任务结果为每台虚拟机的关机结果
+        HTTP/1.1 202 Accepted
+        {
+            "names": ["web-1", "web-2", "db-1"],
+            "job": "6f1c8a34-2b1e-4c55-9a43-3c1a2b9f7e10",
+            "location": "/libvirtapi/jobs/6f1c8a34-2b1e-4c55-9a43-3c1a2b9f7e10"
+        }
+
+        任务结果:
+        [
+            {"name": "web-1", "host": "node1", "priority": 0, "status": "done",
+             "method": "acpi", "state": "Stopped", "error": null},
+            {"name": "web-2", "host": "node1", "priority": 0, "status": "done",
+             "method": "destroy", "state": "Stopped", "error": null},
+            {"name": "db-1", "host": "node1", "priority": 10, "status": "done",
+             "method": "agent", "state": "Stopped", "error": null}
+        ]
+        """
+        try:
+            body = get_body_json()
+
+            host = body.get("host")
+            if host:
+                try:
+                    HOSTS.get(host)
+                except CustomException as e:
+                    return jsonify({"error": e.message}), e.code
+            names = body.get("names")
+            if not names:
+                if not host:
+                    return jsonify({"error": "not found param names or host"}), 400
+                with LibvirtManager(host=host) as lib:
+                    names = [vm["name"] for vm in lib.list_vms()
+                             if vm["state"] != "Stopped"]
+            if not isinstance(names, list):
+                return jsonify({"error": "incorrect param names"}), 400
+            if len(set(names)) != len(names):
+                return jsonify({"error": "duplicate names"}), 400
+            priorities = body.get("priorities") or {}
+            if not isinstance(priorities, dict):
+                return jsonify({"error": "incorrect param priorities"}), 400
+            priorities = dict(
+                (name, _number_param(priorities, name, 0))
+                for name in priorities)
+
+            max_parallelism = CONF.getint("default", "vm_action_max_parallelism")
+            parallelism = min(_number_param(body, "parallelism",
+                                            max_parallelism, minimum=1),
+                              max_parallelism)
+            acpi_timeout = _number_param(
+                body, "acpi_timeout",
+                CONF.getfloat("default", "shutdown_acpi_timeout"), float)
+            agent_timeout = _number_param(
+                body, "agent_timeout",
+                CONF.getfloat("default", "shutdown_agent_timeout"), float)
+
+            job = JOBS.submit("shutdown_vms", host or ",".join(names),
+                              shutdown_vms_job, names, host, priorities,
+                              parallelism, acpi_timeout, agent_timeout)
+            return jsonify({"names": names, "job": job.id,
+                            "location": "/libvirtapi/jobs/%s" % job.id}), 202
         except Exception as e:
-            return error_handler(e, "opertate vm failed")
+            return error_handler(e, "shutdown vms failed")
+
+
+class NovncToken(BaseView):
+    # TODO: 后续开启认证
+    # @auth.login_required
+    def get(self, token):
+        """
+        @api {get} /libvirtapi/novnc/:token 查询 novnc token 对应的 VNC 地址
+        @apiName novnc_token
+        @apiGroup vm
+        @apiSuccess {object} target
+        @apiExample 查询 novnc token，供 websockify token 插件使用
+        GET /libvirtapi/novnc/Zk3x9V0qH2cJ1sYv7mQbXw
+        Content-Type: application/json
+        @apiSuccessExample 成功响应:
+        HTTP/1.1 200 OK
+        {
+            "host": "192.168.0.240",
+            "port": "5904"
+        }
+        """
+        try:
+            target = NOVNC.lookup(token)
+            if not target:
+                return jsonify({"error": "not found token"}), 404
+            return jsonify({"host": target[0], "port": target[1]}), 200
+        except Exception as e:
+            return error_handler(e, "get novnc token error")
 
 
 bp.add_url_rule('/libvirtapi/vm', view_func=ListVMs.as_view("list_vms"))
@@ -280,5 +742,13 @@ bp.add_url_rule('/libvirtapi/vm/<string:name>', view_func=VM.as_view("vm"))
 bp.add_url_rule('/libvirtapi/vm/<string:name>/xml',
                 view_func=VMXML.as_view("get_vm_xml"))
 bp.add_url_rule('/libvirtapi/vm', view_func=VM.as_view("create_vm"))
+bp.add_url_rule('/libvirtapi/vm/batch', view_func=BatchVM.as_view("batch_vm"))
+bp.add_url_rule('/libvirtapi/vm/actions',
+                view_func=VMActions.as_view("vm_actions"))
+bp.add_url_rule('/libvirtapi/vm/shutdown',
+                view_func=ShutdownVMs.as_view("shutdown_vms"))
+bp.add_url_rule('/libvirtapi/flavor', view_func=Flavor.as_view("flavors"))
+bp.add_url_rule('/libvirtapi/novnc/<string:token>',
+                view_func=NovncToken.as_view("novnc_token"))
 bp.add_url_rule('/libvirtapi/vm/<string:name>/action',
                 view_func=VMAction.as_view('vm_action'))
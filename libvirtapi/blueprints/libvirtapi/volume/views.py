@@ -28,9 +28,9 @@ class VolumeXML(BaseView):
         HTTP/1.1 200 OK
         """
         try:
-            lib = LibvirtManager()
-            volume = lib.get_volume_xml(name)
-            return volume, 200
+            with LibvirtManager() as lib:
+                volume = lib.get_volume_xml(name)
+                return volume, 200
         except Exception as e:
             return error_handler(e, "get volume_xml info failed")
 
@@ -54,9 +54,9 @@ class VolumeList(BaseView):
         }
         """
         try:
-            lib = LibvirtManager()
-            volumes = lib.list_volumes()
-            return jsonify(volumes), 200
+            with LibvirtManager() as lib:
+                volumes = lib.list_volumes()
+                return jsonify(volumes), 200
         except Exception as e:
             return error_handler(e, "get list_volumes failed")
 
@@ -80,9 +80,10 @@ class Volume(BaseView):
         }
         """
         try:
-            lib = LibvirtManager()
-            volume = lib.volume_info(name)
-            return jsonify(volume), 200
+            with LibvirtManager() as lib:
+                lib.inventory.sync(lib)
+                volume = lib.volume_info(name)
+                return jsonify(volume), 200
         except Exception as e:
             return error_handler(e, "get list_volumes failed")
 
@@ -120,9 +121,9 @@ class Volume(BaseView):
             if not size:
                 return jsonify({"error": "not found param size"}), 400
 
-            lib = LibvirtManager()
-            volume = lib.create_volume(name + ".qcow2", "", size)
-            return jsonify(volume), 200
+            with LibvirtManager() as lib:
+                volume = lib.create_volume(name + ".qcow2", "", size)
+                return jsonify(volume), 200
         except Exception as e:
             return error_handler(e, "create volume info failed")
 
@@ -144,9 +145,9 @@ class Volume(BaseView):
         }
         """
         try:
-            lib = LibvirtManager()
-            result = lib.delete_volume(name + '.qcow2')
-            return jsonify({'message': result}), 200
+            with LibvirtManager() as lib:
+                result = lib.delete_volume(name + '.qcow2')
+                return jsonify({'message': result}), 200
         except Exception as e:
             return error_handler(e, "delete volume info failed")
 
@@ -17,10 +17,55 @@ DEFAULT_CONFIG = {
         "logfile_size": "100",
         "logfile_backup_count": "5",
         "libvirt_url": "qemu+tcp://192.168.0.234/system",
+        "libvirt_hosts": "",
+        "fleet_timeout": "30",
         "auth_name": "libvirtapi",
         "auth_uuid": "2c47df88-2f34-49f0-a8f9-471f33116e2b",
         "available_cpu": "4",
-        "libvirtapi_ip": "192.168.0.129"
+        "libvirtapi_ip": "192.168.0.129",
+        "resource_reconcile_interval": "300",
+        "libvirt_pool_size": "8",
+        "libvirt_pool_timeout": "30",
+        "libvirt_keepalive_interval": "5",
+        "libvirt_keepalive_count": "3",
+        "libvirt_health_check_interval": "30",
+        "job_workers": "4",
+        "job_history_size": "200",
+        "batch_max_parallelism": "8",
+        "vm_action_max_parallelism": "16",
+        "vm_action_timeout": "300",
+        "shutdown_acpi_timeout": "60",
+        "shutdown_agent_timeout": "30",
+        "provision_mode": "clone",
+        "event_queue_size": "1000",
+        "event_keepalive_interval": "15",
+        "metrics_interval": "10",
+        "metrics_history": "360",
+        "prometheus_interval": "15",
+        "rpc_trace": "True",
+        "rpc_trace_history": "100",
+        "rpc_trace_log_threshold": "100",
+        "scheduler_filters": "HostFilter,RamFilter,HugePagesFilter,"
+                             "CoreFilter,DiskFilter,PinningFilter,"
+                             "NUMAFilter,AntiAffinityFilter",
+        "scheduler_weighers": "RamWeigher:1.0,CpuWeigher:0.5,DiskWeigher:0.2,"
+                              "NUMAWeigher:1.0,SoftAntiAffinityWeigher:2.0",
+        "cpu_allocation_ratio": "0",
+        "numa_placement": "prefer",
+        "scheduler_refresh_interval": "60",
+        "isolated_cpus": "",
+        "emulator_cpus": "",
+        "cpu_policy": "dedicated",
+        "libvirt_offload": "True",
+        "libvirt_offload_threads": "20",
+        "libvirt_call_timeout": "60",
+        "libvirt_call_timeouts": "checkout:0,createXMLFrom:3600,"
+                                 "wipe:3600,wipePattern:3600,"
+                                 "create:300,createXML:300,"
+                                 "recvFlags:600,send:600",
+        "asgi_port": "8779",
+        "asgi_workers": "32",
+        "novnc_token_file": "/var/lib/libvirtapi/novnc-token.conf"
     }
 }
 
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import threading
+import time
+
+import eventlet
+import libvirt
+from libvirt import libvirtError
+
+from libvirtapi import config as cfg
+from libvirtapi.exs import CustomException
+from libvirtapi.libvirtoperations.inventory import start_event_loop
+from libvirtapi.libvirtoperations.offload import CallTimeout
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+# 出现以下错误时认为连接已不可用，归还时直接丢弃
+CONNECTION_ERRORS = frozenset([
+    libvirt.VIR_ERR_INVALID_CONN,
+    libvirt.VIR_ERR_SYSTEM_ERROR,
+    libvirt.VIR_ERR_RPC,
+    libvirt.VIR_ERR_NO_CONNECT,
+])
+
+
+def is_connection_error(e):
+    # 超时的调用仍在原生线程中使用该连接
+    if isinstance(e, CallTimeout):
+        return True
+    return isinstance(e, libvirtError) and \
+        e.get_error_code() in CONNECTION_ERRORS
+
+
+class PoolExhaustedError(CustomException):
+    def __init__(self, message, code=503):
+        super().__init__(message, code)
+
+
+class ConnectionPool():
+    """
+    libvirt 连接池，一个 URI 对应一个连接池。
+
+    conn = pool.checkout()
+    try:
+        ...
+    finally:
+        pool.checkin(conn)
+
+    借出时不做 isAlive 检查，连接健康由 health_check 在后台线程中完成；
+    使用中出现连接类错误的连接在归还时丢弃。
+
+    丢弃的连接在后台线程中关闭：close 是一次 RPC，对端挂起时会阻塞，
+    不能在归还连接的 wsgi 线程中执行；调用超时的连接还在原生线程中使用，
+    要等这些调用返回后才能关闭。
+    """
+
+    def __init__(self, uri, size=8, timeout=30,
+                 keepalive_interval=5, keepalive_count=3):
+        self.uri = uri
+        self.size = size
+        self.timeout = timeout
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+
+        self._cond = threading.Condition()
+        self._idle = collections.deque()
+        self._opened = 0
+        self._in_use = 0
+        self._waiting = 0
+
+        self.checkouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.created = 0
+        self.discarded = 0
+
+    def _open(self):
+        # keepalive 依赖事件循环
+        start_event_loop()
+        conn = libvirt.open(self.uri)
+        if self.keepalive_interval > 0:
+            try:
+                conn.setKeepAlive(self.keepalive_interval,
+                                  self.keepalive_count)
+            except libvirtError as e:
+                # 本地驱动(如 test:///) 不支持 keepalive
+                LOG.debug("setKeepAlive unsupported on %s: %s" % (self.uri, e))
+        return conn
+
+    def checkout(self):
+        """
+        没有空闲连接且已达上限时等待归还，超过 timeout 抛出 PoolExhaustedError。
+        原生线程在条件变量上等待；wsgi 所在的主线程不能阻塞在原生锁上，
+        否则整个 hub 停住，持有连接的绿色线程也无法归还，改为让出后重试。
+        """
+        start = time.time()
+        on_hub = threading.current_thread() is threading.main_thread()
+        delay = 0.001
+        with self._cond:
+            self._waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    if self._idle or self._opened < self.size:
+                        conn = self._idle.pop() if self._idle else None
+                        if conn is None:
+                            # 先占位，在锁外建立连接
+                            self._opened += 1
+                        self._in_use += 1
+                        break
+                    remaining = self.timeout - (time.time() - start)
+                    if remaining <= 0:
+                        raise PoolExhaustedError(
+                            "libvirt connection pool for %s exhausted "
+                            "(size %s)" % (self.uri, self.size))
+                    if not on_hub:
+                        self._cond.wait(remaining)
+                        continue
+                eventlet.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
+        finally:
+            with self._cond:
+                self._waiting -= 1
+
+        if conn is None:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._opened -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self.created += 1
+
+        waited = time.time() - start
+        with self._cond:
+            self.checkouts += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+        return conn
+
+    def checkin(self, conn, broken=False, pending=()):
+        """
+        pending 为超时后仍在执行的调用(threading.Event 列表)，不为空时丢弃连接
+        """
+        broken = broken or bool(pending)
+        with self._cond:
+            self._in_use -= 1
+            if broken:
+                self._opened -= 1
+                self.discarded += 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+        if broken:
+            thread = threading.Thread(
+                target=_close_connection, args=(conn, pending),
+                name="libvirt-close")
+            thread.daemon = True
+            thread.start()
+
+    def health_check(self):
+        """
+        检查空闲连接，丢弃失效连接。在后台线程中调用，不占用请求路径。
+        """
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._in_use += len(idle)
+
+        for conn in idle:
+            try:
+                alive = conn.isAlive()
+            except libvirtError:
+                alive = False
+            if not alive:
+                LOG.warning("drop dead libvirt connection to %s" % self.uri)
+            self.checkin(conn, broken=not alive)
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "uri": self.uri,
+                "size": self.size,
+                "opened": self._opened,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": self.checkouts,
+                "created": self.created,
+                "discarded": self.discarded,
+                "wait_time_total": round(self.wait_time_total, 6),
+                "wait_time_avg": round(
+                    self.wait_time_total / self.checkouts, 6)
+                if self.checkouts else 0,
+                "wait_time_max": round(self.wait_time_max, 6)}
+
+
+def _close_connection(conn, pending):
+    for event in pending:
+        event.wait()
+    try:
+        conn.close()
+    except libvirtError as e:
+        LOG.debug(e)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_health_thread = None
+
+
+def get_connection_pool(uri=None):
+    uri = uri or CONF.get("default", "libvirt_url")
+    with _pools_lock:
+        pool = _pools.get(uri)
+        if pool is None:
+            pool = ConnectionPool(
+                uri,
+                size=CONF.getint("default", "libvirt_pool_size"),
+                timeout=CONF.getfloat("default", "libvirt_pool_timeout"),
+                keepalive_interval=CONF.getint(
+                    "default", "libvirt_keepalive_interval"),
+                keepalive_count=CONF.getint(
+                    "default", "libvirt_keepalive_count"))
+            _pools[uri] = pool
+        return pool
+
+
+def list_connection_pools():
+    with _pools_lock:
+        return list(_pools.values())
+
+
+def _health_check_loop(interval):
+    while True:
+        time.sleep(interval)
+        for pool in list_connection_pools():
+            try:
+                pool.health_check()
+            except Exception as e:
+                LOG.warning("health check %s failed: %s" % (pool.uri, e))
+
+
+def start_health_checker(interval):
+    global _health_thread
+    if interval <= 0 or _health_thread is not None:
+        return
+    _health_thread = threading.Thread(
+        target=_health_check_loop, args=(interval,),
+        name="libvirt-health-check")
+    _health_thread.daemon = True
+    _health_thread.start()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+from libvirtapi.libvirtoperations.domainxml import format_cpuset, parse_cpuset
+from libvirtapi.libvirtoperations.inventory import INVENTORY
+
+LOG = logging.getLogger(__name__)
+
+
+class CpuAllocator():
+    """
+    隔离 CPU 的独占分配表。
+
+    isolated_cpus 中的物理 CPU 只分配给一台虚拟机，每个 vCPU 绑定一个物理 CPU。
+    作为 DomainInventory 的监听者，按虚拟机 XML 中的 vcpupin/emulatorpin 记账，
+    虚拟机删除后自动释放，服务重启后由全量同步重建，不需要单独持久化。
+
+    创建中的虚拟机先用 claim 占用，虚拟机出现在 inventory 之后再 unclaim。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.isolated = frozenset()
+        self.emulator = []  # emulatorpin 使用的物理 CPU，为空时与 vCPU 共用
+        self._domains = {}  # uuid -> (vm name, set(cpu))
+        self._owners = {}  # cpu -> vm name
+        self._claims = {}  # key -> [cpu]
+
+    def configure(self, isolated, emulator=""):
+        with self._lock:
+            self.isolated = frozenset(parse_cpuset(isolated))
+            self.emulator = parse_cpuset(emulator)
+
+    @property
+    def enabled(self):
+        return bool(self.isolated)
+
+    def __call__(self, old, new):
+        with self._lock:
+            if old:
+                self._release(old["uuid"])
+            if new:
+                cpus = self.isolated.intersection(new.get("pinned_cpus") or ())
+                if cpus:
+                    self._assign(new["uuid"], new["name"], cpus)
+
+    def _assign(self, uuid, name, cpus):
+        for cpu in cpus:
+            owner = self._owners.get(cpu)
+            if owner and owner != name:
+                LOG.warning("cpu %s pinned by both %s and %s" %
+                            (cpu, owner, name))
+            self._owners[cpu] = name
+        self._domains[uuid] = (name, cpus)
+
+    def _release(self, uuid):
+        name, cpus = self._domains.pop(uuid, (None, ()))
+        for cpu in cpus:
+            if self._owners.get(cpu) == name:
+                del self._owners[cpu]
+
+    def _free(self):
+        claimed = set()
+        for cpus in self._claims.values():
+            claimed.update(cpus)
+        return sorted(self.isolated.difference(self._owners, claimed))
+
+    def free(self):
+        with self._lock:
+            return self._free()
+
+    def claim(self, key, count, prefer=()):
+        """
+        占用 count 个空闲的隔离 CPU，优先使用 prefer 中的 CPU（同一 NUMA 节点），
+        空闲数量不足时返回 None
+        """
+        prefer = set(prefer)
+        with self._lock:
+            free = self._free()
+            if len(free) < count:
+                return None
+            free.sort(key=lambda cpu: (cpu not in prefer, cpu))
+            cpus = sorted(free[:count])
+            self._claims[key] = cpus
+            return cpus
+
+    def unclaim(self, key):
+        with self._lock:
+            self._claims.pop(key, None)
+
+    def cputune_xml(self, cpus):
+        """
+        vCPU i 绑定 cpus[i]，emulator 线程绑定 emulator_cpus 或虚拟机自己的 CPU
+        """
+        pins = "".join("<vcpupin vcpu='%d' cpuset='%d'/>" % (vcpu, cpu)
+                       for vcpu, cpu in enumerate(cpus))
+        return "<cputune>%s<emulatorpin cpuset='%s'/></cputune>" % (
+            pins, format_cpuset(self.emulator or cpus))
+
+    def to_dict(self):
+        with self._lock:
+            return {"isolated": format_cpuset(self.isolated),
+                    "emulator": format_cpuset(self.emulator),
+                    "free": format_cpuset(self._free()),
+                    "pinned": dict((name, format_cpuset(cpus))
+                                   for name, cpus in self._domains.values())}
+
+
+CPUS = CpuAllocator()
+INVENTORY.add_listener(CPUS)
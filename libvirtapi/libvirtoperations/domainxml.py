@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import os
+import xml.etree.ElementTree as ET
+
+
+def parse_cpuset(cpuset):
+    """
+    "0-3,^2,8" -> [0, 1, 3, 8]
+    """
+    cpus = set()
+    excluded = set()
+    for item in (cpuset or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        target = cpus
+        if item.startswith("^"):
+            target = excluded
+            item = item[1:]
+        start, _, end = item.partition("-")
+        target.update(range(int(start), int(end or start) + 1))
+    return sorted(cpus - excluded)
+
+
+def format_cpuset(cpus):
+    """
+    [0, 1, 2, 3, 8] -> "0-3,8"
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else "%d-%d" % (a, b)
+                    for a, b in ranges)
+
+
+class DomainXML():
+    """
+    虚拟机 XML 解析结果，一次 XMLDesc、一次解析，供各个查询方法共享。
+
+    doc = DomainXML(dom.XMLDesc(0))
+    doc.disks()     -> [{"name": "test.qcow2", "file": "...", "dev": "hda"}]
+    doc.graphics()  -> [{"type": "vnc", "port": "5900", ...}]
+    doc.metadata()  -> {"createDate": "2019-11-11 11:11:11"}
+    doc.vcpupins()  -> [{"vcpu": "0", "cpuset": "2"}]
+    doc.numa_nodeset() -> "0"
+    doc.pinned_cpus() -> [2, 3]
+    doc.hugepage_size() -> 2048
+    """
+
+    def __init__(self, xml):
+        self.root = ET.fromstring(xml)
+
+    @classmethod
+    def from_dom(cls, dom):
+        return cls(dom.XMLDesc(0))
+
+    def _text(self, path, default=None):
+        node = self.root.find(path)
+        if node is None or node.text is None:
+            return default
+        return node.text
+
+    @property
+    def name(self):
+        return self._text("name")
+
+    @property
+    def uuid(self):
+        return self._text("uuid")
+
+    @property
+    def description(self):
+        return self._text("description")
+
+    def vcpus(self):
+        node = self.root.find("vcpu")
+        if node is None:
+            return 0
+        return int(node.get("current", node.text))
+
+    def current_memory(self):
+        # libvirt 输出的单位固定为 KiB
+        node = self.root.find("currentMemory")
+        if node is None:
+            node = self.root.find("memory")
+        return int(node.text) if node is not None else 0
+
+    def metadata(self):
+        node = self.root.find("metadata")
+        if node is None:
+            return {}
+        return dict(node.attrib)
+
+    def disks(self, device="disk"):
+        disks = []
+        for disk in self.root.iterfind("devices/disk"):
+            if disk.get("device") != device:
+                continue
+            source = disk.find("source")
+            target = disk.find("target")
+            if source is None or source.get("file") is None:
+                continue
+            path = source.get("file")
+            disks.append({"name": os.path.basename(path),
+                          "file": path,
+                          "dev": target.get("dev") if target is not None else ""})
+        return disks
+
+    def graphics(self, graphics_type=None):
+        return [dict(node.attrib)
+                for node in self.root.iterfind("devices/graphics")
+                if graphics_type is None or node.get("type") == graphics_type]
+
+    def vcpupins(self):
+        return [dict(node.attrib)
+                for node in self.root.iterfind("cputune/vcpupin")]
+
+    def numa_nodeset(self):
+        node = self.root.find("numatune/memory")
+        if node is None:
+            return None
+        return node.get("nodeset")
+
+    def pinned_cpus(self):
+        """
+        vcpupin 和 emulatorpin 绑定的所有物理 CPU
+        """
+        cpus = set()
+        for node in self.root.iterfind("cputune/vcpupin"):
+            cpus.update(parse_cpuset(node.get("cpuset")))
+        node = self.root.find("cputune/emulatorpin")
+        if node is not None:
+            cpus.update(parse_cpuset(node.get("cpuset")))
+        return sorted(cpus)
+
+    def hugepage_size(self):
+        """
+        memoryBacking 使用的大页大小(KiB)，未使用大页时返回 None
+        """
+        hugepages = self.root.find("memoryBacking/hugepages")
+        if hugepages is None:
+            return None
+        page = hugepages.find("page")
+        if page is None:
+            # 未指定大小时使用主机默认大页大小，通常为 2M
+            return 2048
+        size = int(page.get("size"))
+        unit = (page.get("unit") or "KiB").lower()
+        return int(size * {"b": 1 / 1024, "bytes": 1 / 1024, "k": 1, "kib": 1,
+                           "m": 1024, "mib": 1024, "g": 1024 ** 2,
+                           "gib": 1024 ** 2}.get(unit, 1))
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import collections
+import itertools
+import logging
+import threading
+import time
+
+from libvirtapi.libvirtoperations.inventory import INVENTORY
+from libvirtapi.libvirtoperations.ledger import LEDGER
+
+LOG = logging.getLogger(__name__)
+
+# 推送给订阅者的虚拟机字段，其余字段变化不推送
+VM_EVENT_FIELDS = ("name", "uuid", "id", "state", "cpu", "mem", "autostart")
+
+
+def vm_summary(info):
+    summary = dict((field, info.get(field)) for field in VM_EVENT_FIELDS)
+    # 所在主机名，见 get_host_info
+    summary["host"] = (info.get("host") or {}).get("name")
+    return summary
+
+
+class Subscriber():
+    """
+    单个订阅者的有界队列。消费过慢导致队列溢出时丢弃积压的事件，
+    并标记 overflowed，由消费方通知客户端重新拉取全量数据。
+    """
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self.queue = collections.deque()
+        self.overflowed = False
+        self.dropped = 0
+
+    def put(self, event):
+        if len(self.queue) >= self.maxlen:
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self.overflowed = True
+        self.queue.append(event)
+
+    def drain(self):
+        events = []
+        while self.queue:
+            try:
+                events.append(self.queue.popleft())
+            except IndexError:
+                break
+        return events
+
+
+class EventBroker():
+    """
+    虚拟机状态和资源变化的广播。
+
+    作为 DomainInventory 的监听者，由同一个 libvirt 事件订阅驱动，
+    把变化扇出到每个订阅者的有界队列：
+        vm:        {"action": "added|changed|removed", "vm": {...}}
+        resources: {"vcpus": ..., "memory": ..., ...}
+    全量同步时 inventory 会对未变化的虚拟机重复通知，只推送摘要字段有变化的。
+    """
+
+    def __init__(self, queue_size=1000):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self._resources = None
+        self._ledgers = [LEDGER]
+        self.queue_size = queue_size
+
+    def __call__(self, old, new):
+        if old and new:
+            before, after = vm_summary(old), vm_summary(new)
+            if before != after:
+                self.publish("vm", {"action": "changed", "vm": after})
+        elif new:
+            self.publish("vm", {"action": "added", "vm": vm_summary(new)})
+        elif old:
+            self.publish("vm", {"action": "removed", "vm": vm_summary(old)})
+        self.publish_resources()
+
+    def add_ledger(self, ledger):
+        # 多主机时 resources 事件为所有主机之和
+        self._ledgers.append(ledger)
+
+    def resources(self):
+        # 内存单位为 MiB
+        ledgers = list(self._ledgers)
+        return {"vcpus": sum(l.vcpus for l in ledgers),
+                "memory": sum(l.memory for l in ledgers),
+                "reserved_vcpus": sum(l.reserved_vcpus for l in ledgers),
+                "reserved_memory": sum(l.reserved_memory for l in ledgers),
+                "running": sum(l.running() for l in ledgers)}
+
+    def publish_resources(self):
+        res = self.resources()
+        with self._lock:
+            if res == self._resources:
+                return
+            self._resources = res
+        self.publish("resources", res)
+
+    def publish(self, event, data):
+        with self._lock:
+            item = (next(self._ids), event, data)
+            for sub in self._subscribers:
+                sub.put(item)
+
+    def subscribe(self):
+        sub = Subscriber(self.queue_size)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    @property
+    def subscribers(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+BROKER = EventBroker()
+INVENTORY.add_listener(BROKER)
+
+_publisher_thread = None
+
+
+def _publish_loop(managers_factory, interval):
+    while True:
+        INVENTORY.changed.wait(interval)
+        INVENTORY.changed.clear()
+        if not BROKER.subscribers:
+            continue
+        failed = False
+        # 事件回调只标记脏数据，这里刷新后由监听者推送变化
+        for lib in managers_factory():
+            try:
+                with lib:
+                    lib.inventory.sync(lib)
+            except Exception as e:
+                LOG.warning("publish inventory events of %s failed: %s"
+                            % (lib.uri, e))
+                failed = True
+        BROKER.publish_resources()
+        if failed:
+            time.sleep(interval)
+
+
+def start_publisher(managers_factory, interval=5):
+    """
+    启动推送线程：libvirt 事件到达后立即刷新各主机的 inventory，
+    没有事件时每 interval 秒检查一次预留资源的变化。
+    managers_factory() 返回每台主机的 LibvirtManager。
+    """
+    global _publisher_thread
+    if _publisher_thread is not None:
+        return
+    _publisher_thread = threading.Thread(
+        target=_publish_loop, args=(managers_factory, interval),
+        name="event-publisher")
+    _publisher_thread.daemon = True
+    _publisher_thread.start()
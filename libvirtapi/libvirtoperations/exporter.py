@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import threading
+import time
+
+from libvirtapi.libvirtoperations.metrics import COLLECTOR
+from libvirtapi.utils.prometheus import REQUEST_LATENCY, metric
+
+LOG = logging.getLogger(__name__)
+
+# 导出的存储池
+EXPORT_POOLS = ("default", "images")
+
+# 样本字段 -> (指标名, 类型, 说明, 换算系数)
+DOMAIN_COUNTERS = (
+    ("cpu_time", "libvirtapi_domain_cpu_seconds_total", "counter",
+     "Domain CPU time", 1e-9),
+    ("rd_bytes", "libvirtapi_domain_block_read_bytes_total", "counter",
+     "Domain block bytes read", 1),
+    ("wr_bytes", "libvirtapi_domain_block_write_bytes_total", "counter",
+     "Domain block bytes written", 1),
+    ("rd_reqs", "libvirtapi_domain_block_read_requests_total", "counter",
+     "Domain block read requests", 1),
+    ("wr_reqs", "libvirtapi_domain_block_write_requests_total", "counter",
+     "Domain block write requests", 1),
+    ("rx_bytes", "libvirtapi_domain_net_receive_bytes_total", "counter",
+     "Domain network bytes received", 1),
+    ("tx_bytes", "libvirtapi_domain_net_transmit_bytes_total", "counter",
+     "Domain network bytes transmitted", 1),
+    ("rx_pkts", "libvirtapi_domain_net_receive_packets_total", "counter",
+     "Domain network packets received", 1),
+    ("tx_pkts", "libvirtapi_domain_net_transmit_packets_total", "counter",
+     "Domain network packets transmitted", 1),
+    ("balloon_rss", "libvirtapi_domain_memory_rss_bytes", "gauge",
+     "Domain resident memory", 1024),
+)
+
+
+class SnapshotExporter():
+    """
+    Prometheus 指标快照。
+
+    后台线程周期性调用 refresh 生成每台主机的主机、存储池、虚拟机指标文本，
+    每个序列带 host 标签；抓取时只拼接快照和请求耗时直方图，
+    抓取开销与抓取频率无关。
+    虚拟机计数器取自 MetricsCollector 的最近一次采样，不额外发起 RPC。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._text = ""
+        self.updated = 0
+        self.duration = 0
+        self.errors = 0
+
+    def collect(self, lib):
+        """
+        返回一台主机的 [(指标名, 类型, 说明, [(labels, value)])]
+        """
+        name = lib.host.name
+        inventory, ledger = lib.inventory, lib.ledger
+        series = []
+        host = lib.get_host_info()
+        series.append(("libvirtapi_host_cpus", "gauge",
+                       "Host logical cpus",
+                       [({"host": name}, host["cpus"])]))
+        series.append(("libvirtapi_host_cpu_mhz", "gauge",
+                       "Host cpu frequency",
+                       [({"host": name}, host["cpumhz"])]))
+        series.append(("libvirtapi_host_numa_nodes", "gauge",
+                       "Host NUMA nodes",
+                       [({"host": name}, host["numanodes"])]))
+        series.append(("libvirtapi_host_memory_bytes", "gauge",
+                       "Host physical memory",
+                       [({"host": name}, host["phymemory"])]))
+        series.append(("libvirtapi_allocatable_vcpus", "gauge",
+                       "vCPUs available to VMs",
+                       [({"host": name}, lib.get_total_cpu())]))
+        series.append(("libvirtapi_allocatable_memory_bytes", "gauge",
+                       "Memory available to VMs",
+                       [({"host": name},
+                         lib.get_total_mem() * 1024 * 1024)]))
+
+        inventory.sync(lib)
+        series.append(("libvirtapi_allocated_vcpus", "gauge",
+                       "vCPUs used by running VMs and pending creations",
+                       [({"host": name, "kind": "running"}, ledger.vcpus),
+                        ({"host": name, "kind": "reserved"},
+                         ledger.reserved_vcpus)]))
+        series.append(("libvirtapi_allocated_memory_bytes", "gauge",
+                       "Memory used by running VMs and pending creations",
+                       [({"host": name, "kind": "running"},
+                         int(ledger.memory * 1024 * 1024)),
+                        ({"host": name, "kind": "reserved"},
+                         int(ledger.reserved_memory * 1024 * 1024))]))
+
+        pools = []
+        for pool_name in EXPORT_POOLS:
+            pool = lib.get_pool(pool_name)
+            if pool is not None:
+                pools.append((pool_name, pool.info()))
+        for index, suffix, doc in ((1, "capacity", "Storage pool capacity"),
+                                   (2, "allocation", "Storage pool allocation"),
+                                   (3, "available", "Storage pool free space")):
+            series.append(("libvirtapi_pool_%s_bytes" % suffix, "gauge", doc,
+                           [({"host": name, "pool": pool_name}, info[index])
+                            for pool_name, info in pools]))
+
+        vms = sorted(inventory.list(), key=lambda vm: vm["name"])
+        series.append(("libvirtapi_domain_info", "gauge",
+                       "Domain state, value is always 1",
+                       [({"host": name, "name": vm["name"], "uuid": vm["uuid"],
+                          "state": vm["state"]}, 1) for vm in vms]))
+        series.append(("libvirtapi_domain_vcpus", "gauge", "Domain vCPUs",
+                       [({"host": name, "name": vm["name"]}, vm["cpu"])
+                        for vm in vms]))
+        series.append(("libvirtapi_domain_memory_bytes", "gauge",
+                       "Domain current memory",
+                       [({"host": name, "name": vm["name"]}, vm["mem"])
+                        for vm in vms]))
+
+        samples = sorted(COLLECTOR.latest(name).items())
+        for field, metric_name, kind, doc, scale in DOMAIN_COUNTERS:
+            series.append((metric_name, kind, doc,
+                           [({"host": name, "name": vm},
+                             round(sample[field] * scale, 6))
+                            for vm, sample in samples if sample]))
+        return series
+
+    def refresh(self, libs):
+        """
+        libs 为每台主机的 LibvirtManager，某台主机失败时跳过该主机，
+        其他主机的指标照常导出
+        """
+        start = time.time()
+        merged = collections.OrderedDict()
+        for lib in libs:
+            try:
+                with lib:
+                    series = self.collect(lib)
+            except Exception as e:
+                self.errors += 1
+                LOG.warning("refresh prometheus snapshot of %s failed: %s"
+                            % (lib.uri, e))
+                continue
+            for name, kind, doc, samples in series:
+                merged.setdefault((name, kind, doc), []).extend(samples)
+
+        lines = []
+        for (name, kind, doc), samples in merged.items():
+            metric(lines, name, kind, doc, samples)
+
+        with self._lock:
+            self._text = "\n".join(lines)
+            self.updated = time.time()
+            self.duration = self.updated - start
+
+    def render(self):
+        with self._lock:
+            lines = [self._text] if self._text else []
+            updated, duration, errors = \
+                self.updated, self.duration, self.errors
+        metric(lines, "libvirtapi_exporter_snapshot_age_seconds", "gauge",
+               "Seconds since the last snapshot refresh",
+               [({}, round(time.time() - updated, 3) if updated else -1)])
+        metric(lines, "libvirtapi_exporter_snapshot_duration_seconds",
+               "gauge", "Duration of the last snapshot refresh",
+               [({}, round(duration, 6))])
+        metric(lines, "libvirtapi_exporter_snapshot_errors_total", "counter",
+               "Failed snapshot refreshes", [({}, errors)])
+        REQUEST_LATENCY.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+EXPORTER = SnapshotExporter()
+
+_exporter_thread = None
+
+
+def _refresh_loop(managers_factory, interval):
+    while True:
+        try:
+            EXPORTER.refresh(managers_factory())
+        except Exception as e:
+            EXPORTER.errors += 1
+            LOG.warning("refresh prometheus snapshot failed: %s" % e)
+        time.sleep(interval)
+
+
+def start_exporter(managers_factory, interval):
+    """
+    启动快照刷新线程，每 interval 秒刷新一次。interval <= 0 时不启动，
+    /metrics 只输出请求耗时。
+    managers_factory() 返回每台主机的 LibvirtManager。
+    """
+    global _exporter_thread
+    if interval <= 0 or _exporter_thread is not None:
+        return
+    _exporter_thread = threading.Thread(
+        target=_refresh_loop, args=(managers_factory, interval),
+        name="prometheus-exporter")
+    _exporter_thread.daemon = True
+    _exporter_thread.start()
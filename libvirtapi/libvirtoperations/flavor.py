@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+import logging
+import string
+import xml.etree.ElementTree as ET
+from xml.etree.ElementTree import Element, SubElement
+from xml.sax.saxutils import escape
+
+from libvirtapi import config as cfg
+from libvirtapi.exs import CustomException
+from libvirtapi.libvirtoperations.hugepages import PAGE_SIZES
+from libvirtapi.libvirtoperations.osxml import OSXML
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+FLAVOR_SECTION_PREFIX = "flavor:"
+
+# 配置文件中 [flavor:NAME] 段可覆盖的选项及默认值，默认值即原有的虚拟机定义
+FLAVOR_DEFAULTS = {
+    "arch": "x86_64",
+    "machine": "",
+    "emulator": "/usr/bin/qemu-system-x86_64",
+    "disk_bus": "ide",
+    "cdrom_bus": "ide",
+    "nic_model": "virtio",
+    "nic_bridge": "br0",
+    "video_model": "qxl",
+    "graphics": "vnc",
+    "sound_model": "ich6",
+    # 大页内存，2M 或 1G，为空时不使用；memory_locked 锁定内存不换出
+    "hugepages": "",
+    "memory_locked": "no",
+}
+
+# 磁盘总线对应的设备名前缀
+DISK_DEV_PREFIX = {"ide": "hd", "sata": "sd", "scsi": "sd", "virtio": "vd",
+                   "usb": "sd"}
+
+# 每台虚拟机需要填充的字段，模板中以 ${slot} 表示
+SLOTS = ("name", "uuid", "description", "create_date", "group", "mem",
+         "vcpu", "mac", "boot", "image", "placement")
+# 原样插入的 XML 片段，不做转义
+RAW_SLOTS = frozenset(["placement"])
+
+
+def _slot(name):
+    return "${%s}" % name
+
+
+class Flavor():
+    """
+    虚拟机规格模板。
+
+    加载时根据规格选项生成一次完整的 domain XML 并序列化为字符串模板，
+    创建虚拟机时只做字段替换，不再逐个构造 Element。
+
+    flavor = Flavor("default", {"disk_bus": "virtio"})
+    xml = flavor.render(name="test", uuid="...", ...)
+    """
+
+    def __init__(self, name, options=None):
+        self.name = name
+        self.options = dict(FLAVOR_DEFAULTS)
+        self.options.update(options or {})
+        errors = self._check_options()
+        if errors:
+            LOG.error("flavor %s is invalid: %s" % (name, "; ".join(errors)))
+        self.valid = not errors
+        self.template = string.Template(
+            ET.tostring(self._build(), encoding="unicode").replace(
+                "<!--%s-->" % _slot("placement"), _slot("placement")))
+
+    def _check_options(self):
+        errors = []
+        if self.options["hugepages"] and \
+                self.options["hugepages"] not in PAGE_SIZES:
+            errors.append("hugepages %s not in %s" % (
+                self.options["hugepages"], sorted(PAGE_SIZES)))
+        return errors
+
+    def _build(self):
+        opt = self.options
+        domain = Element('domain', attrib={
+            'type': 'kvm', 'xmlns:qemu': 'http://libvirt.org/schemas/domain/qemu/1.0'})
+        SubElement(domain, 'name').text = _slot("name")
+        SubElement(domain, 'uuid').text = _slot("uuid")
+        SubElement(domain, 'description').text = _slot("description")
+        SubElement(domain, 'metadata', attrib={
+            'createDate': _slot("create_date"), 'group': _slot("group")})
+        SubElement(domain, 'memory', attrib={'unit': 'GiB'}).text = _slot("mem")
+        SubElement(domain, 'currentMemory', attrib={
+            'unit': 'GiB'}).text = _slot("mem")
+        if opt["hugepages"] in PAGE_SIZES or opt["memory_locked"] == "yes":
+            backing = SubElement(domain, 'memoryBacking')
+            if opt["hugepages"] in PAGE_SIZES:
+                hugepages = SubElement(backing, 'hugepages')
+                SubElement(hugepages, 'page', attrib={
+                    'size': str(PAGE_SIZES[opt["hugepages"]]),
+                    'unit': 'KiB'})
+            if opt["memory_locked"] == "yes":
+                SubElement(backing, 'locked')
+        SubElement(domain, 'vcpu', attrib={
+            'placement': 'static'}).text = _slot("vcpu")
+        # 调度器生成的 numatune/cputune，序列化后替换为 ${placement}
+        domain.append(ET.Comment(_slot("placement")))
+
+        features = SubElement(domain, 'features')
+        SubElement(features, 'acpi')
+        SubElement(features, 'apic')
+
+        cpu = SubElement(domain, 'cpu', attrib={
+            'mode': 'host-model', 'check': 'partial'})
+        SubElement(cpu, 'model', attrib={'fallback': 'allow'})
+
+        clock = SubElement(domain, 'clock', attrib={'offset': 'utc'})
+        SubElement(clock, 'timer', attrib={
+            'name': 'rtc', 'tickpolicy': 'catchup'})
+        SubElement(clock, 'timer', attrib={
+            'name': 'pit', 'tickpolicy': 'delay'})
+        SubElement(clock, 'timer', attrib={'name': 'hpet', 'present': 'no'})
+
+        SubElement(domain, 'on_poweroff').text = 'destroy'
+        SubElement(domain, 'on_reboot').text = 'restart'
+        SubElement(domain, 'on_crash').text = 'destroy'
+
+        pm = SubElement(domain, 'pm')
+        SubElement(pm, 'suspend-to-mem', attrib={'enabled': 'no'})
+        SubElement(pm, 'suspend-to-disk', attrib={'enabled': 'no'})
+
+        domain.append(OSXML(None, arch=opt["arch"],
+                            machine=opt["machine"]).getXML())
+        domain.append(self._devices())
+
+        cmdline = SubElement(domain, 'qemu:commandline')
+        SubElement(cmdline, 'qemu:arg', attrib={'value': '-coretek-rt'})
+        return domain
+
+    def _disk(self, devices, device, bus, index, source, driver_type):
+        disk = SubElement(devices, 'disk', attrib={
+            'device': device, 'type': 'file'})
+        SubElement(disk, 'driver', attrib={'name': 'qemu', 'type': driver_type})
+        SubElement(disk, 'source', attrib={'file': source})
+        SubElement(disk, 'target', attrib={
+            'bus': bus, 'dev': DISK_DEV_PREFIX.get(bus, "sd") + "ab"[index]})
+        if device == "cdrom":
+            SubElement(disk, 'readonly')
+        if bus == "ide":
+            SubElement(disk, 'address', attrib={
+                'bus': '0', 'controller': '0', 'target': '0',
+                'type': 'drive', 'unit': str(index)})
+
+    def _devices(self):
+        opt = self.options
+        devices = Element('devices')
+        SubElement(devices, 'emulator').text = opt["emulator"]
+
+        self._disk(devices, "disk", opt["disk_bus"], 0, _slot("boot"), "qcow2")
+        self._disk(devices, "cdrom", opt["cdrom_bus"], 1, _slot("image"), "raw")
+
+        usb = [("ich9-ehci1", None, "0x7", None),
+               ("ich9-uhci1", "0", "0x0", "on"),
+               ("ich9-uhci2", "2", "0x1", None),
+               ("ich9-uhci3", "4", "0x2", None)]
+        for model, startport, function, multifunction in usb:
+            controller = SubElement(devices, 'controller', attrib={
+                'index': '0', 'model': model, 'type': 'usb'})
+            if startport is not None:
+                SubElement(controller, 'master', attrib={'startport': startport})
+            address = {'bus': '0x00', 'domain': '0x0000',
+                       'function': function, 'slot': '0x06', 'type': 'pci'}
+            if multifunction:
+                address['multifunction'] = multifunction
+            SubElement(controller, 'address', attrib=address)
+
+        SubElement(devices, 'controller', attrib={
+            'index': '0', 'model': 'pci-root', 'type': 'pci'})
+        if "ide" in (opt["disk_bus"], opt["cdrom_bus"]):
+            controller = SubElement(devices, 'controller', attrib={
+                'index': '0', 'type': 'ide'})
+            SubElement(controller, 'address', attrib={
+                'bus': '0x00', 'domain': '0x0000', 'function': '0x1',
+                'slot': '0x01', 'type': 'pci'})
+        controller = SubElement(devices, 'controller', attrib={
+            'index': '0', 'type': 'virtio-serial'})
+        SubElement(controller, 'address', attrib={
+            'bus': '0x00', 'domain': '0x0000', 'function': '0x0',
+            'slot': '0x05', 'type': 'pci'})
+
+        interface = SubElement(devices, 'interface', attrib={'type': 'bridge'})
+        SubElement(interface, 'mac', attrib={'address': _slot("mac")})
+        SubElement(interface, 'source', attrib={'bridge': opt["nic_bridge"]})
+        SubElement(interface, 'model', attrib={'type': opt["nic_model"]})
+        SubElement(interface, 'address', attrib={
+            'bus': '0x00', 'domain': '0x0000', 'function': '0x0',
+            'slot': '0x03', 'type': 'pci'})
+
+        serial = SubElement(devices, 'serial', attrib={'type': 'pty'})
+        target = SubElement(serial, 'target', attrib={
+            'type': 'isa-serial', 'port': '0'})
+        SubElement(target, 'model', attrib={'name': 'isa-serial'})
+        console = SubElement(devices, 'console', attrib={'type': 'pty'})
+        SubElement(console, 'target', attrib={'type': 'serial', 'port': '0'})
+
+        channel = SubElement(devices, 'channel', attrib={'type': 'unix'})
+        SubElement(channel, 'target', attrib={
+            'type': 'virtio', 'name': 'org.qemu.guest_agent.0'})
+        SubElement(channel, 'address', attrib={
+            'type': 'virtio-serial', 'controller': '0', 'bus': '0', 'port': '1'})
+        channel = SubElement(devices, 'channel', attrib={'type': 'spicevmc'})
+        SubElement(channel, 'target', attrib={
+            'type': 'virtio', 'name': 'com.redhat.spice.0'})
+        SubElement(channel, 'address', attrib={
+            'type': 'virtio-serial', 'controller': '0', 'bus': '0', 'port': '2'})
+
+        tablet = SubElement(devices, 'input', attrib={'type': 'tablet', 'bus': 'usb'})
+        SubElement(tablet, 'address', attrib={'type': 'usb', 'bus': '0', 'port': '1'})
+        SubElement(devices, 'input', attrib={'type': 'mouse', 'bus': 'ps2'})
+        SubElement(devices, 'input', attrib={'type': 'keyboard', 'bus': 'ps2'})
+
+        graphics = {'type': opt["graphics"], 'port': '-1', 'autoport': 'yes',
+                    'listen': '0.0.0.0'}
+        if opt["graphics"] == "vnc":
+            graphics['keymap'] = 'en-us'
+        graphics = SubElement(devices, 'graphics', attrib=graphics)
+        SubElement(graphics, 'listen', attrib={'type': 'address'})
+
+        if opt["sound_model"] != "none":
+            sound = SubElement(devices, 'sound', attrib={
+                'model': opt["sound_model"]})
+            SubElement(sound, 'address', attrib={
+                'bus': '0x00', 'domain': '0x0000', 'function': '0x0',
+                'slot': '0x04', 'type': 'pci'})
+
+        video = SubElement(devices, 'video')
+        model = {'heads': '1', 'type': opt["video_model"]}
+        if opt["video_model"] == "qxl":
+            model.update({'ram': '65536', 'vgamem': '16384', 'vram': '65536'})
+        SubElement(video, 'model', attrib=model)
+        SubElement(video, 'address', attrib={
+            'bus': '0x00', 'domain': '0x0000', 'function': '0x0',
+            'slot': '0x02', 'type': 'pci'})
+
+        SubElement(devices, 'redirdev', attrib={'bus': 'usb', 'type': 'spicevmc'})
+        SubElement(devices, 'redirdev', attrib={'bus': 'usb', 'type': 'spicevmc'})
+
+        memballoon = SubElement(devices, 'memballoon', attrib={'model': 'virtio'})
+        SubElement(memballoon, 'address', attrib={
+            'bus': '0x00', 'domain': '0x0000', 'function': '0x0',
+            'slot': '0x07', 'type': 'pci'})
+        return devices
+
+    def render(self, **slots):
+        return self.template.substitute(
+            dict((key, value if key in RAW_SLOTS
+                  else escape(str(value), {'"': "&quot;"}))
+                 for key, value in slots.items()))
+
+    def validate(self, conn):
+        """
+        用宿主机的 domain capabilities 校验规格中的总线、显卡和图形类型，
+        不支持的规格标记为不可用。
+        """
+        opt = self.options
+        caps = ET.fromstring(conn.getDomainCapabilities(
+            opt["emulator"], opt["arch"], opt["machine"] or None, "kvm", 0))
+
+        def supported(path):
+            return set(value.text for value in caps.iterfind(path + "/value"))
+
+        checks = [
+            ("disk_bus", "devices/disk/enum[@name='bus']"),
+            ("cdrom_bus", "devices/disk/enum[@name='bus']"),
+            ("video_model", "devices/video/enum[@name='modelType']"),
+            ("graphics", "devices/graphics/enum[@name='type']"),
+        ]
+        errors = self._check_options()
+        for option, path in checks:
+            values = supported(path)
+            # 较旧的 libvirt 不返回该枚举时跳过
+            if values and opt[option] not in values:
+                errors.append("%s %s not in %s" % (
+                    option, opt[option], sorted(values)))
+        if opt["hugepages"] in PAGE_SIZES:
+            # 主机支持的页大小
+            sizes = set(int(page.get("size")) for page in ET.fromstring(
+                conn.getCapabilities()).iterfind("host/cpu/pages"))
+            if PAGE_SIZES[opt["hugepages"]] not in sizes:
+                errors.append("hugepages %s not supported by host" %
+                              opt["hugepages"])
+        self.valid = not errors
+        if errors:
+            LOG.error("flavor %s is invalid: %s" % (self.name, "; ".join(errors)))
+        return errors
+
+
+class FlavorRegistry():
+    """
+    从配置文件加载的全部规格，未配置时只有 default 规格。
+    """
+
+    def __init__(self):
+        self._flavors = {}
+
+    def load(self, conf):
+        flavors = {"default": Flavor("default")}
+        for section in conf.sections():
+            if not section.startswith(FLAVOR_SECTION_PREFIX):
+                continue
+            name = section[len(FLAVOR_SECTION_PREFIX):]
+            options = dict((key, conf.get(section, key))
+                           for key in FLAVOR_DEFAULTS
+                           if conf.has_option(section, key))
+            flavors[name] = Flavor(name, options)
+        self._flavors = flavors
+
+    def validate(self, conn):
+        for flavor in self._flavors.values():
+            flavor.validate(conn)
+
+    def get(self, name=None):
+        if not self._flavors:
+            self.load(CONF)
+        flavor = self._flavors.get(name or "default")
+        if flavor is None or not flavor.valid:
+            raise CustomException("flavor %s not found or invalid" % name, 400)
+        return flavor
+
+    def list(self):
+        return [dict(flavor.options, name=flavor.name, valid=flavor.valid)
+                for flavor in self._flavors.values()]
+
+
+FLAVORS = FlavorRegistry()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from libvirtapi import config as cfg
+from libvirtapi.exs import CustomException
+from libvirtapi.libvirtoperations import offload
+from libvirtapi.libvirtoperations.cpupin import CPUS, CpuAllocator
+from libvirtapi.libvirtoperations.events import BROKER
+from libvirtapi.libvirtoperations.hugepages import HugePagePool
+from libvirtapi.libvirtoperations.inventory import INVENTORY, DomainInventory
+from libvirtapi.libvirtoperations.ledger import LEDGER, ResourceLedger
+from libvirtapi.libvirtoperations.novnc import NOVNC
+from libvirtapi.libvirtoperations.volindex import VOLUME_INDEX, VolumeIndex
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+DEFAULT_HOST = "default"
+
+
+class Host():
+    """
+    一台 hypervisor：URI 及该主机的虚拟机清单、资源账本、卷索引、
+    隔离 CPU 分配表和大页池。
+    连接池按 URI 区分，见 connpool.get_connection_pool。
+    """
+
+    def __init__(self, name, uri, inventory=None, ledger=None, volumes=None,
+                 cpus=None):
+        self.name = name
+        self.uri = uri
+        if inventory is None:
+            inventory = DomainInventory()
+            ledger = ResourceLedger()
+            volumes = VolumeIndex()
+            cpus = CpuAllocator()
+            cpus.configure(CONF.get("default", "isolated_cpus"),
+                           CONF.get("default", "emulator_cpus"))
+            inventory.add_listener(ledger)
+            inventory.add_listener(volumes)
+            inventory.add_listener(cpus)
+            inventory.add_listener(BROKER)
+            inventory.add_listener(NOVNC)
+            BROKER.add_ledger(ledger)
+        self.inventory = inventory
+        self.ledger = ledger
+        self.volumes = volumes
+        self.cpus = cpus
+        self.hugepages = HugePagePool()
+        self.last_error = None
+
+    def to_dict(self):
+        return {"name": self.name,
+                "uri": self.uri,
+                "status": "down" if self.last_error else "up",
+                "error": self.last_error,
+                "cpus": self.cpus.to_dict(),
+                "hugepages": self.hugepages.to_dict()}
+
+
+def parse_hosts(value, default_uri):
+    """
+    libvirt_hosts = node1=qemu+tcp://192.168.0.240/system, node2=...
+    未配置时只有一台名为 default 的主机，URI 为 libvirt_url
+    """
+    hosts = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, uri = item.partition("=")
+        if not sep or not name.strip() or not uri.strip():
+            raise ValueError("incorrect libvirt_hosts item: %s" % item)
+        hosts.append((name.strip(), uri.strip()))
+    return hosts or [(DEFAULT_HOST, default_uri)]
+
+
+class HostRegistry():
+    """
+    配置的主机列表。第一台主机使用模块级的 INVENTORY、LEDGER、VOLUME_INDEX，
+    单主机部署的行为与之前一致。
+
+    results, errors = HOSTS.map(func)
+    并发地对每台主机调用 func(host)，总耗时取决于最慢的主机，
+    超过 fleet_timeout 未返回的主机记为错误。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = None
+        self._executor = None
+        self.timeout = 30
+
+    def load(self, conf):
+        hosts = collections.OrderedDict()
+        items = parse_hosts(conf.get("default", "libvirt_hosts"),
+                            conf.get("default", "libvirt_url"))
+        for index, (name, uri) in enumerate(items):
+            if index == 0:
+                CPUS.configure(conf.get("default", "isolated_cpus"),
+                               conf.get("default", "emulator_cpus"))
+                hosts[name] = Host(name, uri, INVENTORY, LEDGER, VOLUME_INDEX,
+                                   CPUS)
+            else:
+                hosts[name] = Host(name, uri)
+        with self._lock:
+            self._hosts = hosts
+            self.timeout = conf.getfloat("default", "fleet_timeout")
+            self._executor = ThreadPoolExecutor(
+                max_workers=max(len(hosts) * 2, 2))
+        LOG.info("libvirt hosts: %s" % ", ".join(
+            "%s=%s" % (host.name, host.uri) for host in hosts.values()))
+
+    def _ensure(self):
+        if self._hosts is None:
+            self.load(CONF)
+        return self._hosts
+
+    def list(self):
+        return list(self._ensure().values())
+
+    @property
+    def default(self):
+        return self.list()[0]
+
+    def get(self, name=None):
+        """
+        name 为空时返回第一台主机
+        """
+        if not name:
+            return self.default
+        host = self._ensure().get(name)
+        if host is None:
+            raise CustomException("not found host %s" % name, 404)
+        return host
+
+    def by_uri(self, uri):
+        hosts = self._ensure()
+        for host in hosts.values():
+            if host.uri == uri:
+                return host
+        # 未配置的 URI 作为临时主机登记，使用独立的清单和账本
+        with self._lock:
+            host = hosts.get(uri)
+            if host is None:
+                host = hosts[uri] = Host(uri, uri)
+            return host
+
+    def map(self, func, hosts=None):
+        """
+        返回 (results, errors)，均为 {host name: ...}，按主机配置顺序排列。
+        多台主机时 func 在原生线程池中执行，wsgi 线程让出等待。
+        """
+        hosts = self.list() if hosts is None else hosts
+        results = collections.OrderedDict()
+        errors = collections.OrderedDict()
+        if len(hosts) == 1:
+            # 单台主机在当前线程中调用，不经过线程池
+            futures = None
+        else:
+            futures = [(host, self._executor.submit(func, host))
+                       for host in hosts]
+            # wsgi 线程中等待会阻塞 hub，放到 tpool 中等待
+            offload.wait([future for _, future in futures], self.timeout)
+
+        for index, host in enumerate(hosts):
+            try:
+                if futures is None:
+                    results[host.name] = func(host)
+                else:
+                    future = futures[index][1]
+                    if not future.done():
+                        raise CustomException(
+                            "timeout after %ss" % self.timeout, 504)
+                    results[host.name] = future.result()
+                host.last_error = None
+            except Exception as e:
+                LOG.warning("host %s: %s" % (host.name, e))
+                host.last_error = str(e)
+                errors[host.name] = str(e)
+        return results, errors
+
+    async def gather(self, func, hosts=None, executor=None):
+        """
+        map 的 asyncio 版本：func(host) 在 executor 中执行，
+        各主机并发等待，不占用事件循环
+        """
+        loop = asyncio.get_event_loop()
+        hosts = self.list() if hosts is None else hosts
+        outcomes = await asyncio.gather(
+            *[asyncio.wait_for(loop.run_in_executor(executor, func, host),
+                               self.timeout) for host in hosts],
+            return_exceptions=True)
+        results = collections.OrderedDict()
+        errors = collections.OrderedDict()
+        for host, outcome in zip(hosts, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                outcome = CustomException("timeout after %ss" % self.timeout,
+                                          504)
+            if isinstance(outcome, Exception):
+                LOG.warning("host %s: %s" % (host.name, outcome))
+                host.last_error = str(outcome)
+                errors[host.name] = str(outcome)
+            else:
+                host.last_error = None
+                results[host.name] = outcome
+        return results, errors
+
+
+HOSTS = HostRegistry()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+# 规格中的大页大小 -> KiB
+PAGE_SIZES = {"2M": 2048, "1G": 1048576}
+
+
+def page_size_kib(value):
+    """
+    "2M" -> 2048，空值表示不使用大页，返回 0
+    """
+    if not value:
+        return 0
+    if value not in PAGE_SIZES:
+        raise ValueError("unsupported hugepage size %s" % value)
+    return PAGE_SIZES[value]
+
+
+class HugePagePool():
+    """
+    一台主机各 NUMA 节点的大页池。
+
+    总页数来自 capabilities，空闲页数来自 getFreePages，由调度器的 refresh 更新。
+    两次 refresh 之间创建的虚拟机以 claim 记账：创建中的 claim 和
+    上次 refresh 之后才结束的 claim 都从空闲页数中扣除，
+    之前结束的 claim 所占的页已经反映在 getFreePages 的结果中。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = {}  # size KiB -> {node: pages}
+        self.free = {}  # size KiB -> {node: pages}
+        self._claims = {}  # key -> [size KiB, {node: pages}, 结束时间]
+        self.updated = 0
+
+    def refresh(self, conn, caps):
+        """
+        caps 为已解析的 getCapabilities 结果
+        """
+        total = {}
+        for cell in caps.iterfind("host/topology/cells/cell"):
+            node = int(cell.get("id"))
+            for pages in cell.iterfind("pages"):
+                size = int(pages.get("size"))
+                # 4K 普通页不是大页池
+                if size in PAGE_SIZES.values() and int(pages.text or 0):
+                    total.setdefault(size, {})[node] = int(pages.text)
+        free = {}
+        if total:
+            nodes = sorted(set(node for counts in total.values()
+                               for node in counts))
+            result = conn.getFreePages(sorted(total), nodes[0],
+                                       nodes[-1] - nodes[0] + 1)
+            for node, counts in result.items():
+                for size, pages in counts.items():
+                    if size in total:
+                        free.setdefault(size, {})[int(node)] = pages
+        now = time.time()
+        with self._lock:
+            self.total = total
+            self.free = free
+            for key in [key for key, claim in self._claims.items()
+                        if claim[2] is not None and claim[2] < now]:
+                del self._claims[key]
+            self.updated = now
+
+    def total_mib(self, node=None):
+        """
+        大页池占用的内存(MiB)，这部分内存不能作为普通内存分配
+        """
+        with self._lock:
+            return sum(pages * size / 1024
+                       for size, counts in self.total.items()
+                       for n, pages in counts.items()
+                       if node is None or n == node)
+
+    def _available(self, size):
+        available = dict(self.free.get(size, {}))
+        for claim_size, nodes, _ in self._claims.values():
+            if claim_size == size:
+                for node, pages in nodes.items():
+                    available[node] = available.get(node, 0) - pages
+        return available
+
+    def available(self, size, node=None):
+        with self._lock:
+            available = self._available(size)
+        if node is not None:
+            return available.get(node, 0)
+        return sum(available.values())
+
+    def claim(self, key, size, pages, node=None):
+        """
+        占用 pages 个大页，node 为 None 时优先放在单个节点内，
+        放不下再跨节点分配。空闲页数不足时返回 False
+        """
+        with self._lock:
+            available = self._available(size)
+            if node is not None:
+                if available.get(node, 0) < pages:
+                    return False
+                nodes = {node: pages}
+            else:
+                fit = [n for n, free in available.items() if free >= pages]
+                if fit:
+                    best = max(fit, key=lambda n: available[n])
+                    nodes = {best: pages}
+                elif sum(max(free, 0) for free in available.values()) >= pages:
+                    nodes = {}
+                    remaining = pages
+                    for n, free in sorted(available.items(),
+                                          key=lambda item: -item[1]):
+                        if remaining <= 0 or free <= 0:
+                            break
+                        nodes[n] = min(free, remaining)
+                        remaining -= nodes[n]
+                else:
+                    return False
+            self._claims[key] = [size, nodes, None]
+            return True
+
+    def cancel(self, key):
+        """
+        调度未采用的 claim，页没有被占用，直接删除
+        """
+        with self._lock:
+            self._claims.pop(key, None)
+
+    def unclaim(self, key):
+        """
+        创建结束，虚拟机已占用的大页在下次 refresh 之前仍然扣除
+        """
+        with self._lock:
+            claim = self._claims.get(key)
+            if claim is not None:
+                claim[2] = time.time()
+
+    def to_dict(self):
+        with self._lock:
+            return [{"size": size,
+                     "total": dict(self.total[size]),
+                     "free": self._available(size)}
+                    for size in sorted(self.total)]
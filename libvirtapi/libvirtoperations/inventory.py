@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import uuid
+
+import libvirt
+from libvirt import libvirtError
+
+from libvirtapi.libvirtoperations import offload
+
+LOG = logging.getLogger(__name__)
+
+_event_loop_lock = threading.Lock()
+_event_loop_thread = None
+
+CHANGED = threading.Event()
+
+# 客户机重启(VIR_DOMAIN_EVENT_ID_REBOOT)不是生命周期事件，没有事件码，
+# 通知等待者时使用该值
+REBOOTED = "rebooted"
+
+
+def _run_event_loop():
+    while True:
+        try:
+            libvirt.virEventRunDefaultImpl()
+        except libvirtError as e:
+            LOG.warning("libvirt event loop error: %s" % e)
+
+
+def start_event_loop():
+    """
+    注册并启动 libvirt 默认事件循环线程。
+    必须在打开需要接收事件的连接之前调用，重复调用无副作用。
+    """
+    global _event_loop_thread
+    with _event_loop_lock:
+        if _event_loop_thread is not None:
+            return
+        libvirt.virEventRegisterDefaultImpl()
+        _event_loop_thread = threading.Thread(
+            target=_run_event_loop, name="libvirt-event-loop")
+        _event_loop_thread.daemon = True
+        _event_loop_thread.start()
+
+
+class LifecycleWaiter():
+    """
+    等待某台虚拟机的生命周期事件，由 DomainInventory.watch 创建。
+    """
+
+    def __init__(self, uuid, events):
+        self.uuid = uuid
+        self.events = frozenset(events)
+        self.event = None
+        self._done = threading.Event()
+
+    def notify(self, event):
+        if event in self.events:
+            self.event = event
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """
+        收到事件返回 True，超时返回 False
+        """
+        return self._done.wait(timeout)
+
+
+class DomainInventory():
+    """
+    进程内虚拟机清单缓存。
+
+    首次读取时通过 LibvirtManager 全量同步一次，之后由 libvirt 事件
+    (生命周期、设备增删、重启) 把对应虚拟机标记为脏数据，下次读取时只刷新
+    脏数据。事件使用独立的连接接收，该连接断开后缓存整体失效，
+    下次读取时重新建立事件连接并全量同步。
+
+    事件回调运行在事件循环线程中，只做标记，不发起 RPC；
+    sync 查询 libvirt 时不持有锁，回调不会被全量同步阻塞。
+    """
+
+    EVENTS = (
+        ("VIR_DOMAIN_EVENT_ID_LIFECYCLE", "_lifecycle_cb"),
+        ("VIR_DOMAIN_EVENT_ID_REBOOT", "_reboot_cb"),
+        ("VIR_DOMAIN_EVENT_ID_DEVICE_ADDED", "_device_cb"),
+        ("VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED", "_device_cb"),
+    )
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._domains = {}  # uuid -> vm info
+        self._names = {}  # name -> uuid
+        self._dirty = set()  # 需要刷新的 uuid
+        self._fetching = 0  # 正在锁外查询 libvirt 的 sync 数
+        self._resets = 0  # 缓存失效的次数
+        self._synced = False
+        self._bound = False
+        self._unsupported = False
+        self._event_conn = None
+        self._callback_ids = []  # 事件连接上注册的回调 id
+        self._stale = []  # 已断开、待注销回调并关闭的 (conn, callback_ids)
+        self._binding = False
+        self._listeners = []
+        self._waiters = {}  # uuid -> [LifecycleWaiter]
+        self.generation = 0
+        # 有事件到达或缓存失效时置位，供推送线程及时同步，所有主机共用
+        self.changed = CHANGED
+        # 进程重启后 generation 从 0 开始，版本号带上 epoch 以免与旧值冲突
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def add_listener(self, listener):
+        """
+        listener(old, new)：虚拟机信息变化时调用，old/new 为变化前后的
+        vm info，新增时 old 为 None，删除时 new 为 None。
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, old, new):
+        for listener in self._listeners:
+            try:
+                listener(old, new)
+            except Exception as e:
+                LOG.exception("inventory listener error: %s" % e)
+
+    def ensure_bound(self, uri):
+        """
+        事件连接不存在时建立并注册事件回调。
+        驱动不支持事件时不再重试，此后每次读取都全量同步。
+
+        打开连接和注册回调在 tpool 中执行，不持有锁；同一时刻只有一个
+        调用者建立连接，其他调用者不等待，本次按未绑定处理。
+        重新建立之前先注销已断开连接上的回调并关闭该连接。
+        """
+        with self._lock:
+            if self._event_conn is not None or self._unsupported or \
+                    self._binding:
+                return
+            self._binding = True
+            stale, self._stale = self._stale, []
+        conn = None
+        try:
+            for old_conn, old_ids in stale:
+                try:
+                    offload.call(self._release, old_conn, old_ids)
+                except Exception as e:
+                    # 超时的调用仍在原生线程中执行，不影响重新建立连接
+                    LOG.warning("release libvirt event connection "
+                                "failed: %s" % e)
+            start_event_loop()
+            # 主机不可达时 open 可能阻塞很久，不能阻塞 wsgi 线程
+            conn, callback_ids = offload.call(self._open, uri)
+        finally:
+            with self._lock:
+                self._binding = False
+                if conn is not None:
+                    if callback_ids:
+                        self._event_conn = conn
+                        self._callback_ids = callback_ids
+                    else:
+                        self._unsupported = True
+        if conn is not None and not callback_ids:
+            offload.call(conn.close)
+
+    def _open(self, uri):
+        conn = libvirt.open(uri)
+        try:
+            # 依靠 keepalive 及时发现事件连接断开
+            conn.setKeepAlive(5, 3)
+        except libvirtError as e:
+            LOG.debug(e)
+        return conn, self.bind(conn)
+
+    def bind(self, conn):
+        """
+        在连接上注册事件回调，并使缓存失效。
+        返回注册的回调 id 列表，注册失败时返回空列表。
+        """
+        with self._lock:
+            self._synced = False
+            self._bound = False
+            self._resets += 1
+        callback_ids = []
+        try:
+            for event_id, callback in self.EVENTS:
+                callback_ids.append(conn.domainEventRegisterAny(
+                    None, getattr(libvirt, event_id),
+                    getattr(self, callback), None))
+            conn.registerCloseCallback(self._close_cb, None)
+        except libvirtError as e:
+            LOG.warning("register domain events failed, "
+                        "inventory cache disabled: %s" % e)
+            self._deregister(conn, callback_ids)
+            return []
+        with self._lock:
+            self._bound = True
+        return callback_ids
+
+    def _deregister(self, conn, callback_ids):
+        for callback_id in callback_ids:
+            try:
+                conn.domainEventDeregisterAny(callback_id)
+            except libvirtError as e:
+                LOG.debug(e)
+
+    def _release(self, conn, callback_ids):
+        """
+        注销回调后关闭连接，回调持有的引用随之释放
+        """
+        self._deregister(conn, callback_ids)
+        try:
+            conn.unregisterCloseCallback()
+        except libvirtError as e:
+            LOG.debug(e)
+        try:
+            conn.close()
+        except libvirtError as e:
+            LOG.debug(e)
+
+    def _close_cb(self, conn, reason, opaque):
+        """
+        在事件循环线程中执行，不发起 RPC，断开的连接留给下次
+        ensure_bound 释放
+        """
+        LOG.warning("libvirt event connection closed, reason: %s" % reason)
+        with self._lock:
+            if self._event_conn is not None:
+                self._stale.append((self._event_conn, self._callback_ids))
+            self._event_conn = None
+            self._callback_ids = []
+            self._bound = False
+            self.invalidate()
+
+    def _lifecycle_cb(self, conn, dom, event, detail, opaque):
+        uuid = dom.UUIDString()
+        if event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+            self.remove(uuid)
+        else:
+            self.mark_dirty(uuid)
+        self._wake(uuid, event)
+
+    def _reboot_cb(self, conn, dom, opaque):
+        uuid = dom.UUIDString()
+        self.mark_dirty(uuid)
+        self._wake(uuid, REBOOTED)
+
+    def _wake(self, uuid, event):
+        with self._lock:
+            waiters = list(self._waiters.get(uuid, ()))
+        for waiter in waiters:
+            waiter.notify(event)
+
+    def watch(self, uuid, events):
+        """
+        在发起操作之前注册，收到 events 中任一生命周期事件(或 REBOOTED)
+        时唤醒等待者，用完后调用 unwatch。
+        """
+        waiter = LifecycleWaiter(uuid, events)
+        with self._lock:
+            self._waiters.setdefault(uuid, []).append(waiter)
+        return waiter
+
+    def unwatch(self, waiter):
+        with self._lock:
+            waiters = self._waiters.get(waiter.uuid, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                self._waiters.pop(waiter.uuid, None)
+
+    @property
+    def bound(self):
+        """
+        事件连接已建立，生命周期事件可以送达
+        """
+        with self._lock:
+            return self._bound
+
+    def _device_cb(self, conn, dom, dev_alias, opaque):
+        self.mark_dirty(dom.UUIDString())
+
+    def invalidate(self):
+        with self._lock:
+            self._synced = False
+            self._resets += 1
+            self.generation += 1
+            self.changed.set()
+
+    def mark_dirty(self, uuid):
+        with self._lock:
+            self._dirty.add(uuid)
+            self.generation += 1
+            self.changed.set()
+
+    def remove(self, uuid):
+        with self._lock:
+            info = self._domains.pop(uuid, None)
+            if info:
+                self._names.pop(info["name"], None)
+                self._notify(info, None)
+            if self._fetching:
+                # 正在查询的结果可能仍包含该虚拟机，下次 sync 时确认
+                self._dirty.add(uuid)
+            else:
+                self._dirty.discard(uuid)
+            self.generation += 1
+
+    def put(self, info):
+        with self._lock:
+            old = self._domains.get(info["uuid"])
+            if old and old["name"] != info["name"]:
+                self._names.pop(old["name"], None)
+            self._domains[info["uuid"]] = info
+            self._names[info["name"]] = info["uuid"]
+            self._dirty.discard(info["uuid"])
+            self.generation += 1
+            self._notify(old, info)
+
+    def sync(self, manager):
+        """
+        全量同步或刷新脏数据，manager 为 LibvirtManager 实例。
+
+        查询 libvirt 时不持有锁，事件回调不会等待 RPC；结果在锁内应用，
+        查询期间到达的事件对应的虚拟机仍为脏数据，下次 sync 再刷新。
+        """
+        self.ensure_bound(manager.uri)
+        with self._lock:
+            full = not self._bound or not self._synced
+            bound = self._bound
+            resets = self._resets
+            dirty = self._dirty
+            self._dirty = set()
+            self._fetching += 1
+        try:
+            if full:
+                vms = manager.scan_vms()
+            else:
+                infos = [(vm_uuid, manager.load_vm_info(vm_uuid))
+                         for vm_uuid in dirty]
+        except Exception:
+            with self._lock:
+                self._fetching -= 1
+                self._dirty |= dirty
+            raise
+
+        with self._lock:
+            self._fetching -= 1
+            arrived = self._dirty
+            self._dirty = set()
+            if full:
+                # 以差量方式应用全量结果，监听者只需处理增量
+                seen = set(info["uuid"] for info in vms)
+                for vm_uuid in [vm_uuid for vm_uuid in self._domains
+                                if vm_uuid not in seen]:
+                    self.remove(vm_uuid)
+                for info in vms:
+                    self.put(info)
+                # 查询期间事件连接重建或断开，结果可能已过时
+                if self._resets == resets:
+                    self._synced = bound
+                self.generation += 1
+            else:
+                for vm_uuid, info in infos:
+                    if info:
+                        self.put(info)
+                    else:
+                        self.remove(vm_uuid)
+            self._dirty |= arrived
+
+    @property
+    def stale(self):
+        """
+        下次 sync 是否需要查询 libvirt
+        """
+        with self._lock:
+            return not self._bound or not self._synced or bool(self._dirty)
+
+    @property
+    def supported(self):
+        """
+        驱动不支持事件时缓存不可用，调用方应直接查询 libvirt。
+        """
+        return not self._unsupported
+
+    def snapshot(self, manager):
+        """
+        同步后返回 (version, vms)，version 与 vms 在同一把锁内取得，
+        version 不变则 vms 不变。
+        """
+        self.sync(manager)
+        with self._lock:
+            return ("%s-%d" % (self.epoch, self.generation),
+                    list(self._domains.values()))
+
+    def list(self):
+        with self._lock:
+            return list(self._domains.values())
+
+    def get_by_uuid(self, uuid):
+        with self._lock:
+            return self._domains.get(uuid)
+
+    def get_by_name(self, name):
+        with self._lock:
+            uuid = self._names.get(name)
+            return self._domains.get(uuid) if uuid else None
+
+
+INVENTORY = DomainInventory()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from libvirtapi.utils.utils import uuid_generate
+
+LOG = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class Job():
+    """
+    后台任务状态。phase 由任务函数在执行过程中更新，
+    volume/pool/host 指向正在写入的存储卷，用于查询已复制字节数。
+    """
+
+    def __init__(self, kind, target):
+        self.id = uuid_generate()
+        self.kind = kind
+        self.target = target
+        self.status = PENDING
+        self.phase = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.volume = None
+        self.pool = "default"
+        self.host = None
+        self.bytes_total = 0
+        self.bytes_copied = 0
+        # 批量任务中每台虚拟机的子任务，复制进度为子任务之和
+        self.children = []
+
+    def set_phase(self, phase):
+        LOG.info("job %s %s: %s" % (self.id, self.target, phase))
+        self.phase = phase
+
+    @property
+    def done(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    def elapsed(self):
+        if not self.started:
+            return 0
+        return round((self.finished or time.time()) - self.started, 3)
+
+    def to_dict(self):
+        return {"id": self.id,
+                "type": self.kind,
+                "target": self.target,
+                "status": self.status,
+                "phase": self.phase,
+                "bytes_copied": self.bytes_copied,
+                "bytes_total": self.bytes_total,
+                "created": time.strftime(
+                    "%Y-%m-%d %H:%M:%S", time.localtime(self.created)),
+                "elapsed": self.elapsed(),
+                "error": self.error,
+                "result": self.result}
+
+
+class JobManager():
+    """
+    有界线程池执行后台任务，保留最近 history 个任务的状态。
+
+    job = JOBS.submit("create_vm", "test", func, args)
+    func(job, *args) 的返回值记录在 job.result 中。
+    """
+
+    def __init__(self, workers=4, history=200):
+        self._lock = threading.Lock()
+        self._jobs = collections.OrderedDict()
+        self._executor = None
+        self.workers = workers
+        self.history = history
+
+    def configure(self, workers, history):
+        with self._lock:
+            self.workers = workers
+            self.history = history
+
+    def submit(self, kind, target, func, *args):
+        job = Job(kind, target)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers)
+            self._jobs[job.id] = job
+            self._trim()
+            self._executor.submit(self._run, job, func, args)
+        return job
+
+    def _trim(self):
+        # 只淘汰已结束的任务
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.history:
+                break
+            if self._jobs[job_id].done:
+                del self._jobs[job_id]
+
+    def _run(self, job, func, args):
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            job.result = func(job, *args)
+            job.status = SUCCEEDED
+            job.set_phase("done")
+        except Exception as e:
+            LOG.exception("job %s %s failed" % (job.id, job.target))
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+
+JOBS = JobManager()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import threading
+import time
+
+from libvirtapi.libvirtoperations.inventory import INVENTORY
+
+LOG = logging.getLogger(__name__)
+
+
+def single_node(nodeset):
+    """
+    nodeset 为单个 NUMA 节点时返回节点号，否则返回 None
+    """
+    if nodeset and nodeset.isdigit():
+        return int(nodeset)
+    return None
+
+
+class ResourceLedger():
+    """
+    运行中虚拟机的 vCPU、内存占用账本。
+
+    作为 DomainInventory 的监听者，按虚拟机信息的变化增量记账，
+    查询已分配资源为 O(1)。全量同步时 inventory 同样以差量方式通知，
+    因此周期性全量同步即可纠正漏掉事件导致的偏差。
+
+    绑定到单个 NUMA 节点的虚拟机和预留另外按节点记账，
+    node_vcpus/node_memory 包含已分配和已预留的部分。
+
+    预留同时记录虚拟机组，反亲和检查需要计入创建中的同组虚拟机。
+    调度出去的磁盘空间(claimed_disk)在创建结束后仍然保留，直到调度器
+    重新获取存储池剩余空间；创建失败时调用 release_disk 释放。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._allocations = {}  # uuid -> (vcpus, memory MiB, node)
+        self._reservations = {}  # key -> (vcpus, memory MiB, node, group)
+        self._disk_claims = {}  # key -> (Byte, 预占时间)
+        self.claimed_disk = 0
+        self.vcpus = 0
+        self.memory = 0
+        self.reserved_vcpus = 0
+        self.reserved_memory = 0
+        self.node_vcpus = collections.defaultdict(int)
+        self.node_memory = collections.defaultdict(float)
+
+    def __call__(self, old, new):
+        with self._lock:
+            if old:
+                self._release(old["uuid"])
+            if new and new["id"] > 0:
+                # vm info 中内存单位为 Byte，大页内存在 HugePagePool 中记账
+                memory = 0 if new.get("hugepages") else \
+                    new["mem"] / 1024 / 1024
+                self._allocate(new["uuid"], new["cpu"], memory,
+                               single_node(new.get("numa")))
+
+    def _allocate(self, uuid, vcpus, memory, node=None):
+        self._allocations[uuid] = (vcpus, memory, node)
+        self.vcpus += vcpus
+        self.memory += memory
+        self._node_add(node, vcpus, memory)
+
+    def _release(self, uuid):
+        vcpus, memory, node = self._allocations.pop(uuid, (0, 0, None))
+        self.vcpus -= vcpus
+        self.memory -= memory
+        self._node_add(node, -vcpus, -memory)
+
+    def _node_add(self, node, vcpus, memory):
+        if node is not None:
+            self.node_vcpus[node] += vcpus
+            self.node_memory[node] += memory
+
+    def running(self):
+        return len(self._allocations)
+
+    def reserve(self, key, vcpus, memory, total_vcpus, total_memory,
+                node=None, disk=0, group=None, exclusive=False):
+        """
+        为创建中的虚拟机预留资源，资源不足时返回 False。
+        检查与预留在同一把锁内完成，并发创建不会超额分配。
+        exclusive 为 True 时(反亲和)已有同组预留也返回 False。
+        """
+        with self._lock:
+            if vcpus > total_vcpus - self.vcpus - self.reserved_vcpus or \
+                    memory > total_memory - self.memory - self.reserved_memory:
+                return False
+            if exclusive and group and self._group_reservations(group):
+                return False
+            self._reservations[key] = (vcpus, memory, node, group)
+            self.reserved_vcpus += vcpus
+            self.reserved_memory += memory
+            self._node_add(node, vcpus, memory)
+            if disk:
+                self._disk_claims[key] = (disk, time.time())
+                self.claimed_disk += disk
+            return True
+
+    def _group_reservations(self, group):
+        return len([key for key, r in self._reservations.items()
+                    if r[3] == group])
+
+    def reserved_in_group(self, group):
+        """
+        创建中的同组虚拟机数
+        """
+        with self._lock:
+            return self._group_reservations(group)
+
+    def release_disk(self, key, ratio=1.0):
+        """
+        创建失败时释放预占的磁盘空间，批量创建部分失败时按比例释放
+        """
+        with self._lock:
+            disk, claimed = self._disk_claims.pop(key, (0, 0))
+            released = disk * ratio
+            self.claimed_disk -= released
+            if disk - released > 0:
+                self._disk_claims[key] = (disk - released, claimed)
+
+    def reset_disk(self, before):
+        """
+        调度器在 before 时刻之后重新获取了存储池剩余空间，
+        此前的磁盘预占已包含在内
+        """
+        with self._lock:
+            for key, (disk, claimed) in list(self._disk_claims.items()):
+                if claimed < before:
+                    del self._disk_claims[key]
+                    self.claimed_disk -= disk
+
+    def unreserve(self, key):
+        with self._lock:
+            vcpus, memory, node, _ = self._reservations.pop(
+                key, (0, 0, None, None))
+            self.reserved_vcpus -= vcpus
+            self.reserved_memory -= memory
+            self._node_add(node, -vcpus, -memory)
+
+
+LEDGER = ResourceLedger()
+INVENTORY.add_listener(LEDGER)
+
+_reconciler_thread = None
+
+
+def _reconcile_loop(managers_factory, interval):
+    while True:
+        time.sleep(interval)
+        for lib in managers_factory():
+            try:
+                with lib:
+                    lib.inventory.invalidate()
+                    lib.inventory.sync(lib)
+            except Exception as e:
+                LOG.warning("resource reconcile %s failed: %s"
+                            % (lib.uri, e))
+
+
+def start_reconciler(managers_factory, interval):
+    """
+    启动周期性对账线程，每 interval 秒全量同步一次每台主机的 inventory，
+    managers_factory() 返回每台主机的 LibvirtManager。
+    interval <= 0 时不启动。
+    """
+    global _reconciler_thread
+    if interval <= 0 or _reconciler_thread is not None:
+        return
+    _reconciler_thread = threading.Thread(
+        target=_reconcile_loop, args=(managers_factory, interval),
+        name="resource-reconciler")
+    _reconciler_thread.daemon = True
+    _reconciler_thread.start()
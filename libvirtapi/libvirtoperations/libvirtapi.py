@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
+import collections
 import logging
 import math
 import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import libvirt
@@ -10,13 +13,20 @@ except ImportError:
     HAS_LIBVIRT = False
 
 from libvirtapi import config as cfg
+from libvirtapi.exs import CustomException
 from libvirt import libvirtError
-from xml.dom import minidom
-from salt._compat import StringIO as _StringIO
 from salt.exceptions import CommandExecutionError
+from libvirtapi.libvirtoperations.domainxml import DomainXML
 from libvirtapi.libvirtoperations.guest import Guest
+from libvirtapi.libvirtoperations.jobs import Job
+from libvirtapi.libvirtoperations.connpool import get_connection_pool
+from libvirtapi.libvirtoperations.connpool import is_connection_error
+from libvirtapi.libvirtoperations.hosts import HOSTS
+from libvirtapi.libvirtoperations.inventory import REBOOTED
+from libvirtapi.libvirtoperations import offload
+from libvirtapi.libvirtoperations.novnc import NOVNC
+from libvirtapi.libvirtoperations.rpctrace import traced
 from libvirtapi.utils.utils import xml_to_dict
-from libvirtapi.utils.utils import uuid_generate as genuuid
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
@@ -44,48 +54,107 @@ VIRT_STATE_NAME_MAP = {0: "NoState",
                        6: "Crashed",
                        7: "PMSuspended"}
 
+# 虚拟机电源操作: action -> (LibvirtManager 方法, 目标状态, 到达目标状态的生命周期事件)
+# reboot 由客户机响应 ACPI 重启，完成的标志是重启事件；
+# hard_reboot 强制关机后启动，不经过客户机
+POWER_ACTIONS = {
+    "start": ("start", "Running", ("VIR_DOMAIN_EVENT_STARTED",)),
+    "shutdown": ("shutdown", "Stopped", ("VIR_DOMAIN_EVENT_STOPPED",)),
+    "destroy": ("destroy", "Stopped", ("VIR_DOMAIN_EVENT_STOPPED",)),
+    "reboot": ("reboot", "Running", (REBOOTED,)),
+    "hard_reboot": ("hard_reboot", "Running", ("VIR_DOMAIN_EVENT_STARTED",)),
+    "suspend": ("suspend", "Paused", ("VIR_DOMAIN_EVENT_SUSPENDED",)),
+    "resume": ("resume", "Running", ("VIR_DOMAIN_EVENT_RESUMED",)),
+}
+# 前后状态相同的操作，已处于目标状态时仍然执行
+RESTART_ACTIONS = frozenset(["reboot", "hard_reboot"])
 
-class LibvirtConnect:
-    connect = None
-
-    def __new__(cls, *args, **kwargs):
-        """
-        连接不存在时，创建
-        连接不可用时，创建
-        """
-        if not cls.connect:
-            cls.connect = cls._libvirt_connect()
-            return cls.connect
+SHUTDOWN_MODES = {
+    "acpi": "VIR_DOMAIN_SHUTDOWN_ACPI_POWER_BTN",
+    "agent": "VIR_DOMAIN_SHUTDOWN_GUEST_AGENT",
+}
 
-        try:
-            """
-            该方法会在 flask 窗口上打印 libvirt: Domain Config error : invalid connection pointer in virConnectIsAlive。
-            除此之外一切正常，目前未找到解决办法。
-            TODO: libvirt: Domain Config error，该错误不会被Exception捕获，似乎只是输出信息。当前不影响正常功能。
-            """
-            is_alive = cls.connect.isAlive()
-            if not is_alive:
-                cls.connect = None
-                cls.connect = cls._libvirt_connect()
+# get_vm_info 返回的字段，fields 参数只能从中选择
+VM_FIELDS = ("platform", "host", "autostart", "console", "cpu",
+             "description", "createDate", "disks", "id", "mem", "name",
+             "state", "type", "uuid", "numa", "group", "pinned_cpus",
+             "hugepages")
+# 需要解析 XML 的字段
+XML_FIELDS = frozenset(["console", "description", "createDate", "disks",
+                        "numa", "group", "pinned_cpus", "hugepages"])
+# 需要 getInfo 的字段
+HOST_FIELDS = frozenset(["host", "console"])
+
+
+# 镜像上传下载的分块大小
+STREAM_CHUNK_SIZE = 1024 * 1024
+ZERO_CHUNK = bytes(STREAM_CHUNK_SIZE)
+
+# 未完成的上传已写入的位置，用于断点续传
+UPLOAD_OFFSETS = {}
+
+# 上传时新建镜像卷，写入完成后 refresh 重新探测格式
+IMAGE_VOLUME_XML = """
+<volume>
+    <name>%s</name>
+    <allocation>0</allocation>
+    <capacity unit="bytes">%d</capacity>
+    <target>
+        <format type='raw'/>
+    </target>
+</volume>
+"""
 
-        except libvirtError:
-            """
-            由于 isAlive 方法会抛异常，这是不合理的，但是没有办法。
-            进入该步骤，证明连接不可用。
-            再次进行连接，如果异常，则向上层传递。
-            """
-            cls.connect = None
-            cls.connect = cls._libvirt_connect()
-        return cls.connect
 
-    def _libvirt_connect():
-        libvirt_url = CONF.get("default", "libvirt_url")
-        return libvirt.open(libvirt_url)
+def _abort_stream(stream):
+    # 传输未开始时 abort 也会失败，不能掩盖原来的异常
+    try:
+        stream.abort()
+    except Exception as e:
+        LOG.debug(e)
 
 
 class LibvirtBase:
-    def __init__(self):
-        self.conn = LibvirtConnect()
+    """
+    每个实例在首次访问 conn 时从连接池借出一个连接，close 时归还。
+    host 为 libvirt_hosts 中的主机名，不指定时使用第一台主机。
+
+    with LibvirtManager(host="node1") as lib:
+        lib.list_vms()
+    """
+
+    def __init__(self, uri=None, host=None):
+        self.host = HOSTS.by_uri(uri) if uri else HOSTS.get(host)
+        self.uri = self.host.uri
+        self.inventory = self.host.inventory
+        self.ledger = self.host.ledger
+        self.volumes = self.host.volumes
+        self._conn = None
+        self._traced = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            # 等待空闲连接和建立连接都可能阻塞，在 wsgi 线程中放到 tpool 执行
+            self._conn = offload.call(get_connection_pool(self.uri).checkout)
+            # 请求中借出的连接包装为统计调用次数和耗时的代理，
+            # 调用在 tpool 中执行，统计的是 RPC 本身的耗时
+            self._traced = offload.offloaded(traced(self._conn))
+        return self._traced
+
+    def close(self, broken=False):
+        if self._conn is not None:
+            # 有调用超时的连接丢弃，等原生线程中的调用返回后再关闭
+            pending = getattr(self._traced, "pending", ())
+            get_connection_pool(self.uri).checkin(self._conn, broken, pending)
+            self._conn = None
+            self._traced = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(broken=is_connection_error(exc_value))
 
 
 class LibvirtManager(LibvirtBase):
@@ -105,99 +174,219 @@ class LibvirtManager(LibvirtBase):
         dom = self.get_pool(pool_name).storageVolLookupByName(volume_name)
         return dom.XMLDesc(0)
 
-    def get_disks(self, vm_name):
-        disks = []
-        domain = xml_to_dict(self.get_xml(vm_name)).get("domain")
-        disks_dom = domain.get("devices").get("disk")
-        for disk in disks_dom:
-            if not isinstance(disk, dict) or disk.get("device") != "disk":
-                continue
-            tmp = {"name": disk.get("source").get(
-                "file").split("/")[5], "file": disk.get("source").get(
-                "file"), "dev": disk.get("target").get("dev")}
-            disks.append(tmp)
-        return disks
+    def get_domain_xml(self, vm_name):
+        return DomainXML.from_dom(self._get_dom(vm_name))
 
-    def get_vnc(self, vm_name):
+    def get_disks(self, vm_name, doc=None):
+        if doc is None:
+            doc = self.get_domain_xml(vm_name)
+        return doc.disks()
+
+    def get_vnc(self, vm_name, doc=None, host_info=None):
         out = {"autoport": "",
                "keymap": "",
                "listen": "",
                "port": "",
                "url": "",
                "type": "vnc"}
-        xml = self.get_xml(vm_name)
-        ssock = _StringIO(xml)
-        doc = minidom.parse(ssock)
-        for node in doc.getElementsByTagName("domain"):
-            g_nodes = node.getElementsByTagName("graphics")
-            for g_node in g_nodes:
-                for key in g_node.attributes.keys():
-                    out[key] = g_node.getAttribute(key)
-
-        out["listen"] = self.get_host_info().get("host_ip")
-        out["url"] = "http://%s:6080/vnc_lite.html?path=websockify?token=%s" % (
-            CONF.get("default", "libvirtapi_ip"), vm_name)
+        if doc is None:
+            doc = self.get_domain_xml(vm_name)
+        if host_info is None:
+            host_info = self.get_host_info()
+
+        for g_node in doc.graphics():
+            out.update(g_node)
+
+        out["listen"] = host_info.get("host_ip")
+        # 关机的虚拟机没有 token
+        token = NOVNC.assign(doc.uuid, out["listen"], out["port"])
+        if token:
+            out["url"] = "http://%s:6080/vnc_lite.html?path=websockify?token=%s" % (
+                CONF.get("default", "libvirtapi_ip"), token)
 
         return out
 
+    def _load_vm_info(self, dom):
+        doc = DomainXML.from_dom(dom)
+        raw = dom.info()
+        return self._build_vm_info(
+            dom, doc, raw[0], raw[3], raw[2], self.get_host_info(),
+            dom.autostart())
+
+    def load_vm_info(self, uuid):
+        """
+        绕过缓存，直接从 libvirt 读取虚拟机信息
+        """
+        try:
+            return self._load_vm_info(self.conn.lookupByUUIDString(uuid))
+        except libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                raise
+            LOG.debug(e)
+            return {}
+
     def get_vm_info(self, vm_name):
         try:
-            domain = xml_to_dict(self.get_xml(vm_name)).get("domain")
-            dom = self._get_dom(vm_name)
-            raw = dom.info()
-            return {
-                "platform": "Linux",  # 虚拟机平台信息
-                "host": self.get_host_info(),
-                "autostart": "yes" if dom.autostart() else "no",
-                "console": self.get_vnc(vm_name),
-                "cpu": raw[3],
-                "description": domain.get("description"),
-                "createDate": domain.get("metadata").get("createDate"),
-                "disks": self.get_disks(vm_name),
-                "id": dom.ID(),
-                "mem": int(raw[2]) * 1024,  # 默认是KiB,返回Byte
-                "name": vm_name,
-                "state": VIRT_STATE_NAME_MAP.get(raw[0], "Unknown"),
-                "type": "rt",
-                "uuid": dom.UUIDString()}
+            self.inventory.sync(self)
+            info = self.inventory.get_by_name(vm_name)
+            if info:
+                return info
+            # 事件可能晚于调用方的操作到达，缓存未命中时回源
+            info = self._load_vm_info(self._get_dom(vm_name))
+            self.inventory.put(info)
+            return info
         except:
             return {}
 
-    def _list_active_vms(self):
-        vms = []
-        for id in self.conn.listDomainsID():
-            vms.append(self.conn.lookupByID(id))
-        return vms
+    def get_vm_info_by_uuid(self, uuid):
+        self.inventory.sync(self)
+        info = self.inventory.get_by_uuid(uuid)
+        if info:
+            return info
+        info = self.load_vm_info(uuid)
+        if info:
+            self.inventory.put(info)
+        return info
+
+    def _list_domain_stats(self, state=None):
+        """
+        一次 RPC 获取所有虚拟机及其状态、vcpu、内存统计。
+        旧版本 libvirt 或不支持 getAllDomainStats 的驱动退化为 listAllDomains。
+        state 可以映射为查询标志时由 libvirt 过滤。
+        """
+        stats = (libvirt.VIR_DOMAIN_STATS_STATE |
+                 libvirt.VIR_DOMAIN_STATS_VCPU |
+                 libvirt.VIR_DOMAIN_STATS_BALLOON)
+        suffix = {"running": "RUNNING",
+                  "paused": "PAUSED",
+                  "stopped": "SHUTOFF"}.get((state or "").lower())
+        try:
+            flags = getattr(libvirt, "VIR_CONNECT_GET_ALL_DOMAINS_STATS_%s"
+                            % suffix) if suffix else 0
+            return self.conn.getAllDomainStats(stats, flags)
+        except libvirtError as e:
+            LOG.debug("getAllDomainStats unsupported, fallback: %s" % e)
+            flags = getattr(libvirt, "VIR_CONNECT_LIST_DOMAINS_%s"
+                            % suffix) if suffix else 0
+            return [(dom, {}) for dom in self.conn.listAllDomains(flags)]
+
+    def _build_vm_info(self, dom, doc, state, cpu, mem, host_info, autostart,
+                       fields=None):
+        """
+        根据一次 XMLDesc 的解析结果构造 get_vm_info 的所有字段
+        mem 单位为 KiB
+        fields 不为空时只构造其中的字段，此时 doc/host_info 可以为 None
+        """
+        vm_name = dom.name()
+        getters = {
+            "platform": lambda: "Linux",  # 虚拟机平台信息
+            "host": lambda: host_info,
+            "autostart": lambda: "yes" if autostart else "no",
+            "console": lambda: self.get_vnc(vm_name, doc, host_info),
+            "cpu": lambda: int(cpu),
+            "description": lambda: doc.description,
+            "createDate": lambda: doc.metadata().get("createDate"),
+            "disks": lambda: self.get_disks(vm_name, doc),
+            "id": dom.ID,
+            "mem": lambda: int(mem) * 1024,  # 返回Byte
+            "name": lambda: vm_name,
+            "state": lambda: VIRT_STATE_NAME_MAP.get(state, "Unknown"),
+            "type": lambda: "rt",
+            "uuid": dom.UUIDString,
+            # 调度时绑定的 NUMA 节点和反亲和组
+            "numa": lambda: doc.numa_nodeset(),
+            "group": lambda: doc.metadata().get("group") or None,
+            "pinned_cpus": lambda: doc.pinned_cpus(),
+            "hugepages": lambda: doc.hugepage_size()}
+        return dict((field, getters[field]()) for field in fields or VM_FIELDS)
+
+    def scan_vms(self, fields=None, state=None, name_prefix=None):
+        """
+        绕过缓存，批量获取虚拟机列表：
+            getAllDomainStats 一次取回所有虚拟机的状态统计，
+            listAllDomains(AUTOSTART) 一次取回自启动列表，
+            每台虚拟机只获取并解析一次 XML。
+
+        过滤和字段选择下推到查询中：先按状态和名称前缀过滤，
+        未请求的字段不查询，例如只要 name、state 时不调用 XMLDesc 和 getInfo。
+        """
+        fields = fields or VM_FIELDS
+        host_info = None
+        if HOST_FIELDS.intersection(fields):
+            host_info = self.get_host_info()
+        autostart_names = set()
+        if "autostart" in fields:
+            autostart_names = set(dom.name() for dom in self.conn.listAllDomains(
+                libvirt.VIR_CONNECT_LIST_DOMAINS_AUTOSTART))
 
-    def _list_inactive_vms(self):
         vms = []
-        for vm_name in self.conn.listDefinedDomains():
-            vms.append(self.conn.lookupByName(vm_name))
+        for dom, record in self._list_domain_stats(state):
+            try:
+                vm_name = dom.name()
+                if name_prefix and not vm_name.startswith(name_prefix):
+                    continue
+                dom_state = record.get("state.state")
+                if dom_state is None:
+                    dom_state = dom.state()[0]
+                if not _match_state(dom_state, state):
+                    continue
+                cpu = record.get("vcpu.current")
+                mem = record.get("balloon.current")
+                doc = None
+                if XML_FIELDS.intersection(fields) or \
+                        (cpu is None and "cpu" in fields) or \
+                        (mem is None and "mem" in fields):
+                    doc = DomainXML.from_dom(dom)
+                    cpu = doc.vcpus() if cpu is None else cpu
+                    mem = doc.current_memory() if mem is None else mem
+                vms.append(self._build_vm_info(
+                    dom, doc, dom_state, cpu, mem, host_info,
+                    vm_name in autostart_names, fields))
+            except libvirtError as e:
+                # 遍历过程中虚拟机被删除
+                LOG.debug(e)
         return vms
 
     def list_vms(self):
-        vm_objects = []
-        vm_objects.extend(self._list_active_vms())
-        vm_objects.extend(self._list_inactive_vms())
-        vms = []
-        for obj in vm_objects:
-            vms.append(self.get_vm_info(obj.name()))
+        self.inventory.sync(self)
+        return self.inventory.list()
 
-        # 将 vnc token 写入 novnc 配置文件
-        with open(r"novnc-token.conf", "w") as f:
-            f.writelines(["%s: %s:%s%s" % (vm["name"], vm["console"]["listen"],
-                                           vm["console"]["port"], "\n") for vm in vms if vm["console"]["port"] != "-1"])
-
-        return vms
+    def page_vms(self, state=None, name_prefix=None, fields=None,
+                 limit=None, marker=None):
+        """
+        分页查询虚拟机列表，按名称排序，marker 为上一页最后一台虚拟机的名称。
 
-    def get_vm_binding_cpus(self, vmname):
-        cpuset = []
-        doc = minidom.parse(_StringIO(self.get_xml(vmname)))
-        for node in doc.getElementsByTagName("cputune"):
-            i_nodes = node.getElementsByTagName("vcpupin")
-            for i_node in i_nodes:
-                cpuset.append(i_node.getAttribute("cpuset"))
-        return cpuset
+        返回 {"vms": [...], "next_marker": ..., "version": ...}，
+        没有下一页时 next_marker 为 None；version 为清单缓存版本，
+        版本不变则结果不变，缓存不可用时为 None。
+        """
+        self.inventory.ensure_bound(self.uri)
+        if self.inventory.supported:
+            version, vms = self.inventory.snapshot(self)
+            vms = [vm for vm in vms
+                   if _match_state(vm["state"], state) and
+                   (not name_prefix or vm["name"].startswith(name_prefix))]
+        else:
+            version = None
+            # 排序和分页需要 name
+            vms = self.scan_vms(
+                fields and list(set(fields) | {"name"}), state, name_prefix)
+
+        vms.sort(key=lambda vm: vm["name"])
+        if marker:
+            vms = [vm for vm in vms if vm["name"] > marker]
+        next_marker = None
+        if limit and len(vms) > limit:
+            vms = vms[:limit]
+            next_marker = vms[-1]["name"]
+        if fields:
+            vms = [dict((field, vm[field]) for field in fields) for vm in vms]
+        return {"vms": vms, "next_marker": next_marker, "version": version}
+
+    def get_vm_binding_cpus(self, vmname, doc=None):
+        if doc is None:
+            doc = self.get_domain_xml(vmname)
+        return [pin.get("cpuset") for pin in doc.vcpupins()]
 
     def list_storage_pools(self):
         return self.conn.listStoragePools()
@@ -232,9 +421,21 @@ class LibvirtManager(LibvirtBase):
             LOG.debug(e)
             return None
 
-    def generate_volume_xml(self, volume_name, default_pool_path, volume_size):
+    def generate_volume_xml(self, volume_name, default_pool_path, volume_size,
+                            backing_store=None):
+        """
+        backing_store = {"path": 基础镜像路径, "format": 基础镜像格式}
+        指定时生成以该镜像为 backing file 的 qcow2 写时复制卷
+        """
         if not default_pool_path:
             default_pool_path = "/var/lib/libvirt/images"
+        backing_xml = ""
+        if backing_store:
+            backing_xml = """
+            <backingStore>
+                <path>""" + backing_store["path"] + """</path>
+                <format type='""" + backing_store["format"] + """'/>
+            </backingStore>"""
         return """
         <volume>
             <name>""" + volume_name + """</name>
@@ -249,7 +450,7 @@ class LibvirtManager(LibvirtBase):
                     <mode>0744</mode>
                     <label>virt_image_t</label>
                 </permissions>
-            </target>
+            </target>""" + backing_xml + """
         </volume>
         """
 
@@ -273,8 +474,49 @@ class LibvirtManager(LibvirtBase):
         else:
             return {}
 
+    def overlay_volume(self, volume_name, default_pool_path, volume_size,
+                       image_info):
+        """
+        创建以 images 池中镜像为 backing file 的 qcow2 卷，不复制镜像数据
+        """
+        # overlay 容量不能小于基础镜像
+        volume_size = max(int(volume_size),
+                          int(math.ceil(image_info["capacity"] / 1024 ** 3)))
+        backing_store = {
+            "path": image_info["path"],
+            "format": "qcow2" if image_info["type"] == "qcow2" else "raw"}
+        volume_xml = self.generate_volume_xml(
+            volume_name, default_pool_path, str(volume_size), backing_store)
+
+        if not self.volume_info(volume_name):
+            self.get_pool().createXML(volume_xml, 0)
+            return self.volume_info(volume_name)
+        else:
+            return {}
+
+    def get_overlays(self, path):
+        """
+        返回 default 池中以 path 为 backing file 的卷名
+        """
+        overlays = []
+        for volume in self.get_pool().listAllVolumes(0):
+            backing = ET.fromstring(volume.XMLDesc(0)).find(
+                "backingStore/path")
+            if backing is not None and backing.text == path:
+                overlays.append(volume.name())
+        return overlays
+
+    def _check_no_overlays(self, volume):
+        overlays = self.get_overlays(volume.path())
+        if overlays:
+            raise CustomException(
+                "volume %s is the backing file of %s, delete them first" %
+                (volume.name(), ", ".join(overlays)), 409)
+
     def list_volumes(self, pool_name="default"):
         pool = self.get_pool(pool_name)
+        # attached_to 取自卷索引，整个列表只同步一次
+        self.inventory.sync(self)
         vols = [self.volume_info(vol, pool_name)
                 for vol in pool.listVolumes()]
         return vols
@@ -284,7 +526,115 @@ class LibvirtManager(LibvirtBase):
         images = [vol for vol in self.list_volumes("images")]
         return images
 
+    def image_size(self, image_name):
+        """
+        镜像文件的实际大小(Byte)，镜像不存在时返回 None
+        """
+        volume = self.get_volume(image_name, "images")
+        if not volume:
+            return None
+        try:
+            return volume.infoFlags(
+                libvirt.VIR_STORAGE_VOL_GET_PHYSICAL)[2]
+        except libvirtError as e:
+            LOG.debug(e)
+            return volume.info()[1]
+
+    def upload_image(self, image_name, reader, length, offset=0, total=None,
+                     sparse=True):
+        """
+        从 reader 分块读取 length 字节写入 images 池中的镜像 offset 处，
+        不在内存中缓存整个文件。镜像不存在时按 total 大小创建。
+        sparse 为 True 时全零块以空洞发送。
+        """
+        pool = self.get_pool("images")
+        volume = self.get_volume(image_name, "images")
+        if volume is None:
+            volume = pool.createXML(IMAGE_VOLUME_XML % (
+                image_name, total or offset + length), 0)
+
+        flags = libvirt.VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM if sparse else 0
+        stream = self.conn.newStream(0)
+        start = time.time()
+        sent = 0
+        try:
+            volume.upload(stream, offset, length, flags)
+            while sent < length:
+                chunk = reader.read(min(STREAM_CHUNK_SIZE, length - sent))
+                if not chunk:
+                    raise CustomException(
+                        "request body ended at %s of %s bytes" %
+                        (sent, length), 400)
+                if sparse and chunk == ZERO_CHUNK[:len(chunk)]:
+                    stream.sendHole(len(chunk), 0)
+                else:
+                    data = chunk
+                    while data:
+                        data = data[stream.send(data):]
+                sent += len(chunk)
+                UPLOAD_OFFSETS[image_name] = offset + sent
+            stream.finish()
+        except Exception:
+            _abort_stream(stream)
+            raise
+        UPLOAD_OFFSETS.pop(image_name, None)
+        # 重新探测镜像格式和大小
+        pool.refresh(0)
+
+        elapsed = max(time.time() - start, 1e-6)
+        LOG.info("upload image %s: %s bytes in %.2fs" %
+                 (image_name, sent, elapsed))
+        return {"name": image_name,
+                "offset": offset,
+                "bytes": sent,
+                "seconds": round(elapsed, 3),
+                "throughput": round(sent / elapsed / 1024 / 1024, 2)}
+
+    def download_image(self, image_name, offset=0, length=0, sparse=True):
+        """
+        生成器，分块读取 images 池中的镜像。length 为 0 时读到文件末尾。
+        sparse 为 True 时空洞由 libvirt 以长度返回，在本地展开为全零块。
+        """
+        volume = self.get_volume(image_name, "images")
+        flags = libvirt.VIR_STORAGE_VOL_DOWNLOAD_SPARSE_STREAM if sparse else 0
+        stream = self.conn.newStream(0)
+        start = time.time()
+        received = 0
+        try:
+            volume.download(stream, offset, length, flags)
+            while True:
+                if sparse:
+                    data = stream.recvFlags(
+                        STREAM_CHUNK_SIZE, libvirt.VIR_STREAM_RECV_STOP_AT_HOLE)
+                    if data == -3:
+                        hole = stream.recvHole(0)
+                        received += hole
+                        while hole > 0:
+                            size = min(hole, STREAM_CHUNK_SIZE)
+                            yield ZERO_CHUNK if size == STREAM_CHUNK_SIZE \
+                                else bytes(size)
+                            hole -= size
+                        continue
+                else:
+                    data = stream.recv(STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                received += len(data)
+                yield data
+            stream.finish()
+        except BaseException:
+            _abort_stream(stream)
+            raise
+        finally:
+            elapsed = max(time.time() - start, 1e-6)
+            LOG.info("download image %s: %s bytes in %.2fs, %.2f MB/s" %
+                     (image_name, received, elapsed,
+                      received / elapsed / 1024 / 1024))
+
     def volume_info(self, volume_name, pool_name="default"):
+        """
+        attached_to 直接读取卷索引，需要最新结果时调用方先 inventory.sync
+        """
         volume = self.get_volume(volume_name, pool_name)
         if not volume:
             return volume
@@ -295,12 +645,20 @@ class LibvirtManager(LibvirtBase):
             "path": path,
             "capacity": volume_info[1],
             "allocation": volume_info[2],
-            "type": volume_name.split(".")[-1]
+            "type": volume_name.split(".")[-1],
+            "attached_to": self.volumes.lookup(path)
         }
         return vol
 
-    def delete_volume(self, volume_name):
-        volume = self.get_volume(volume_name)
+    def delete_volume(self, volume_name, pool_name="default"):
+        volume = self.get_volume(volume_name, pool_name)
+        self.inventory.sync(self)
+        attached_to = self.volumes.lookup(volume.path())
+        if attached_to:
+            raise CustomException("volume %s is in use by %s" %
+                                  (volume_name, ", ".join(attached_to)), 409)
+        # 仍被 overlay 依赖的基础镜像不能删除
+        self._check_no_overlays(volume)
         # 物理删除
         volume.wipe(0)
         # 从pool中逻辑删除
@@ -315,16 +673,9 @@ class LibvirtManager(LibvirtBase):
 
     def resize_volume(self, volume_name, new_size):
         volume = self.get_volume(volume_name)
-        path = volume.path()
-        vm_name = ""
-        for vm in self.list_vms():
-            vm_disk = self.get_disks(vm.get("name"))
-            for key in vm_disk.keys():
-                if vm_disk[key] == path:
-                    vm_name = vm.get("name")
-        if vm_name:
-            state = self.get_vm_state(vm_name)
-            if state != "shutdown":
+        self.inventory.sync(self)
+        for vm_name in self.volumes.lookup(volume.path()):
+            if self.inventory.get_by_name(vm_name)["state"] != "Stopped":
                 return "The volume is in use, please uninstall or shutdown and try again"
         return volume.resize(new_size) == 0
 
@@ -335,7 +686,19 @@ class LibvirtManager(LibvirtBase):
         state = VIRT_STATE_NAME_MAP.get(raw[0], "Unknown")
         return state
 
-    def create_vm(self, args):
+    def prepare_create(self, image):
+        """
+        创建虚拟机前的公共查询，批量创建时只执行一次
+        """
+        default_pool_path = xml_to_dict(self.get_pool().XMLDesc()).get(
+            "pool").get("target").get("path")
+        image_info = self.volume_info(image, "images")
+        if not image_info:
+            raise CustomException("not found image %s" % image, 400)
+        return {"default_pool_path": default_pool_path,
+                "image_info": image_info}
+
+    def create_vm(self, args, job=None, context=None):
         """
         args = {
             "name": "test",
@@ -346,49 +709,75 @@ class LibvirtManager(LibvirtBase):
         }
 
         create_vm(args)
+
+        job 为 JobManager 中的任务时，执行过程中更新任务阶段和复制进度
+        context 为 prepare_create 的结果，不传时重新查询
         """
+        job = job or Job("create_vm", args["name"])
 
         if self.get_vm_info(args["name"]):
             raise Exception("instance %s is exist." % args["name"])
 
-        default_pool_path = xml_to_dict(self.get_pool().XMLDesc()).get(
-            "pool").get("target").get("path")
-
-        image_info = self.volume_info(args["image"], "images")
+        job.set_phase("prepare")
+        context = context or self.prepare_create(args["image"])
+        default_pool_path = context["default_pool_path"]
+        image_info = context["image_info"]
         boot_name = args["name"] + ".qcow2"
         options = {
             "name": args["name"],
             "vcpu": args["vcpu"],
             "description": args.get("description", ""),
             "mem": args.get("mem", "1"),
+            "flavor": args.get("flavor"),
+            "group": args.get("group") or "",
+            "placement": args.get("placement") or "",
             "boot": default_pool_path + "/" + boot_name
         }
+        provision = args.get("provision") or CONF.get(
+            "default", "provision_mode")
+        job.volume = boot_name
+        job.host = self.host.name
         if image_info["type"] == "iso":
+            job.set_phase("create_volume")
             self.create_volume(boot_name, default_pool_path,
                                str(args["volume_size"]))
             options["image"] = image_info["path"]
+        elif provision == "overlay":
+            job.set_phase("overlay")
+            self.overlay_volume(boot_name, default_pool_path,
+                                args["volume_size"], image_info)
         else:
+            job.bytes_total = image_info["allocation"]
+            job.set_phase("clone")
             image = self.get_volume(args["image"], "images")
             self.clone_volume(boot_name, default_pool_path,
                               str(args["volume_size"]), image)
+            job.bytes_copied = job.bytes_total
 
         guest = Guest(self.conn, options)
 
-        xml = bytes.decode(guest.guestGetXML(
-            options["boot"], options.get("image", ""))).replace("\n", "")
+        xml = guest.guestGetXML(options["boot"], options.get("image", ""))
 
+        job.set_phase("start")
         self.conn.createXML(xml, 0)
+        job.set_phase("define")
         self.conn.defineXML(xml)
         LOG.info("创建云主机成功：%s" % options["name"])
         return self.get_vm_info(args["name"])
 
     def destroy(self, vm_name):
         dom = self._get_dom(vm_name)
+        self.inventory.mark_dirty(dom.UUIDString())
         return dom.destroy() == 0
 
     def delete(self, vm_name):
         volumes = self.get_disks(vm_name)
         volume_names = [volume['name'] for volume in volumes if volume]
+        # 删除前检查，避免虚拟机已删除而磁盘因被依赖无法删除
+        for volume_name in volume_names:
+            volume = self.get_volume(volume_name)
+            if volume:
+                self._check_no_overlays(volume)
         if self.get_vm_state(vm_name) in ["Running", "Stopping"]:
             self.destroy(vm_name)
             try:
@@ -409,6 +798,7 @@ class LibvirtManager(LibvirtBase):
 
     def create(self, vm_name):
         dom = self._get_dom(vm_name)
+        self.inventory.mark_dirty(dom.UUIDString())
         return dom.create() == 0
 
     def start(self, vm_name):
@@ -416,6 +806,7 @@ class LibvirtManager(LibvirtBase):
 
     def reboot(self, vm_name):
         dom = self._get_dom(vm_name)
+        self.inventory.mark_dirty(dom.UUIDString())
         # reboot has a few modes of operation, passing 0 in means the
         # hypervisor will pick the best method for rebooting
         return dom.reboot(0) == 0
@@ -426,6 +817,8 @@ class LibvirtManager(LibvirtBase):
 
     def set_auto_start(self, vm_name, state="on"):
         dom = self._get_dom(vm_name)
+        # 自启动变更没有对应的 libvirt 事件
+        self.inventory.mark_dirty(dom.UUIDString())
 
         if state == "on":
             return dom.setAutostart(1) == 0
@@ -435,49 +828,77 @@ class LibvirtManager(LibvirtBase):
             # return False if state is set to something other then on or off
             return False
 
-    def shutdown(self, vm_name):
+    def shutdown(self, vm_name, mode=None):
+        """
+        发起关机后立即返回，mode 为 acpi 或 agent，默认由 hypervisor 选择
+        """
         dom = self._get_dom(vm_name)
+        self.inventory.mark_dirty(dom.UUIDString())
+        if mode:
+            return dom.shutdownFlags(
+                getattr(libvirt, SHUTDOWN_MODES[mode])) == 0
         return dom.shutdown() == 0
 
+    def suspend(self, vm_name):
+        dom = self._get_dom(vm_name)
+        self.inventory.mark_dirty(dom.UUIDString())
+        return dom.suspend() == 0
+
+    def resume(self, vm_name):
+        dom = self._get_dom(vm_name)
+        self.inventory.mark_dirty(dom.UUIDString())
+        return dom.resume() == 0
+
     def undefine(self, vm_name):
         dom = self._get_dom(vm_name)
-        return dom.undefine() == 0
+        ret = dom.undefine() == 0
+        self.inventory.remove(dom.UUIDString())
+        return ret
 
     def get_total_mem(self):
-        mem = self.conn.getInfo()[1]
+        # 大页池中的内存只能分配给使用大页的虚拟机，单独记账
+        mem = self.conn.getInfo()[1] - self.host.hugepages.total_mib()
         # 预留10%的内存分配给libvirt程序
         mem -= mem / 10
         return math.floor(mem)
 
     def get_free_mem(self):
-        mem = self.get_total_mem()
-        for vm in self.list_vms():
-            dom = self._get_dom(vm.get("name"))
-            if dom.ID() > 0:
-                mem -= dom.info()[2] / 1024
-        return math.floor(mem)
+        self.inventory.sync(self)
+        return math.floor(self.get_total_mem() - self.ledger.memory -
+                          self.ledger.reserved_memory)
 
     def get_total_cpu(self):
         return int(CONF.get('default', 'available_cpu'))
 
     def get_free_cpu(self):
-        cpus = self.get_total_cpu()
-        for vm in self.list_vms():
-            dom = self._get_dom(vm.get("name"))
-            if dom.ID() > 0:
-                cpus -= dom.info()[3]
-        return cpus
+        self.inventory.sync(self)
+        return self.get_total_cpu() - self.ledger.vcpus - self.ledger.reserved_vcpus
+
+    def job_info(self, job):
+        # 克隆过程中以目标卷的已分配大小作为已复制字节数
+        for item in job.children or [job]:
+            if item.phase == "clone" and item.volume:
+                volume = self.volume_info(item.volume, item.pool)
+                if volume:
+                    item.bytes_copied = volume["allocation"]
+        if job.children:
+            job.bytes_copied = sum(child.bytes_copied
+                                   for child in job.children)
+        return job.to_dict()
 
     def get_resources(self):
         total_vcpus = self.get_total_cpu()
         free_vcpus = self.get_free_cpu()
         total_memory = self.get_total_mem()
         free_memory = self.get_free_mem()
-        default_pool_info = self.get_pool().info()
-        images_pool_info = self.get_pool('images').info()
-        images_num = len(self.list_volumes('images'))
-        volume_num = len(self.list_volumes())
-        vms = self.list_vms()
+        default_pool = self.get_pool()
+        images_pool = self.get_pool('images')
+        default_pool_info = default_pool.info()
+        images_pool_info = images_pool.info()
+        images_num = images_pool.numOfVolumes()
+        volume_num = default_pool.numOfVolumes()
+        vms = self.inventory.list()
+        hosts = HOSTS.list()
         res = {
             "cpu": {
                 "total": total_vcpus,
@@ -518,18 +939,19 @@ class LibvirtManager(LibvirtBase):
                 "stop": len([vm for vm in vms if vm['state'] != 'Running']),
             },
             "host": {
-                "total": 1,
-                "run": 1,
-                "stop": 0,
+                "total": len(hosts),
+                "run": len([host for host in hosts if not host.last_error]),
+                "stop": len([host for host in hosts if host.last_error]),
             },
         }
         return res
 
     def set_vcpus(self, vm_name, vcpus, config=False):
-        if self.get_vm_state(vm_name) != "shutdown":
+        if self.get_vm_state(vm_name) != "Stopped":
             return False
 
         dom = self._get_dom(vm_name)
+        self.inventory.mark_dirty(dom.UUIDString())
         flags = libvirt.VIR_DOMAIN_VCPU_MAXIMUM
 
         if config:
@@ -541,10 +963,11 @@ class LibvirtManager(LibvirtBase):
         return ret1 == ret2 == 0
 
     def set_mem(self, vm_name, memory, config=False):
-        if self.get_vm_state(vm_name) != "shutdown":
+        if self.get_vm_state(vm_name) != "Stopped":
             return False
 
         dom = self._get_dom(vm_name)
+        self.inventory.mark_dirty(dom.UUIDString())
 
         # libvirt has a funny bitwise system for the flags in that the flag
         # to affect the "current" setting is 0, which means that to set the
@@ -562,7 +985,8 @@ class LibvirtManager(LibvirtBase):
 
     def get_host_info(self):
         raw = self.conn.getInfo()
-        info = {"host_ip": CONF.get("default", "libvirt_url").split("/")[2],
+        info = {"name": self.host.name,
+                "host_ip": self.uri.split("/")[2],
                 "cpucores": raw[6],
                 "cpumhz": raw[3],
                 "cpumodel": str(raw[0]),
@@ -572,3 +996,460 @@ class LibvirtManager(LibvirtBase):
                 "phymemory": raw[1] * 1024 * 1024,  # 默认是MB，转换为Byte
                 "sockets": raw[5]}
         return info
+
+
+
+def _match_state(state, expected):
+    """
+    state 为 libvirt 状态码或 VIRT_STATE_NAME_MAP 中的名称，忽略大小写
+    """
+    if not expected:
+        return True
+    if not isinstance(state, str):
+        state = VIRT_STATE_NAME_MAP.get(state, "Unknown")
+    return state.lower() == expected.lower()
+
+
+
+def fleet_page_vms(host=None, state=None, name_prefix=None, fields=None,
+                   limit=None, marker=None):
+    """
+    并发查询所有主机(或指定主机)的虚拟机列表，按名称合并后分页，
+    总耗时取决于最慢的主机。
+
+    返回 {"vms": [...], "next_marker": ..., "version": ..., "errors": {...}}，
+    errors 为查询失败的主机；version 由各主机的清单版本组成，
+    任一主机缓存不可用或查询失败时为 None。
+    """
+    hosts = [HOSTS.get(host)] if host else HOSTS.list()
+    pages, errors = HOSTS.map(
+        lambda h: query_page(h, state, name_prefix, fields, limit, marker),
+        hosts)
+    return merge_pages(pages, errors, fields, limit)
+
+
+def parse_list_params(args):
+    """
+    校验列表请求的 limit、fields 参数，返回 (limit, fields)
+    """
+    limit = args.get("limit")
+    if limit is not None:
+        if not limit.isdigit() or int(limit) <= 0:
+            raise CustomException("incorrect param limit", 400)
+        limit = int(limit)
+    fields = None
+    if args.get("fields"):
+        fields = [f.strip() for f in args["fields"].split(",") if f.strip()]
+        unknown = [f for f in fields if f not in VM_FIELDS]
+        if unknown:
+            raise CustomException("unknown fields: %s" % ",".join(unknown), 400)
+    return limit, fields
+
+
+def query_page(h, state=None, name_prefix=None, fields=None, limit=None,
+               marker=None):
+    """
+    查询一台主机的一页虚拟机
+    """
+    # 合并排序需要 name
+    host_fields = fields and list(set(fields) | {"name"})
+    with LibvirtManager(host=h.name) as lib:
+        return lib.page_vms(state, name_prefix, host_fields, limit, marker)
+
+
+def merge_pages(pages, errors, fields=None, limit=None):
+    """
+    按名称合并各主机的结果后分页，pages/errors 为 {host name: ...}
+    """
+    vms = []
+    more = False
+    for page in pages.values():
+        vms.extend(page["vms"])
+        more = more or page["next_marker"] is not None
+    vms.sort(key=lambda vm: vm["name"])
+    next_marker = None
+    if limit and (more or len(vms) > limit):
+        vms = vms[:limit]
+        next_marker = vms[-1]["name"] if vms else None
+    if fields:
+        vms = [dict((field, vm[field]) for field in fields) for vm in vms]
+
+    versions = [page["version"] for page in pages.values()]
+    version = None
+    if not errors and None not in versions:
+        version = ",".join("%s:%s" % (name, page["version"])
+                           for name, page in pages.items())
+    return {"vms": vms, "next_marker": next_marker, "version": version,
+            "errors": errors}
+
+
+def find_vm(name, hosts=None):
+    """
+    返回虚拟机所在的主机名，找不到时返回 None。
+    先查各主机的清单缓存，未命中时并发查询所有主机。
+    """
+    hosts = hosts or HOSTS.list()
+    for h in hosts:
+        if h.inventory.get_by_name(name):
+            return h.name
+
+    def lookup(h):
+        with LibvirtManager(host=h.name) as lib:
+            try:
+                lib._get_dom(name)
+                return True
+            except libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+                return False
+
+    found, _ = HOSTS.map(lookup, hosts)
+    for host_name, exists in found.items():
+        if exists:
+            return host_name
+    return None
+
+
+def vm_exists(name):
+    """
+    虚拟机名称在所有主机中唯一，创建前检查
+    """
+    return find_vm(name) is not None
+
+
+def locate_vm(name, host=None):
+    """
+    返回操作虚拟机时使用的主机名，host 不为空时直接使用 host。
+    只有一台主机时不查询；找不到时返回 None，
+    调用方使用第一台主机，沿用原有的错误处理。
+    不能用于判断虚拟机是否存在，见 vm_exists。
+    """
+    if host:
+        return HOSTS.get(host).name
+    hosts = HOSTS.list()
+    if len(hosts) == 1:
+        return hosts[0].name
+    return find_vm(name, hosts)
+
+
+def fleet_managers():
+    """
+    每台主机一个 LibvirtManager，供后台同步线程使用
+    """
+    return [LibvirtManager(host=host.name) for host in HOSTS.list()]
+
+
+def create_vm_job(job, args, reservation):
+    """
+    JobManager 中执行的创建任务，结束后释放预留资源，失败时同时释放磁盘空间
+    """
+    try:
+        with LibvirtManager(host=args.get("host")) as lib:
+            return lib.create_vm(args, job)
+    except Exception:
+        HOSTS.get(args.get("host")).ledger.release_disk(reservation)
+        raise
+    finally:
+        host = HOSTS.get(args.get("host"))
+        host.ledger.unreserve(reservation)
+        host.cpus.unclaim(reservation)
+        host.hugepages.unclaim(reservation)
+
+
+def _rollback_vm(name, host=None):
+    """
+    清理批量创建中的虚拟机及其启动盘，忽略不存在的资源
+    """
+    with LibvirtManager(host=host) as lib:
+        try:
+            dom = lib._get_dom(name)
+            if dom.isActive():
+                lib.destroy(name)
+            lib.undefine(name)
+        except libvirtError as e:
+            LOG.debug(e)
+        if lib.get_volume(name + ".qcow2"):
+            lib.delete_volume(name + ".qcow2")
+
+
+def create_vm_batch_job(job, names, template, parallelism, reservation,
+                        atomic=False, placements=None):
+    """
+    批量创建虚拟机，公共查询只执行一次，各虚拟机的克隆和启动并发执行，
+    并发数为 parallelism。
+
+    创建失败的虚拟机清理其启动盘；atomic 为 True 时，任一虚拟机失败则
+    回滚整批已创建的虚拟机。
+    placements 为调度器为每台虚拟机生成的 numatune/cputune。
+    """
+    host = template.get("host")
+    results = collections.OrderedDict(
+        (name, {"name": name, "status": "pending", "error": None})
+        for name in names)
+    job.result = list(results.values())
+
+    def create_one(name):
+        args = dict(template, name=name)
+        if placements:
+            args["placement"] = placements.get(name, "")
+        results[name]["status"] = "running"
+        child = Job("create_vm", name)
+        job.children.append(child)
+        try:
+            with LibvirtManager(host=host) as lib:
+                # 已存在的虚拟机或磁盘不属于本批次，不能回滚
+                if lib.get_vm_info(name) or lib.get_volume(name + ".qcow2"):
+                    results[name]["status"] = "failed"
+                    results[name]["error"] = "instance %s is exist." % name
+                    return
+                lib.create_vm(args, job=child, context=context)
+            results[name]["status"] = "created"
+        except Exception as e:
+            LOG.warning("batch create %s failed: %s" % (name, e))
+            results[name]["status"] = "failed"
+            results[name]["error"] = str(e)
+            _rollback_vm(name, host)
+
+    job.host = host
+    try:
+        job.set_phase("prepare")
+        with LibvirtManager(host=host) as lib:
+            context = lib.prepare_create(template["image"])
+        if context["image_info"]["type"] != "iso":
+            job.bytes_total = context["image_info"]["allocation"] * len(names)
+
+        job.set_phase("provision")
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            list(executor.map(create_one, names))
+
+        failed = [name for name, r in results.items()
+                  if r["status"] == "failed"]
+        if failed and atomic:
+            job.set_phase("rollback")
+            for name, r in results.items():
+                if r["status"] == "created":
+                    _rollback_vm(name, host)
+                    r["status"] = "rolled_back"
+        if failed:
+            raise CustomException("%s of %s vms failed: %s" %
+                                  (len(failed), len(names), ", ".join(failed)))
+        return job.result
+    finally:
+        h = HOSTS.get(host)
+        h.ledger.unreserve(reservation)
+        h.cpus.unclaim(reservation)
+        h.hugepages.unclaim(reservation)
+        # 未创建成功(失败、回滚、未执行)的虚拟机不占用磁盘空间
+        created = len([r for r in results.values()
+                       if r["status"] == "created"])
+        if created < len(names):
+            h.ledger.release_disk(reservation,
+                                  1 - float(created) / len(names))
+
+
+def _watch(h, lib, dom, events):
+    """
+    在发起操作前注册生命周期事件，主机不支持事件时返回 None
+    """
+    # 先建立事件连接，保证操作产生的事件能送达
+    h.inventory.ensure_bound(lib.uri)
+    if not h.inventory.bound:
+        return None
+    return h.inventory.watch(
+        dom.UUIDString(),
+        [event if event == REBOOTED else getattr(libvirt, event)
+         for event in events])
+
+
+def _wait_state(host, name, waiter, target, timeout):
+    """
+    等待虚拟机到达 target 状态，返回最终状态，等待期间不占用连接。
+    waiter 为 None 时（主机不支持事件）退化为每秒查询一次状态。
+    """
+    if waiter:
+        waiter.wait(timeout)
+    else:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with LibvirtManager(host=host) as lib:
+                if lib.get_vm_state(name) == target:
+                    break
+            time.sleep(1)
+    with LibvirtManager(host=host) as lib:
+        return lib.get_vm_state(name)
+
+
+def power_action(name, action, host=None, wait=False, timeout=300):
+    """
+    对一台虚拟机执行电源操作，返回 {"name", "host", "status", "state"}。
+
+    wait 为 True 时在发起操作前注册生命周期事件，操作后等待目标状态，
+    超过 timeout 秒 status 为 timeout。reboot 等待客户机的重启事件，
+    主机不支持事件时不等待。
+    已处于目标状态的虚拟机不重复操作（reboot、hard_reboot 除外），
+    status 为 unchanged。
+    """
+    method, target, events = POWER_ACTIONS[action]
+    host = locate_vm(name, host)
+    h = HOSTS.get(host)
+    result = {"name": name, "host": host, "status": "done", "state": None}
+    waiter = None
+    try:
+        with LibvirtManager(host=host) as lib:
+            dom = lib._get_dom(name)
+            state = lib.get_vm_state(name)
+            if action not in RESTART_ACTIONS and state == target:
+                result.update(status="unchanged", state=state)
+                return result
+            if wait:
+                waiter = _watch(h, lib, dom, events)
+            LOG.info("%s vm: %s" % (action, name))
+            getattr(lib, method)(name)
+            state = lib.get_vm_state(name)
+
+        if wait and action == "reboot":
+            # 重启前后都是 Running，只能等重启事件
+            if waiter and not waiter.wait(timeout):
+                result["status"] = "timeout"
+            with LibvirtManager(host=host) as lib:
+                state = lib.get_vm_state(name)
+        elif wait and state != target:
+            state = _wait_state(host, name, waiter, target, timeout)
+            if state != target:
+                result["status"] = "timeout"
+        result["state"] = state
+        return result
+    finally:
+        if waiter:
+            h.inventory.unwatch(waiter)
+
+
+def graceful_shutdown(name, host=None, acpi_timeout=60, agent_timeout=30):
+    """
+    依次尝试 ACPI 关机、guest agent 关机，各自等待 VIR_DOMAIN_EVENT_STOPPED
+    事件，超时后进入下一步，最后强制关机。超时为 0 的步骤跳过。
+
+    返回 {"name", "host", "status", "method", "state"}，method 为使虚拟机
+    关机的方式：acpi、agent 或 destroy。
+    """
+    host = locate_vm(name, host)
+    h = HOSTS.get(host)
+    result = {"name": name, "host": host, "status": "done", "method": None,
+              "state": None}
+    waiter = None
+    try:
+        with LibvirtManager(host=host) as lib:
+            dom = lib._get_dom(name)
+            state = lib.get_vm_state(name)
+            if state == "Stopped":
+                result.update(status="unchanged", state=state)
+                return result
+            waiter = _watch(h, lib, dom, ("VIR_DOMAIN_EVENT_STOPPED",))
+
+        for method, timeout in (("acpi", acpi_timeout),
+                                ("agent", agent_timeout)):
+            if timeout <= 0:
+                continue
+            try:
+                with LibvirtManager(host=host) as lib:
+                    LOG.info("shutdown vm %s: %s" % (name, method))
+                    lib.shutdown(name, method)
+            except libvirtError as e:
+                # 没有 guest agent、虚拟机已关机等，进入下一步
+                LOG.warning("shutdown vm %s by %s failed: %s" %
+                            (name, method, e))
+                continue
+            state = _wait_state(host, name, waiter, "Stopped", timeout)
+            if state == "Stopped":
+                result.update(method=method, state=state)
+                return result
+
+        LOG.warning("shutdown vm %s timed out, destroy" % name)
+        with LibvirtManager(host=host) as lib:
+            try:
+                lib.destroy(name)
+            except libvirtError as e:
+                # 强制关机前虚拟机已自行关机
+                LOG.warning("destroy vm %s failed: %s" % (name, e))
+            state = lib.get_vm_state(name)
+        result.update(method="destroy", state=state)
+        if state != "Stopped":
+            result["status"] = "failed"
+        return result
+    finally:
+        if waiter:
+            h.inventory.unwatch(waiter)
+
+
+def shutdown_vms_job(job, names, host=None, priorities=None, parallelism=8,
+                     acpi_timeout=60, agent_timeout=30):
+    """
+    按优先级分批关机，priority 小的先关，同一优先级为一批，
+    批内并发数为 parallelism，上一批全部结束后才开始下一批。
+    任务结果为每台虚拟机的关机结果。
+    """
+    priorities = priorities or {}
+    names = sorted(names, key=lambda name: priorities.get(name, 0))
+    results = collections.OrderedDict(
+        (name, {"name": name, "priority": priorities.get(name, 0),
+                "status": "pending", "method": None, "state": None,
+                "error": None})
+        for name in names)
+    job.result = list(results.values())
+
+    def stop(name):
+        results[name]["status"] = "running"
+        try:
+            results[name].update(graceful_shutdown(
+                name, host, acpi_timeout, agent_timeout))
+        except Exception as e:
+            LOG.warning("shutdown %s failed: %s" % (name, e))
+            results[name]["status"] = "failed"
+            results[name]["error"] = str(e)
+
+    waves = collections.OrderedDict()
+    for name in names:
+        waves.setdefault(priorities.get(name, 0), []).append(name)
+    for priority, wave in waves.items():
+        job.set_phase("priority %s" % priority)
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            list(executor.map(stop, wave))
+
+    failed = [name for name, r in results.items() if r["status"] == "failed"]
+    if failed:
+        raise CustomException("%s of %s vms failed: %s" %
+                              (len(failed), len(names), ", ".join(failed)))
+    return job.result
+
+
+def vm_actions_job(job, names, action, parallelism, host=None, wait=False,
+                   timeout=300):
+    """
+    批量电源操作，并发数为 parallelism，任务结果为每台虚拟机的操作结果。
+    """
+    results = collections.OrderedDict(
+        (name, {"name": name, "action": action, "status": "pending",
+                "state": None, "error": None})
+        for name in names)
+    job.result = list(results.values())
+
+    def act(name):
+        results[name]["status"] = "running"
+        try:
+            results[name].update(
+                power_action(name, action, host, wait, timeout))
+        except Exception as e:
+            LOG.warning("%s %s failed: %s" % (action, name, e))
+            results[name]["status"] = "failed"
+            results[name]["error"] = str(e)
+
+    job.set_phase(action)
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        list(executor.map(act, names))
+
+    failed = [name for name, r in results.items()
+              if r["status"] in ("failed", "timeout")]
+    if failed:
+        raise CustomException("%s of %s vms failed: %s" %
+                              (len(failed), len(names), ", ".join(failed)))
+    return job.result
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from array import array
+
+import libvirt
+
+LOG = logging.getLogger(__name__)
+
+# 每次采样记录的字段，计数类字段为累计值，查询时换算为速率
+SAMPLE_FIELDS = ("time", "cpu_time", "vcpus",
+                 "rd_reqs", "wr_reqs", "rd_bytes", "wr_bytes",
+                 "rx_bytes", "tx_bytes", "rx_pkts", "tx_pkts",
+                 "balloon_current", "balloon_rss", "balloon_unused")
+
+# 累计计数字段 -> 速率字段
+RATE_FIELDS = (("rd_reqs", "disk_read_iops"),
+               ("wr_reqs", "disk_write_iops"),
+               ("rd_bytes", "disk_read_bps"),
+               ("wr_bytes", "disk_write_bps"),
+               ("rx_bytes", "net_rx_bps"),
+               ("tx_bytes", "net_tx_bps"),
+               ("rx_pkts", "net_rx_pps"),
+               ("tx_pkts", "net_tx_pps"))
+
+
+class RingBuffer():
+    """
+    定长环形缓冲区，每个字段一个 array('d')，容量固定，内存不随时间增长。
+    """
+
+    def __init__(self, capacity, fields=SAMPLE_FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self._data = dict((field, array("d", bytes(8 * capacity)))
+                          for field in fields)
+        self._next = 0
+        self.count = 0
+
+    def append(self, sample):
+        for field in self.fields:
+            self._data[field][self._next] = sample.get(field, 0)
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def last(self):
+        if not self.count:
+            return None
+        idx = (self._next - 1) % self.capacity
+        return dict((field, self._data[field][idx]) for field in self.fields)
+
+    def rows(self, since=0):
+        """
+        按时间顺序返回 time >= since 的样本
+        """
+        start = (self._next - self.count) % self.capacity
+        times = self._data["time"]
+        rows = []
+        for i in range(self.count):
+            idx = (start + i) % self.capacity
+            if times[idx] < since:
+                continue
+            rows.append(dict((field, self._data[field][idx])
+                             for field in self.fields))
+        return rows
+
+
+def _sum_stats(record, prefix, count_key, suffix):
+    total = 0
+    for i in range(record.get(count_key, 0)):
+        total += record.get("%s.%d.%s" % (prefix, i, suffix), 0)
+    return total
+
+
+def parse_stats(record, now):
+    """
+    将 getAllDomainStats 的一条记录转换为样本，多块磁盘、多块网卡累加
+    """
+    return {
+        "time": now,
+        "cpu_time": record.get("cpu.time", 0),
+        "vcpus": record.get("vcpu.current", 0),
+        "rd_reqs": _sum_stats(record, "block", "block.count", "rd.reqs"),
+        "wr_reqs": _sum_stats(record, "block", "block.count", "wr.reqs"),
+        "rd_bytes": _sum_stats(record, "block", "block.count", "rd.bytes"),
+        "wr_bytes": _sum_stats(record, "block", "block.count", "wr.bytes"),
+        "rx_bytes": _sum_stats(record, "net", "net.count", "rx.bytes"),
+        "tx_bytes": _sum_stats(record, "net", "net.count", "tx.bytes"),
+        "rx_pkts": _sum_stats(record, "net", "net.count", "rx.pkts"),
+        "tx_pkts": _sum_stats(record, "net", "net.count", "tx.pkts"),
+        # 单位为 KiB
+        "balloon_current": record.get("balloon.current", 0),
+        "balloon_rss": record.get("balloon.rss", 0),
+        "balloon_unused": record.get("balloon.unused", 0)}
+
+
+def derive_rates(prev, cur):
+    """
+    由相邻两个样本计算速率。虚拟机重启后计数器归零，差值为负时记为 0。
+    """
+    elapsed = cur["time"] - prev["time"]
+    if elapsed <= 0:
+        return None
+    # 内存单位转换为 Byte
+    point = {"time": cur["time"],
+             "mem_balloon": cur["balloon_current"] * 1024,
+             "mem_rss": cur["balloon_rss"] * 1024,
+             "mem_unused": cur["balloon_unused"] * 1024}
+    cpu_delta = max(cur["cpu_time"] - prev["cpu_time"], 0)
+    vcpus = cur["vcpus"] or 1
+    # 相对于虚拟机全部 vCPU 的使用率，cpu.time 单位为 ns
+    point["cpu_percent"] = round(
+        cpu_delta / (elapsed * 1e9 * vcpus) * 100, 2)
+    for counter, rate in RATE_FIELDS:
+        delta = max(cur[counter] - prev[counter], 0)
+        point[rate] = round(delta / elapsed, 2)
+    return point
+
+
+class MetricsCollector():
+    """
+    虚拟机性能采样。每个周期对每台主机调用一次 getAllDomainStats 取回所有
+    运行中虚拟机的统计，追加到各自的环形缓冲区；已停止或删除的虚拟机丢弃历史。
+    样本按主机名区分，不同主机上的同名虚拟机互不影响。
+    """
+
+    STATS = ("VIR_DOMAIN_STATS_CPU_TOTAL", "VIR_DOMAIN_STATS_VCPU",
+             "VIR_DOMAIN_STATS_BALLOON", "VIR_DOMAIN_STATS_INTERFACE",
+             "VIR_DOMAIN_STATS_BLOCK")
+
+    def __init__(self, interval=10, history=360):
+        self._lock = threading.Lock()
+        self._series = {}  # host name -> {vm name: RingBuffer}
+        self.interval = interval
+        self.history = history
+        self.last_sample = {}  # host name -> 采样时间
+
+    def configure(self, interval, history):
+        with self._lock:
+            self.interval = interval
+            self.history = history
+            self._series = {}
+
+    def sample(self, conn, host):
+        stats = 0
+        for name in self.STATS:
+            stats |= getattr(libvirt, name)
+        records = conn.getAllDomainStats(
+            stats, libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE)
+        now = time.time()
+
+        with self._lock:
+            old = self._series.get(host, {})
+            series = {}
+            for dom, record in records:
+                name = dom.name()
+                buf = old.get(name) or RingBuffer(self.history)
+                buf.append(parse_stats(record, now))
+                series[name] = buf
+            self._series[host] = series
+            self.last_sample[host] = now
+
+    def latest(self, host):
+        """
+        返回主机上每台虚拟机最近一次的样本 {vm name: sample}
+        """
+        with self._lock:
+            return dict((name, buf.last())
+                        for name, buf in self._series.get(host, {}).items())
+
+    def window(self, name, seconds, host):
+        """
+        返回最近 seconds 秒内的速率序列及平均值，没有该虚拟机的样本时返回 None
+        """
+        with self._lock:
+            buf = self._series.get(host, {}).get(name)
+            if buf is None:
+                return None
+            # 多取一个周期的样本，作为窗口内第一个点的差分基准
+            rows = buf.rows(time.time() - seconds - self.interval)
+
+        points = []
+        for prev, cur in zip(rows, rows[1:]):
+            point = derive_rates(prev, cur)
+            if point:
+                points.append(point)
+        summary = {}
+        if points:
+            for key in points[-1]:
+                if key != "time":
+                    summary[key] = round(
+                        sum(p[key] for p in points) / len(points), 2)
+        return {"name": name,
+                "interval": self.interval,
+                "window": seconds,
+                "samples": points,
+                "average": summary}
+
+
+COLLECTOR = MetricsCollector()
+
+_sampler_thread = None
+
+
+def _sample_loop(managers_factory):
+    while True:
+        start = time.time()
+        for lib in managers_factory():
+            try:
+                with lib:
+                    COLLECTOR.sample(lib.conn, lib.host.name)
+            except Exception as e:
+                LOG.warning("sample domain stats of %s failed: %s"
+                            % (lib.uri, e))
+        time.sleep(max(COLLECTOR.interval - (time.time() - start), 0))
+
+
+def start_sampler(managers_factory, interval, history):
+    """
+    启动采样线程，每 interval 秒采样一次，每台虚拟机保留 history 个样本。
+    managers_factory() 返回每台主机的 LibvirtManager。
+    interval <= 0 时不启动。
+    """
+    global _sampler_thread
+    if interval <= 0 or _sampler_thread is not None:
+        return
+    COLLECTOR.configure(interval, history)
+    _sampler_thread = threading.Thread(
+        target=_sample_loop, args=(managers_factory,),
+        name="metrics-sampler")
+    _sampler_thread.daemon = True
+    _sampler_thread.start()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import secrets
+import tempfile
+import threading
+
+from libvirtapi.libvirtoperations.inventory import INVENTORY
+
+LOG = logging.getLogger(__name__)
+
+
+def _target(listen, port):
+    if not listen or str(port) in ("", "-1", "None"):
+        return None
+    return (listen, str(port))
+
+
+class TokenRegistry():
+    """
+    novnc token -> (主机 IP, VNC 端口)。
+
+    读取虚拟机信息时由 get_vnc 调用 assign，VNC 地址不变时沿用原 token，
+    变化时（虚拟机启动、迁移）生成新的随机 token，关机后 token 失效，
+    每次开机都是新的 token。作为 DomainInventory 的监听者，
+    虚拟机删除时移除其 token。
+
+    配置了 token 文件时由后台线程写入，写临时文件后 rename，
+    websockify 不会读到写了一半的文件；只有 token 变化时才写。
+    也可以不用文件，websockify 通过 utils.novnc_plugin 查询本服务。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}  # token -> (listen, port)
+        self._domains = {}  # uuid -> token
+        self.path = ""
+        self.changed = threading.Event()
+
+    def assign(self, uuid, listen, port):
+        """
+        返回虚拟机当前的 token，没有 VNC 端口时返回 None
+        """
+        target = _target(listen, port)
+        with self._lock:
+            token = self._domains.get(uuid)
+            if token and self._tokens.get(token) == target:
+                return token
+            if token:
+                del self._tokens[token]
+                del self._domains[uuid]
+            if target is None:
+                if token:
+                    self.changed.set()
+                return None
+            token = secrets.token_urlsafe(16)
+            self._tokens[token] = target
+            self._domains[uuid] = token
+        self.changed.set()
+        return token
+
+    def __call__(self, old, new):
+        if new is None:
+            self.drop(old["uuid"])
+
+    def drop(self, uuid):
+        with self._lock:
+            token = self._domains.pop(uuid, None)
+            if token is None:
+                return
+            del self._tokens[token]
+        self.changed.set()
+
+    def lookup(self, token):
+        with self._lock:
+            return self._tokens.get(token)
+
+    def to_lines(self):
+        with self._lock:
+            return ["%s: %s:%s\n" % (token, listen, port)
+                    for token, (listen, port) in sorted(self._tokens.items())]
+
+    def write(self):
+        """
+        写临时文件后 rename 到 path
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(prefix=".novnc-token.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.writelines(self.to_lines())
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+
+NOVNC = TokenRegistry()
+INVENTORY.add_listener(NOVNC)
+
+
+def _run_writer():
+    while True:
+        NOVNC.changed.wait()
+        NOVNC.changed.clear()
+        try:
+            NOVNC.write()
+        except Exception as e:
+            LOG.warning("write novnc token file failed: %s" % e)
+
+
+def start_writer(path):
+    """
+    path 为空时不写文件，websockify 使用 utils.novnc_plugin
+    """
+    NOVNC.path = path
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    except OSError as e:
+        LOG.warning("create novnc token directory failed: %s" % e)
+    # 启动时写一次，清除上次运行留下的 token
+    NOVNC.changed.set()
+    thread = threading.Thread(target=_run_writer, name="novnc-token-writer")
+    thread.daemon = True
+    thread.start()
+
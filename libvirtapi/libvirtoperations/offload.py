@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+在 eventlet 下把阻塞的 libvirt 调用放到原生线程池中执行。
+
+libvirt-python 的调用是阻塞的 C 调用，eventlet 无法 monkey-patch，
+在 wsgi 的绿色线程中直接调用会阻塞整个进程。
+
+conn = offloaded(raw_conn)
+conn.lookupByName("test").XMLDesc(0)   # 在 tpool 中执行，当前绿色线程让出
+
+只包装主线程(wsgi 所在线程)中使用的连接；后台线程本身是原生线程，
+直接调用，不受超时限制。
+"""
+import logging
+import threading
+from concurrent import futures
+
+import eventlet
+from eventlet import tpool
+
+from libvirtapi.exs import CustomException
+
+LOG = logging.getLogger(__name__)
+
+# 不产生 RPC 的方法
+LOCAL_CALLS = frozenset(["name", "UUID", "UUIDString", "ID", "key",
+                         "connect"])
+
+_enabled = True
+_timeout = 60
+# 方法名 -> 超时(秒)，未列出的方法使用 _timeout
+_timeouts = {}
+
+
+class CallTimeout(CustomException):
+    """
+    调用超时时原生线程中的调用仍在继续，所用的连接不再归还连接池。
+    pending 在原生线程中的调用返回后 set，之后才能关闭该连接。
+    """
+
+    def __init__(self, message, code=504):
+        super().__init__(message, code)
+        self.pending = threading.Event()
+
+
+def parse_timeouts(value):
+    """
+    "createXMLFrom:3600, wipe:3600" -> {"createXMLFrom": 3600.0, "wipe": 3600.0}
+    """
+    timeouts = {}
+    for item in (value or "").split(","):
+        name, sep, seconds = item.strip().partition(":")
+        if sep:
+            timeouts[name.strip()] = float(seconds)
+    return timeouts
+
+
+def configure(enabled, threads, timeout, timeouts=""):
+    """
+    在第一次 offload 之前调用，tpool 的线程数在其初始化后不能修改
+    """
+    global _enabled, _timeout, _timeouts
+    _enabled = enabled
+    _timeout = timeout
+    _timeouts = parse_timeouts(timeouts)
+    tpool.set_num_threads(threads)
+
+
+def should_offload():
+    return _enabled and threading.current_thread() is threading.main_thread()
+
+
+def call(func, *args, **kwargs):
+    """
+    在 tpool 中执行 func，超过该方法的超时时间抛出 CallTimeout。
+    不在主线程中时直接调用。
+    """
+    if not should_offload():
+        return func(*args, **kwargs)
+    name = getattr(func, "__name__", str(func))
+    timeout = _timeouts.get(name, _timeout)
+    error = CallTimeout("libvirt call %s timed out after %ss" % (name, timeout))
+
+    def run():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            error.pending.set()
+
+    timer = None
+    if timeout > 0:
+        timer = eventlet.Timeout(timeout, error)
+    try:
+        return tpool.execute(run)
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+
+def wait(fs, timeout):
+    """
+    等待原生线程池中的 futures，在主线程中放到 tpool 里等待，不阻塞 hub
+    """
+    if not should_offload():
+        return futures.wait(fs, timeout=timeout)
+    return tpool.execute(futures.wait, fs, timeout=timeout)
+
+
+def _wrap(value, pending):
+    # libvirt 对象及其代理(如 rpctrace.TracedObject)都有 _o 句柄
+    if getattr(value, "_o", None) is not None:
+        return OffloadedObject(value, pending)
+    if isinstance(value, list):
+        return [_wrap(item, pending) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_wrap(item, pending) for item in value)
+    return value
+
+
+class OffloadedObject():
+    """
+    libvirt 对象的代理，方法调用在 tpool 中执行，返回的 libvirt 对象同样包装。
+    传给 libvirt 的代理对象通过 _o 属性取得底层句柄，与原对象等价。
+
+    同一连接上的代理共用 pending 列表，记录超时后仍在原生线程中执行的调用，
+    归还连接时据此决定丢弃连接并等这些调用返回后再关闭。
+    """
+
+    def __init__(self, obj, pending=None):
+        self._obj = obj
+        self.pending = [] if pending is None else pending
+
+    def __getattr__(self, item):
+        attr = getattr(self._obj, item)
+        if item in LOCAL_CALLS or item.startswith("_") or \
+                not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            try:
+                return _wrap(call(attr, *args, **kwargs), self.pending)
+            except CallTimeout as e:
+                self.pending.append(e.pending)
+                raise
+        return wrapper
+
+    def __eq__(self, other):
+        return self._obj == getattr(other, "_obj", other)
+
+    def __hash__(self):
+        return hash(self._obj)
+
+
+def offloaded(conn):
+    if not should_offload():
+        return conn
+    return OffloadedObject(conn)
@@ -2,19 +2,17 @@ from xml.etree.ElementTree import Element
 
 
 class OSXML():
-    def __init__(self, conn, arch=None):
-        if arch is None:
-            self.arch = 'x86_64'
-        self.arch = arch
+    def __init__(self, conn, arch=None, machine=None):
+        self.arch = arch or 'x86_64'
+        self.machine = machine
 
     def getXML(self):
         _os = Element('os')
 
-        _type = Element(
-            'type', attrib={'arch': self.arch, 'machine': 'pc-i440fx-rhel7.0.0'})
-
-        _type = Element(
-            'type', attrib={'arch': self.arch})
+        attrib = {'arch': self.arch}
+        if self.machine:
+            attrib['machine'] = self.machine
+        _type = Element('type', attrib=attrib)
 
         _type.text = 'hvm'
 
@@ -25,4 +23,4 @@ class OSXML():
         _os.append(boot2)
         _os.append(boot1)
 
-        return _os
+        return _os
\ No newline at end of file
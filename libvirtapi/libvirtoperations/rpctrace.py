@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+按请求统计 libvirt 调用次数和耗时。
+
+trace = start_trace()
+conn = traced(raw_conn)   # 只有存在活动 trace 时才包装
+...
+summary = end_trace()
+
+virConnect 返回的 virDomain、virStoragePool、virStorageVol 同样被包装，
+本地方法(name、UUIDString 等)不计数。没有活动 trace 时连接不包装，
+后台线程没有额外开销。
+"""
+import collections
+import heapq
+import threading
+import time
+
+import libvirt
+from eventlet import corolocal
+
+# 不产生 RPC 的方法
+LOCAL_CALLS = frozenset(["name", "UUID", "UUIDString", "ID", "key",
+                         "connect"])
+# 每个请求保留的最慢调用数
+SLOWEST = 5
+
+_local = corolocal.local()
+_history_lock = threading.Lock()
+_history = collections.deque(maxlen=100)
+
+
+class RequestTrace():
+    def __init__(self, label=""):
+        self.label = label
+        self.start = time.time()
+        self.count = 0
+        self.total = 0.0
+        self.calls = {}  # call name -> [count, total]
+        self._slowest = []  # heap of (elapsed, call)
+
+    def record(self, call, elapsed):
+        self.count += 1
+        self.total += elapsed
+        stat = self.calls.get(call)
+        if stat is None:
+            stat = self.calls[call] = [0, 0.0]
+        stat[0] += 1
+        stat[1] += elapsed
+        if len(self._slowest) < SLOWEST:
+            heapq.heappush(self._slowest, (elapsed, call))
+        elif elapsed > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (elapsed, call))
+
+    def summary(self):
+        return {
+            "request": self.label,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S",
+                                  time.localtime(self.start)),
+            "duration": round(time.time() - self.start, 6),
+            "rpc_count": self.count,
+            "rpc_time": round(self.total, 6),
+            "slowest": [{"call": call, "time": round(elapsed, 6)}
+                        for elapsed, call in sorted(self._slowest,
+                                                    reverse=True)],
+            "calls": dict((call, {"count": stat[0],
+                                  "time": round(stat[1], 6)})
+                          for call, stat in self.calls.items())}
+
+
+def configure(history):
+    global _history
+    with _history_lock:
+        _history = collections.deque(_history, maxlen=history)
+
+
+def start_trace(label=""):
+    _local.trace = RequestTrace(label)
+    return _local.trace
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+def end_trace():
+    trace = current_trace()
+    if trace is None:
+        return None
+    _local.trace = None
+    summary = trace.summary()
+    with _history_lock:
+        _history.append(summary)
+    return summary
+
+
+def recent(limit=None):
+    with _history_lock:
+        items = list(_history)
+    items.reverse()
+    return items[:limit] if limit else items
+
+
+_TRACED_TYPES = (libvirt.virConnect, libvirt.virDomain,
+                 libvirt.virStoragePool, libvirt.virStorageVol)
+
+
+def _wrap(value, trace):
+    if isinstance(value, _TRACED_TYPES):
+        return TracedObject(value, trace)
+    if isinstance(value, list):
+        return [_wrap(item, trace) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_wrap(item, trace) for item in value)
+    return value
+
+
+class TracedObject():
+    """
+    libvirt 对象的代理，记录每个方法调用的耗时。
+    传给 libvirt 的代理对象通过 _o 属性取得底层句柄，与原对象等价。
+    """
+
+    def __init__(self, obj, trace):
+        self._obj = obj
+        self._trace = trace
+        self._kind = type(obj).__name__
+
+    def __getattr__(self, item):
+        attr = getattr(self._obj, item)
+        if item in LOCAL_CALLS or item.startswith("_") or \
+                not callable(attr):
+            return attr
+        trace = self._trace
+        call = "%s.%s" % (self._kind, item)
+
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return _wrap(attr(*args, **kwargs), trace)
+            finally:
+                trace.record(call, time.time() - start)
+        return wrapper
+
+    def __eq__(self, other):
+        return self._obj == getattr(other, "_obj", other)
+
+    def __hash__(self):
+        return hash(self._obj)
+
+
+def traced(conn):
+    trace = current_trace()
+    if trace is None:
+        return conn
+    return TracedObject(conn, trace)
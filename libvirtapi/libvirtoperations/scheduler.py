@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+from libvirtapi import config as cfg
+from libvirtapi.exs import CustomException
+from libvirtapi.libvirtoperations.domainxml import format_cpuset
+from libvirtapi.libvirtoperations.hosts import HOSTS
+from libvirtapi.libvirtoperations.libvirtapi import LibvirtManager
+from libvirtapi.utils.utils import uuid_generate
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+class HostState():
+    """
+    调度使用的主机视图。
+
+    总量、NUMA 拓扑、大页池和存储池剩余空间由 refresh 通过 RPC 获取后缓存，
+    已分配和已预留的资源直接读取该主机的 ResourceLedger，评分过程不发起 RPC。
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.name = host.name
+        self.total_vcpus = 0
+        self.total_memory = 0  # MiB
+        self.cpu_ratio = 1.0
+        self.cells = {}  # node -> {"cpus": [...], "memory": MiB}
+        self.pool_free = 0  # Byte
+        self.updated = 0
+
+    def refresh(self, lib):
+        start = time.time()
+        ratio = CONF.getfloat("default", "cpu_allocation_ratio")
+        info = lib.conn.getInfo()
+        # cpu_allocation_ratio 为 0 时沿用 available_cpu
+        total_vcpus = int(info[2] * ratio) if ratio > 0 \
+            else lib.get_total_cpu()
+        caps = ET.fromstring(lib.conn.getCapabilities())
+        hugepages = self.host.hugepages
+        hugepages.refresh(lib.conn, caps)
+        cells = {}
+        for cell in caps.iterfind("host/topology/cells/cell"):
+            node = int(cell.get("id"))
+            memory = cell.find("memory")
+            cells[node] = {
+                "cpus": sorted(int(cpu.get("id"))
+                               for cpu in cell.iterfind("cpus/cpu")),
+                # KiB -> MiB，扣除大页池后与 get_total_mem 一样预留 10%
+                "memory": (int(memory.text) / 1024 -
+                           hugepages.total_mib(node)) * 0.9
+                if memory is not None else 0}
+        pool = lib.get_pool()
+        pool_free = pool.info()[3] if pool is not None else 0
+
+        self.total_vcpus = total_vcpus
+        self.total_memory = lib.get_total_mem()
+        self.cpu_ratio = ratio if ratio > 0 else 1.0
+        self.cells = cells
+        self.pool_free = pool_free
+        # 之前调度出去的磁盘空间已反映在存储池剩余空间中
+        self.ledger.reset_disk(start)
+        self.updated = time.time()
+
+    @property
+    def ledger(self):
+        return self.host.ledger
+
+    def free_vcpus(self):
+        ledger = self.ledger
+        return self.total_vcpus - ledger.vcpus - ledger.reserved_vcpus
+
+    def free_memory(self):
+        ledger = self.ledger
+        return self.total_memory - ledger.memory - ledger.reserved_memory
+
+    def free_disk(self):
+        return self.pool_free - self.ledger.claimed_disk
+
+    def fit_node(self, spec):
+        """
+        可以容纳 spec 的 NUMA 节点中剩余内存最多的一个，单节点主机返回 None。
+        使用大页的虚拟机按节点的空闲大页判断。
+        """
+        if len(self.cells) < 2:
+            return None
+        isolated = None
+        if spec.dedicated and self.host.cpus.enabled:
+            isolated = set(self.host.cpus.free())
+        best, best_free = None, None
+        for node, cell in self.cells.items():
+            free_vcpus = len(cell["cpus"]) * self.cpu_ratio - \
+                self.ledger.node_vcpus.get(node, 0)
+            if spec.hugepages:
+                free_memory = self.host.hugepages.available(
+                    spec.hugepages, node) * spec.hugepages / 1024
+            else:
+                free_memory = cell["memory"] - \
+                    self.ledger.node_memory.get(node, 0)
+            if free_vcpus < spec.vcpus or free_memory < spec.memory:
+                continue
+            # 独占 CPU 也要在同一节点内
+            if isolated is not None and \
+                    len(isolated.intersection(cell["cpus"])) < spec.vcpus:
+                continue
+            if best is None or free_memory > best_free:
+                best, best_free = node, free_memory
+        return best
+
+    def placement_xml(self, node, vcpus, cpus=None):
+        """
+        cpus 为独占的隔离 CPU，否则 vCPU 在节点内非隔离的 CPU 上浮动
+        """
+        xml = ""
+        if node is not None:
+            xml = "<numatune><memory mode='strict' nodeset='%d'/></numatune>" \
+                % node
+        if cpus:
+            return xml + self.host.cpus.cputune_xml(cpus)
+        if node is None:
+            return xml
+        shared = [cpu for cpu in self.cells[node]["cpus"]
+                  if cpu not in self.host.cpus.isolated]
+        if not shared:
+            return xml
+        cpuset = format_cpuset(shared)
+        pins = "".join("<vcpupin vcpu='%d' cpuset='%s'/>" % (vcpu, cpuset)
+                       for vcpu in range(vcpus))
+        return xml + "<cputune>%s<emulatorpin cpuset='%s'/></cputune>" % (
+            pins, cpuset)
+
+
+class RequestSpec():
+    """
+    memory 单位 MiB，disk 单位 Byte。
+    group_policy: anti-affinity 同组虚拟机不放在同一主机，
+    soft-anti-affinity 尽量分散。
+    dedicated 为 True 时每个 vCPU 独占一个隔离 CPU（配置了 isolated_cpus 的主机）。
+    hugepages 为大页大小(KiB)，0 表示使用普通内存。
+    """
+
+    def __init__(self, vcpus, memory, disk=0, host=None, group=None,
+                 group_policy=None, numa=True, dedicated=False, hugepages=0):
+        self.vcpus = vcpus
+        self.memory = memory
+        self.disk = disk
+        self.host = host
+        self.group = group
+        self.group_policy = group_policy
+        self.numa = numa
+        self.dedicated = dedicated
+        self.hugepages = hugepages
+        # host name -> 同组虚拟机数量，调度开始时从 inventory 和预留统计
+        self.group_members = {}
+
+    @property
+    def pages(self):
+        return int(self.memory * 1024 // self.hugepages) \
+            if self.hugepages else 0
+
+
+class BaseFilter():
+    reason = ""
+
+    def host_passes(self, state, spec):
+        raise NotImplementedError()
+
+
+class HostFilter(BaseFilter):
+    reason = "不是指定的主机"
+
+    def host_passes(self, state, spec):
+        return spec.host is None or state.name == spec.host
+
+
+class RamFilter(BaseFilter):
+    reason = "可用内存不足"
+
+    def host_passes(self, state, spec):
+        return spec.hugepages or state.free_memory() >= spec.memory
+
+
+class HugePagesFilter(BaseFilter):
+    reason = "大页内存不足"
+
+    def host_passes(self, state, spec):
+        return not spec.hugepages or \
+            state.host.hugepages.available(spec.hugepages) >= spec.pages
+
+
+class CoreFilter(BaseFilter):
+    reason = "可用CPU不足"
+
+    def host_passes(self, state, spec):
+        return state.free_vcpus() >= spec.vcpus
+
+
+class DiskFilter(BaseFilter):
+    reason = "存储池空间不足"
+
+    def host_passes(self, state, spec):
+        return state.free_disk() >= spec.disk
+
+
+class PinningFilter(BaseFilter):
+    reason = "隔离CPU不足"
+
+    def host_passes(self, state, spec):
+        cpus = state.host.cpus
+        return not spec.dedicated or not cpus.enabled or \
+            len(cpus.free()) >= spec.vcpus
+
+
+class NUMAFilter(BaseFilter):
+    """
+    numa_placement 为 strict 时要求虚拟机能放进单个 NUMA 节点
+    """
+    reason = "没有可容纳的 NUMA 节点"
+
+    def host_passes(self, state, spec):
+        if not spec.numa or SCHEDULER.numa_placement != "strict" or \
+                len(state.cells) < 2:
+            return True
+        return state.fit_node(spec) is not None
+
+
+class AntiAffinityFilter(BaseFilter):
+    reason = "已有同组虚拟机"
+
+    def host_passes(self, state, spec):
+        return spec.group_policy != "anti-affinity" or \
+            not spec.group_members.get(state.name)
+
+
+class BaseWeigher():
+    def __init__(self, multiplier=1.0):
+        self.multiplier = multiplier
+
+    def weigh(self, state, spec):
+        raise NotImplementedError()
+
+
+class RamWeigher(BaseWeigher):
+    def weigh(self, state, spec):
+        return state.free_memory()
+
+
+class CpuWeigher(BaseWeigher):
+    def weigh(self, state, spec):
+        return state.free_vcpus()
+
+
+class DiskWeigher(BaseWeigher):
+    def weigh(self, state, spec):
+        return state.free_disk()
+
+
+class NUMAWeigher(BaseWeigher):
+    def weigh(self, state, spec):
+        return 1 if state.fit_node(spec) is not None else 0
+
+
+class SoftAntiAffinityWeigher(BaseWeigher):
+    def weigh(self, state, spec):
+        if spec.group_policy != "soft-anti-affinity":
+            return 0
+        return -spec.group_members.get(state.name, 0)
+
+
+# 可在配置文件 scheduler_filters/scheduler_weighers 中引用的实现，
+# 新的实现通过 register_filter/register_weigher 登记
+FILTERS = dict((cls.__name__, cls) for cls in (
+    HostFilter, RamFilter, HugePagesFilter, CoreFilter, DiskFilter,
+    PinningFilter, NUMAFilter, AntiAffinityFilter))
+WEIGHERS = dict((cls.__name__, cls) for cls in (
+    RamWeigher, CpuWeigher, DiskWeigher, NUMAWeigher,
+    SoftAntiAffinityWeigher))
+
+
+def register_filter(cls):
+    FILTERS[cls.__name__] = cls
+    return cls
+
+
+def register_weigher(cls):
+    WEIGHERS[cls.__name__] = cls
+    return cls
+
+
+class Scheduler():
+    """
+    虚拟机放置调度：过滤掉不满足条件的主机，按权重排序，
+    在得分最高的主机上预留资源，并为其选择 NUMA 节点。
+
+    placement = SCHEDULER.schedule(RequestSpec(2, 4096))
+    -> {"host": "node1", "numa_node": 0, "reservation": "...",
+        "placement": "<numatune>...</numatune><cputune>...</cputune>",
+        "cpus": [4, 5]}
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}  # host name -> HostState
+        self.filters = None
+        self.weighers = None
+        self.numa_placement = "prefer"
+
+    def load(self, conf):
+        filters = []
+        for name in conf.get("default", "scheduler_filters").split(","):
+            name = name.strip()
+            if name:
+                if name not in FILTERS:
+                    raise ValueError("unknown scheduler filter %s" % name)
+                filters.append(FILTERS[name]())
+        weighers = []
+        for item in conf.get("default", "scheduler_weighers").split(","):
+            name, _, multiplier = item.strip().partition(":")
+            if name:
+                if name not in WEIGHERS:
+                    raise ValueError("unknown scheduler weigher %s" % name)
+                weighers.append(WEIGHERS[name](float(multiplier or 1)))
+        self.filters = filters
+        self.weighers = weighers
+        self.numa_placement = conf.get("default", "numa_placement")
+
+    def _ensure(self):
+        if self.filters is None:
+            self.load(CONF)
+
+    def state(self, host):
+        with self._lock:
+            state = self._states.get(host.name)
+            if state is None:
+                state = self._states[host.name] = HostState(host)
+        return state
+
+    def refresh(self, hosts=None):
+        """
+        刷新主机的静态信息，同时同步主机的 inventory，后台线程周期调用
+        """
+        def refresh_host(host):
+            with LibvirtManager(host=host.name) as lib:
+                lib.inventory.sync(lib)
+                self.state(host).refresh(lib)
+
+        _, errors = HOSTS.map(refresh_host, hosts)
+        return errors
+
+    def _sync_inventory(self, host):
+        with LibvirtManager(host=host.name) as lib:
+            lib.inventory.sync(lib)
+
+    def _prepare(self, spec):
+        # 首次调度时刷新主机的静态信息，之后由后台线程定期刷新；
+        # inventory 有未处理的事件时只同步 inventory，评分读缓存的账本
+        hosts = HOSTS.list()
+        pending = [host for host in hosts if not self.state(host).updated]
+        if pending:
+            self.refresh(pending)
+        stale = [host for host in hosts
+                 if host not in pending and host.inventory.stale]
+        if stale:
+            HOSTS.map(self._sync_inventory, stale)
+        states = [self.state(host) for host in hosts
+                  if self.state(host).updated]
+        if spec.group:
+            # 创建中的同组虚拟机还不在 inventory 中，从预留中统计
+            for state in states:
+                spec.group_members[state.name] = len(
+                    [vm for vm in state.host.inventory.list()
+                     if vm.get("group") == spec.group]) + \
+                    state.ledger.reserved_in_group(spec.group)
+        return states
+
+    def select(self, spec):
+        """
+        返回按得分从高到低排列的 HostState，没有满足条件的主机时抛出异常
+        """
+        self._ensure()
+        states = self._prepare(spec)
+        start = time.time()
+
+        candidates = []
+        rejected = []
+        for state in states:
+            for f in self.filters:
+                if not f.host_passes(state, spec):
+                    rejected.append("%s %s" % (state.name, f.reason))
+                    break
+            else:
+                candidates.append(state)
+        if not candidates:
+            raise CustomException("没有满足条件的主机: %s" % (
+                "; ".join(rejected) or "没有可用的主机"), 400)
+
+        # 每个权重归一化到 0-1 后按系数加权
+        scores = dict((state.name, 0.0) for state in candidates)
+        for weigher in self.weighers:
+            values = [weigher.weigh(state, spec) for state in candidates]
+            low, high = min(values), max(values)
+            if high == low:
+                continue
+            for state, value in zip(candidates, values):
+                scores[state.name] += weigher.multiplier * \
+                    (value - low) / (high - low)
+        candidates.sort(key=lambda state: scores[state.name], reverse=True)
+        LOG.debug("scheduled %s candidates in %.3fms: %s" % (
+            len(candidates), (time.time() - start) * 1000,
+            ", ".join("%s=%.3f" % (state.name, scores[state.name])
+                      for state in candidates)))
+        return candidates
+
+    def schedule(self, spec):
+        """
+        依次在候选主机上预留资源，预留成功的主机即调度结果。
+        资源检查与预留在 ledger 的锁内完成，并发调度不会超额分配，
+        反亲和的同组虚拟机也不会被并发调度到同一主机；
+        独占 CPU 和大页以同一个 key 在主机的 CpuAllocator、HugePagePool 中占用，
+        创建结束后一并释放。磁盘空间在创建失败时释放(ledger.release_disk)。
+        """
+        candidates = self.select(spec)
+        for state in candidates:
+            node = None
+            if spec.numa and self.numa_placement != "none":
+                node = state.fit_node(spec)
+            key = uuid_generate()
+            cpus = None
+            if spec.dedicated and state.host.cpus.enabled:
+                prefer = state.cells[node]["cpus"] if node is not None else ()
+                cpus = state.host.cpus.claim(key, spec.vcpus, prefer)
+                if cpus is None:
+                    continue
+                if node is not None and not set(cpus).issubset(prefer):
+                    node = None
+            if spec.hugepages and not state.host.hugepages.claim(
+                    key, spec.hugepages, spec.pages, node):
+                state.host.cpus.unclaim(key)
+                continue
+            # 大页内存不占用普通内存
+            memory = 0 if spec.hugepages else spec.memory
+            if not state.ledger.reserve(
+                    key, spec.vcpus, memory, state.total_vcpus,
+                    state.total_memory, node, spec.disk, spec.group,
+                    spec.group_policy == "anti-affinity"):
+                state.host.cpus.unclaim(key)
+                state.host.hugepages.cancel(key)
+                continue
+            return {"host": state.name,
+                    "numa_node": node,
+                    "reservation": key,
+                    "placement": state.placement_xml(node, spec.vcpus, cpus),
+                    "cpus": cpus}
+        raise CustomException("没有满足条件的主机: 资源已被并发请求占用", 400)
+
+
+SCHEDULER = Scheduler()
+
+_refresher_thread = None
+
+
+def _refresh_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            SCHEDULER.refresh()
+        except Exception as e:
+            LOG.warning("refresh scheduler host states failed: %s" % e)
+
+
+def start_refresher(interval):
+    """
+    启动主机静态信息刷新线程，interval <= 0 时不启动，只在首次调度时获取
+    """
+    global _refresher_thread
+    if interval <= 0 or _refresher_thread is not None:
+        return
+    _refresher_thread = threading.Thread(
+        target=_refresh_loop, args=(interval,),
+        name="scheduler-refresher")
+    _refresher_thread.daemon = True
+    _refresher_thread.start()
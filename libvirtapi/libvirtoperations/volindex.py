@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from libvirtapi.libvirtoperations.inventory import INVENTORY
+
+
+class VolumeIndex():
+    """
+    磁盘路径到虚拟机名称的反向索引。
+
+    作为 DomainInventory 的监听者，随虚拟机的定义、删除和设备变化增量维护，
+    查询某个卷被哪些虚拟机使用时无需遍历所有虚拟机的 XML。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {}  # path -> set(vm name)
+
+    def __call__(self, old, new):
+        with self._lock:
+            if old:
+                for disk in old["disks"]:
+                    names = self._paths.get(disk["file"])
+                    if names:
+                        names.discard(old["name"])
+                        if not names:
+                            del self._paths[disk["file"]]
+            if new:
+                for disk in new["disks"]:
+                    self._paths.setdefault(disk["file"], set()).add(
+                        new["name"])
+
+    def lookup(self, path):
+        with self._lock:
+            return sorted(self._paths.get(path, ()))
+
+
+VOLUME_INDEX = VolumeIndex()
+INVENTORY.add_listener(VOLUME_INDEX)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+对比多个服务端的吞吐和延迟，同一组请求路径、同样的并发数依次压测每个服务端。
+
+在 test 驱动上对比 eventlet 和 asyncio 入口（libvirt_url = test:///default）：
+
+start-libvirtapi &
+start-libvirtapi-asgi &
+libvirtapi-benchmark --target wsgi=http://127.0.0.1:8778 \\
+    --target asgi=http://127.0.0.1:8779 \\
+    --path /libvirtapi/vm --path /libvirtapi/vm/test --path /libvirtapi/hosts \\
+    --concurrency 50 --duration 30
+"""
+import argparse
+import sys
+import threading
+import time
+
+from libvirtapi.utils.loadtest import percentile, request
+
+
+def run(url, concurrency, duration, timeout):
+    """
+    返回 (请求数, 错误数, 每秒请求数, [延迟])
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def worker():
+        while time.time() < deadline:
+            start = time.time()
+            try:
+                status, _ = request(url, timeout=timeout)
+            except Exception:
+                status = 0
+            with lock:
+                latencies.append(time.time() - start)
+                if status not in (200, 304):
+                    errors[0] += 1
+
+    begin = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - begin
+    return len(latencies), errors[0], len(latencies) / elapsed, latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="libvirtapi server benchmark")
+    parser.add_argument("--target", action="append", required=True,
+                        help="name=url，可指定多个")
+    parser.add_argument("--path", action="append",
+                        help="请求路径，可指定多个，默认 /libvirtapi/vm")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args(argv)
+
+    targets = []
+    for target in args.target:
+        name, sep, url = target.partition("=")
+        if not sep:
+            parser.error("--target must be name=url")
+        targets.append((name, url.rstrip("/")))
+
+    print("%-8s %-32s %8s %7s %9s %9s %9s" % (
+        "server", "path", "requests", "errors", "req/s", "p50(ms)",
+        "p99(ms)"))
+    for path in args.path or ["/libvirtapi/vm"]:
+        for name, url in targets:
+            if args.warmup > 0:
+                run(url + path, args.concurrency, args.warmup, args.timeout)
+            count, errors, rps, latencies = run(
+                url + path, args.concurrency, args.duration, args.timeout)
+            print("%-8s %-32s %8d %7d %9.1f %9.1f %9.1f" % (
+                name, path, count, errors, rps,
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+虚拟机列表查询的 RPC 次数和耗时对比，在 test 驱动上定义一批虚拟机后执行：
+
+    legacy  逐台 lookupByID/lookupByName，每台虚拟机再查找 4 次、
+            XMLDesc 3 次、getInfo 2 次，与改为批量查询之前的 list_vms 相同
+    bulk    LibvirtManager.scan_vms，getAllDomainStats 一次取回状态，
+            每台虚拟机只取一次 XML
+
+libvirtapi-listbench --uri test:///default --domains 300 --repeat 5
+
+test:///default 在同一进程内的连接共享状态，定义的虚拟机结束时删除。
+"""
+import argparse
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from libvirtapi import config as cfg
+from libvirtapi.libvirtoperations import offload
+from libvirtapi.libvirtoperations import rpctrace
+from libvirtapi.libvirtoperations.libvirtapi import LibvirtManager
+
+PREFIX = "listbench-"
+
+DOMAIN_XML = """<domain type='test'>
+  <name>%(name)s</name>
+  <memory unit='MiB'>256</memory>
+  <vcpu>1</vcpu>
+  <os><type arch='x86_64'>hvm</type></os>
+  <devices>
+    <disk type='file' device='disk'>
+      <source file='/var/lib/libvirt/images/%(name)s.qcow2'/>
+      <target dev='vda' bus='virtio'/>
+    </disk>
+    <graphics type='vnc' port='-1' autoport='yes'/>
+  </devices>
+</domain>"""
+
+
+def define_domains(conn, count):
+    """
+    定义 count 台虚拟机，其中一半启动
+    """
+    for index in range(count):
+        dom = conn.defineXML(DOMAIN_XML % {"name": "%s%s" % (PREFIX, index)})
+        if index % 2 == 0:
+            dom.create()
+
+
+def remove_domains(conn):
+    for dom in conn.listAllDomains():
+        if not dom.name().startswith(PREFIX):
+            continue
+        if dom.isActive():
+            dom.destroy()
+        dom.undefine()
+
+
+def legacy_list(conn):
+    """
+    改为批量查询之前 list_vms 的调用方式
+    """
+    doms = [conn.lookupByID(i) for i in conn.listDomainsID()]
+    doms += [conn.lookupByName(name) for name in conn.listDefinedDomains()]
+    vms = []
+    for obj in doms:
+        name = obj.name()
+        # get_vm_info
+        ET.fromstring(conn.lookupByName(name).XMLDesc(0))
+        dom = conn.lookupByName(name)
+        raw = dom.info()
+        conn.getInfo()
+        autostart = dom.autostart()
+        # get_vnc
+        ET.fromstring(conn.lookupByName(name).XMLDesc(0))
+        conn.getInfo()
+        # get_disks
+        ET.fromstring(conn.lookupByName(name).XMLDesc(0))
+        vms.append({"name": name, "state": raw[0], "autostart": autostart})
+    return vms
+
+
+def bulk_list(uri):
+    with LibvirtManager(uri=uri) as lib:
+        return lib.scan_vms()
+
+
+def measure(func, repeat):
+    """
+    返回 (平均耗时, 每次的 RPC 次数, 虚拟机数)
+    """
+    elapsed = 0.0
+    rpc_count = 0
+    vms = []
+    for _ in range(repeat):
+        rpctrace.start_trace("listbench")
+        start = time.time()
+        vms = func()
+        elapsed += time.time() - start
+        rpc_count = rpctrace.end_trace()["rpc_count"]
+    return elapsed / repeat, rpc_count, len(vms)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="vm list benchmark")
+    parser.add_argument("--uri", default="test:///default")
+    parser.add_argument("--domains", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    cfg.config_init(os.getenv("LIBVIRTAPI_CONFIG_FILE") or
+                    "/etc/libvirtapi/libvirtapi.conf")
+    # 在当前线程中直接调用 libvirt，不经过 tpool
+    offload.configure(False, 1, 0)
+
+    conn = libvirt.open(args.uri)
+    try:
+        define_domains(conn, args.domains)
+        traced = rpctrace.traced
+        results = [
+            ("legacy", measure(lambda: legacy_list(traced(conn)),
+                               args.repeat)),
+            ("bulk", measure(lambda: bulk_list(args.uri), args.repeat)),
+        ]
+    finally:
+        remove_domains(conn)
+        conn.close()
+
+    print("%-8s %6s %10s %10s" % ("path", "vms", "rpc", "time(ms)"))
+    for name, (elapsed, rpc_count, count) in results:
+        print("%-8s %6d %10d %10.1f" % (name, count, rpc_count,
+                                        elapsed * 1000))
+    legacy, bulk = results[0][1][0], results[1][1][0]
+    if bulk:
+        print("speedup: %.1fx" % (legacy / bulk))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
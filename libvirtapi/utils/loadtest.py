@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+并发请求延迟压测：持续并发请求 GET /libvirtapi/vm，运行中途发起一个
+长时间的操作，分别统计操作前、操作中、操作后的请求延迟。
+
+    clone   提交克隆创建任务，复制在后台任务的原生线程中执行
+    upload  上传镜像，读取请求体和写入 libvirt stream 都在处理请求的
+            wsgi 线程中，检验 hub 线程上的阻塞调用是否影响其他请求
+
+libvirtapi-loadtest --url http://127.0.0.1:8778 --concurrency 20 \\
+    --duration 120 --load-at 20 --load clone --image centos7.qcow2 \\
+    --volume-size 40
+libvirtapi-loadtest --load upload --upload-size 4096
+
+操作中的 p99 超过操作前 p99 的 --max-ratio 倍时以非零状态退出。
+结束时删除压测创建的虚拟机、磁盘和镜像。
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+PHASES = ("before", "during", "after")
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+
+def request(url, method="GET", body=None, timeout=60):
+    data = json.dumps(body).encode() if body is not None else None
+    req = Request(url, data=data, method=method,
+                  headers={"Content-Type": "application/json"})
+    return send(req, timeout)
+
+
+def send(req, timeout=60):
+    try:
+        with urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except HTTPError as e:
+        return e.code, e.read()
+
+
+class LoadTest():
+    def __init__(self, args):
+        self.args = args
+        self.samples = []  # (start, latency, status)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.load_start = None
+        self.load_end = None
+        self.load_status = None
+        # 需要清理的资源，每项依次尝试删除，直到有一个成功
+        self.created = []
+
+    def worker(self):
+        url = self.args.url + self.args.path
+        while not self._stop.is_set():
+            start = time.time()
+            try:
+                status, _ = request(url, timeout=self.args.timeout)
+            except Exception:
+                status = 0
+            with self._lock:
+                self.samples.append((start, time.time() - start, status))
+
+    def clone(self):
+        """
+        任务结束后才返回，结束前不能清理
+        """
+        args = self.args
+        body = {"name": args.name, "vcpu": "1", "mem": "1",
+                "image": args.image, "volume_size": str(args.volume_size),
+                "provision": "clone"}
+        self.load_start = time.time()
+        status, data = request(args.url + "/libvirtapi/vm", "POST", body)
+        if status != 202:
+            self.load_status = "submit failed: %s %s" % (status, data[:200])
+            self.load_end = time.time()
+            return
+        # 删除虚拟机时一并删除磁盘，任务失败时只剩下磁盘
+        self.created.append(["/libvirtapi/vm/%s" % args.name,
+                             "/libvirtapi/volume/%s" % args.name])
+        location = json.loads(data.decode())["location"]
+        while True:
+            _, data = request(args.url + location)
+            job = json.loads(data.decode())
+            if job["status"] in ("succeeded", "failed"):
+                self.load_status = job["status"]
+                break
+            time.sleep(1)
+        self.load_end = time.time()
+
+    def upload(self):
+        args = self.args
+        size = args.upload_size * 1024 * 1024
+        # 非零数据，不会作为空洞跳过
+        chunk = os.urandom(UPLOAD_CHUNK_SIZE)
+
+        def body():
+            sent = 0
+            while sent < size:
+                data = chunk[:min(UPLOAD_CHUNK_SIZE, size - sent)]
+                sent += len(data)
+                yield data
+
+        path = "/libvirtapi/image/%s.img" % args.name
+        req = Request(args.url + path + "?sparse=false", data=body(),
+                      method="PUT",
+                      headers={"Content-Type": "application/octet-stream",
+                               "Content-Length": str(size)})
+        self.created.append([path])
+        self.load_start = time.time()
+        try:
+            status, data = send(req, timeout=max(args.timeout, 600))
+            self.load_status = "done" if status == 200 else \
+                "failed: %s %s" % (status, data[:200])
+        except Exception as e:
+            self.load_status = "failed: %s" % e
+        self.load_end = time.time()
+
+    def cleanup(self):
+        for paths in reversed(self.created):
+            for path in paths:
+                try:
+                    status, data = request(self.args.url + path, "DELETE")
+                except Exception as e:
+                    status, data = 0, str(e).encode()
+                if status == 200:
+                    break
+                print("cleanup %s: %s %s" % (path, status, data[:200]))
+
+    def phase(self, start):
+        if self.load_start is None or start < self.load_start:
+            return "before"
+        if self.load_end is None or start < self.load_end:
+            return "during"
+        return "after"
+
+    def run(self):
+        args = self.args
+        threads = [threading.Thread(target=self.worker)
+                   for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        begin = time.time()
+        load_thread = None
+        try:
+            while time.time() - begin < args.duration:
+                if load_thread is None and \
+                        time.time() - begin >= args.load_at:
+                    load_thread = threading.Thread(
+                        target=getattr(self, args.load))
+                    load_thread.daemon = True
+                    load_thread.start()
+                time.sleep(0.2)
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            if load_thread is not None and load_thread.is_alive():
+                print("waiting for %s to finish" % args.load)
+                load_thread.join()
+            return self.report()
+        finally:
+            self._stop.set()
+            self.cleanup()
+
+    def report(self):
+        phases = dict((phase, []) for phase in PHASES)
+        errors = dict((phase, 0) for phase in PHASES)
+        for start, latency, status in self.samples:
+            phase = self.phase(start)
+            phases[phase].append(latency)
+            if status != 200:
+                errors[phase] += 1
+        print("%-8s %8s %8s %9s %9s %9s %9s" % (
+            "phase", "requests", "errors", "p50(ms)", "p95(ms)", "p99(ms)",
+            "max(ms)"))
+        for phase in PHASES:
+            values = phases[phase]
+            print("%-8s %8d %8d %9.1f %9.1f %9.1f %9.1f" % (
+                phase, len(values), errors[phase],
+                percentile(values, 50) * 1000, percentile(values, 95) * 1000,
+                percentile(values, 99) * 1000,
+                (max(values) if values else 0) * 1000))
+        if self.load_start is not None:
+            print("%s: %s in %.1fs" % (
+                self.args.load, self.load_status,
+                (self.load_end or time.time()) - self.load_start))
+
+        before = percentile(phases["before"], 99)
+        during = percentile(phases["during"], 99)
+        if before and during > before * self.args.max_ratio:
+            print("p99 during %s is %.1fx of baseline" % (
+                self.args.load, during / before))
+            return 1
+        return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="libvirtapi latency load test")
+    parser.add_argument("--url", default="http://127.0.0.1:8778")
+    parser.add_argument("--path", default="/libvirtapi/vm")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--load", choices=("clone", "upload"),
+                        default="clone", help="压测中途发起的操作")
+    parser.add_argument("--image", help="克隆使用的镜像")
+    parser.add_argument("--name", default="loadtest-clone",
+                        help="克隆的虚拟机名，上传的镜像为 <name>.img")
+    parser.add_argument("--volume-size", type=int, default=20)
+    parser.add_argument("--upload-size", type=int, default=1024,
+                        help="上传的数据量(MiB)")
+    parser.add_argument("--load-at", "--clone-at", type=float, default=10,
+                        help="开始压测后多少秒发起操作")
+    parser.add_argument("--max-ratio", type=float, default=3.0)
+    args = parser.parse_args(argv)
+    if args.load == "clone" and not args.image:
+        parser.error("--image is required for --load clone")
+    args.url = args.url.rstrip("/")
+    return LoadTest(args).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+websockify token 插件，向 libvirtapi 查询 token，不读写文件，
+只依赖标准库，可以在没有 libvirt 的 novnc 主机上使用：
+
+websockify --token-plugin libvirtapi.utils.novnc_plugin.TokenPlugin \\
+    --token-source http://127.0.0.1:8778 6080
+"""
+import json
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+
+class TokenPlugin():
+    def __init__(self, src):
+        self.source = src.rstrip("/")
+
+    def lookup(self, token):
+        try:
+            with urlopen("%s/libvirtapi/novnc/%s" % (self.source, token),
+                         timeout=10) as resp:
+                target = json.loads(resp.read().decode())
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+        return [target["host"], target["port"]]
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus 文本格式输出，不依赖 prometheus_client。
+
+lines = []
+metric(lines, "libvirtapi_host_cpus", "gauge", "host cpus", [({}, 32)])
+"\\n".join(lines)
+"""
+import bisect
+import threading
+
+# 秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace(
+        "\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, _escape(value))
+                             for key, value in sorted(labels.items()))
+
+
+def metric(lines, name, kind, doc, samples):
+    """
+    samples: [(labels, value), ...]，labels 为 dict
+    """
+    lines.append("# HELP %s %s" % (name, doc))
+    lines.append("# TYPE %s %s" % (name, kind))
+    for labels, value in samples:
+        lines.append("%s%s %s" % (name, format_labels(labels), value))
+
+
+class Histogram():
+    """
+    按标签分组的累积直方图，observe 为 O(log buckets)。
+    """
+
+    def __init__(self, name, doc, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [counts..., sum, count]
+
+    def observe(self, label_values, value):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = [0] * (len(self.buckets) + 2)
+                self._series[label_values] = series
+            if idx < len(self.buckets):
+                series[idx] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self, lines):
+        with self._lock:
+            items = sorted((key, list(value))
+                           for key, value in self._series.items())
+        lines.append("# HELP %s %s" % (self.name, self.doc))
+        lines.append("# TYPE %s histogram" % self.name)
+        for label_values, series in items:
+            labels = dict(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % (
+                    self.name, format_labels(dict(labels, le=bound)),
+                    cumulative))
+            lines.append("%s_bucket%s %d" % (
+                self.name, format_labels(dict(labels, le="+Inf")),
+                series[-1]))
+            lines.append("%s_sum%s %s" % (
+                self.name, format_labels(labels), round(series[-2], 6)))
+            lines.append("%s_count%s %d" % (
+                self.name, format_labels(labels), series[-1]))
+
+
+REQUEST_LATENCY = Histogram(
+    "libvirtapi_request_duration_seconds",
+    "API request latency by method, endpoint and status",
+    ("method", "endpoint", "status"))
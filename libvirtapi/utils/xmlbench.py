@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+domain XML 生成的吞吐对比，不需要 libvirtd，两种方式都经过 Guest.guestGetXML：
+
+    template  加载时生成的规格模板，每次只填充字段
+    build     每次重新构造 Element 树并序列化，与改为模板之前的开销相当
+
+libvirtapi-xmlbench --count 20000 --flavor disk_bus=virtio --flavor hugepages=2M
+"""
+import argparse
+import sys
+import time
+
+from libvirtapi.libvirtoperations.flavor import Flavor
+from libvirtapi.libvirtoperations.guest import Guest
+from libvirtapi.utils.loadtest import percentile
+
+POOL_PATH = "/var/lib/libvirt/images"
+
+
+class BenchGuest(Guest):
+    """
+    使用压测指定的规格，不从配置文件加载
+    """
+
+    def __init__(self, flavor, options):
+        self._flavor = flavor
+        super().__init__(None, options)
+
+    def setDefaultValues(self):
+        self.flavor = self._flavor
+
+
+def guest_args(index):
+    """
+    与 create_vm 从镜像克隆时相同：boot 为系统盘路径，没有光驱镜像
+    """
+    name = "bench-%s" % index
+    options = {"name": name, "vcpu": "2", "description": "", "mem": "2",
+               "group": "", "placement": ""}
+    return options, "%s/%s.qcow2" % (POOL_PATH, name), ""
+
+
+def run(render, count):
+    """
+    返回 (每秒生成数, [耗时])
+    """
+    latencies = []
+    begin = time.time()
+    for index in range(count):
+        options, boot, image = guest_args(index)
+        start = time.time()
+        render(options, boot, image)
+        latencies.append(time.time() - start)
+    return count / (time.time() - begin), latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="domain XML benchmark")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--flavor", action="append", default=[],
+                        help="规格选项 key=value，可指定多个")
+    args = parser.parse_args(argv)
+
+    options = {}
+    for item in args.flavor:
+        key, sep, value = item.partition("=")
+        if not sep:
+            parser.error("--flavor must be key=value")
+        options[key.strip()] = value.strip()
+    flavor = Flavor("bench", options)
+
+    modes = [
+        ("template", lambda opt, boot, image: BenchGuest(
+            flavor, opt).guestGetXML(boot, image)),
+        ("build", lambda opt, boot, image: BenchGuest(
+            Flavor("bench", options), opt).guestGetXML(boot, image)),
+    ]
+    print("%-10s %8s %10s %9s %9s" % ("mode", "count", "xml/s", "p50(us)",
+                                      "p99(us)"))
+    for name, render in modes:
+        rate, latencies = run(render, args.count)
+        print("%-10s %8d %10.1f %9.1f %9.1f" % (
+            name, args.count, rate, percentile(latencies, 50) * 1e6,
+            percentile(latencies, 99) * 1e6))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -25,7 +25,12 @@ setup(
     install_requires=[],
     entry_points={
         "console_scripts": [
-            "start-libvirtapi = libvirtapi.app:main"
+            "start-libvirtapi = libvirtapi.app:main",
+            "start-libvirtapi-asgi = libvirtapi.asgi:main",
+            "libvirtapi-loadtest = libvirtapi.utils.loadtest:main",
+            "libvirtapi-benchmark = libvirtapi.utils.benchmark:main",
+            "libvirtapi-xmlbench = libvirtapi.utils.xmlbench:main",
+            "libvirtapi-listbench = libvirtapi.utils.listbench:main"
         ]
     }
 
@@ -1 +1,3 @@
-./websockify/websockify.py --web ../noVNC/ --target-config=../novnc-token.conf 6080
+# token 文件与 libvirtapi.conf 中的 novnc_token_file 一致；
+# novnc_token_file 为空时改用：--token-plugin libvirtapi.utils.novnc_plugin.TokenPlugin --token-source http://127.0.0.1:8778
+./websockify/websockify.py --web ../noVNC/ --target-config=/var/lib/libvirtapi/novnc-token.conf 6080
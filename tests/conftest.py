@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+from libvirtapi import config
+
+# 不读取配置文件，使用 DEFAULT_CONFIG
+if not config.CONF.sections():
+    config.config_init("")
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("eventlet")
+pytest.importorskip("salt")
+pytest.importorskip("libvirt")
+
+from libvirtapi.exs import CustomException  # noqa: E402
+from libvirtapi.libvirtoperations import libvirtapi  # noqa: E402
+from libvirtapi.libvirtoperations.libvirtapi import LibvirtManager  # noqa: E402
+from libvirtapi.libvirtoperations.hosts import Host  # noqa: E402
+from libvirtapi.libvirtoperations.jobs import Job  # noqa: E402
+
+GiB = 1024 ** 3
+
+
+class StubManager():
+    """
+    create_vm 对 fail 中的虚拟机抛出异常，created/deleted 记录
+    创建和回滚的虚拟机
+    """
+
+    fail = set()
+    created = []
+    deleted = []
+    volumes = {}
+
+    def __init__(self, host=None):
+        self.host = host
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def prepare_create(self, image):
+        return {"default_pool_path": "/var/lib/libvirt/images",
+                "image_info": {"type": "qcow2", "allocation": 2 * GiB}}
+
+    def get_vm_info(self, name):
+        return None
+
+    def get_volume(self, name, pool_name="default"):
+        return self.volumes.get(name)
+
+    def create_vm(self, args, job=None, context=None):
+        self.volumes[args["name"] + ".qcow2"] = object()
+        if args["name"] in self.fail:
+            raise CustomException("clone %s failed" % args["name"])
+        self.created.append(args["name"])
+
+    def _get_dom(self, name):
+        raise libvirtapi.libvirtError("no domain %s" % name)
+
+    def delete_volume(self, name, pool_name="default"):
+        self.deleted.append(name)
+        self.volumes.pop(name, None)
+
+    def volume_info(self, name, pool_name="default"):
+        return {"allocation": int(name.split("-")[-1].split(".")[0]) * GiB}
+
+
+class StubHosts():
+    def __init__(self, host):
+        self.host = host
+
+    def get(self, name=None):
+        return self.host
+
+
+@pytest.fixture
+def host(monkeypatch):
+    host = Host("stub", "test:///default")
+    monkeypatch.setattr(libvirtapi, "HOSTS", StubHosts(host))
+    monkeypatch.setattr(libvirtapi, "LibvirtManager", StubManager)
+    monkeypatch.setattr(StubManager, "fail", set())
+    monkeypatch.setattr(StubManager, "created", [])
+    monkeypatch.setattr(StubManager, "deleted", [])
+    monkeypatch.setattr(StubManager, "volumes", {})
+    return host
+
+
+def batch(host, names, atomic=False):
+    job = Job("create_vm_batch", "vm-*")
+    host.ledger.reserve(job.id, 2, 2048, 64, 65536, disk=6 * GiB)
+    template = {"image": "centos7.qcow2", "vcpu": "1", "mem": "1",
+                "volume_size": "20"}
+    try:
+        return job, libvirtapi.create_vm_batch_job(
+            job, names, template, 2, job.id, atomic)
+    except CustomException as e:
+        return job, e
+
+
+def test_batch_releases_disk_of_failed_vms(host):
+    StubManager.fail.add("vm-2")
+    job, result = batch(host, ["vm-1", "vm-2", "vm-3"])
+
+    assert isinstance(result, CustomException)
+    status = dict((r["name"], r["status"]) for r in job.result)
+    assert status == {"vm-1": "created", "vm-2": "failed",
+                      "vm-3": "created"}
+    # 失败的虚拟机清理启动盘
+    assert StubManager.deleted == ["vm-2.qcow2"]
+    assert host.ledger.reserved_vcpus == 0
+    assert host.ledger.claimed_disk == pytest.approx(4 * GiB)
+
+
+def test_atomic_batch_rolls_back_created_vms(host):
+    StubManager.fail.add("vm-2")
+    job, result = batch(host, ["vm-1", "vm-2", "vm-3"], atomic=True)
+
+    assert isinstance(result, CustomException)
+    status = dict((r["name"], r["status"]) for r in job.result)
+    assert status == {"vm-1": "rolled_back", "vm-2": "failed",
+                      "vm-3": "rolled_back"}
+    assert sorted(StubManager.deleted) == \
+        ["vm-1.qcow2", "vm-2.qcow2", "vm-3.qcow2"]
+    assert host.ledger.claimed_disk == pytest.approx(0)
+
+
+def test_job_info_sums_child_progress(host):
+    job = Job("create_vm_batch", "vm-*")
+    job.bytes_total = 6 * GiB
+    for index, phase in ((1, "start"), (2, "clone"), (3, "clone")):
+        child = Job("create_vm", "vm-%s" % index)
+        child.phase = phase
+        child.volume = "vm-%s.qcow2" % index
+        child.bytes_copied = 2 * GiB if phase == "start" else 0
+        job.children.append(child)
+
+    # 克隆中的子任务以目标卷的已分配大小作为进度
+    info = LibvirtManager.job_info(StubManager(), job)
+    assert info["bytes_copied"] == (2 + 2 + 3) * GiB
+    assert info["bytes_total"] == 6 * GiB
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+eventlet = pytest.importorskip("eventlet")
+pytest.importorskip("libvirt")
+
+from libvirtapi.libvirtoperations import connpool  # noqa: E402
+from libvirtapi.libvirtoperations import offload  # noqa: E402
+
+
+class StubConnection():
+    """
+    hang 在 release 之前一直阻塞，模拟对端挂起的主机
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.closed = threading.Event()
+
+    def hang(self):
+        self.release.wait()
+        return "late"
+
+    def getHostname(self):
+        return "node"
+
+    def close(self):
+        # 对端挂起时 close 同样阻塞
+        self.release.wait()
+        self.closed.set()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    conns = []
+
+    def open_conn(uri):
+        conn = StubConnection()
+        conns.append(conn)
+        return conn
+
+    monkeypatch.setattr(connpool, "start_event_loop", lambda: None)
+    monkeypatch.setattr(connpool.libvirt, "open", open_conn)
+    offload.configure(True, 4, 0.2)
+    pool = connpool.ConnectionPool("test:///hang", size=2, timeout=5,
+                                   keepalive_interval=0)
+    yield pool, conns
+    for conn in conns:
+        conn.release.set()
+    offload.configure(True, 20, 60)
+
+
+def test_timeout_orphans_connection_without_blocking_hub(pool):
+    pool, conns = pool
+    ticks = []
+
+    def ticker():
+        while True:
+            ticks.append(time.time())
+            eventlet.sleep(0.01)
+
+    def other_request():
+        conn = pool.checkout()
+        try:
+            return offload.offloaded(conn).getHostname()
+        finally:
+            pool.checkin(conn)
+
+    eventlet.spawn(ticker)
+    conn = pool.checkout()
+    proxy = offload.offloaded(conn)
+    with pytest.raises(offload.CallTimeout):
+        proxy.hang()
+    assert len(proxy.pending) == 1
+
+    start = time.time()
+    pool.checkin(conn, pending=proxy.pending)
+    # 归还不等待挂起的调用，也不在当前线程 close
+    assert time.time() - start < 0.1
+    assert pool.metrics()["opened"] == 0
+    assert pool.metrics()["discarded"] == 1
+
+    # 挂起期间其他请求照常处理
+    before = len(ticks)
+    assert eventlet.spawn(other_request).wait() == "node"
+    eventlet.sleep(0.1)
+    assert len(ticks) > before
+    assert not conns[0].closed.is_set()
+
+    conns[0].release.set()
+    assert conns[0].closed.wait(2)
+    assert pool.metrics()["opened"] == 1
+
+
+def test_offloaded_timeout_marks_pending(pool):
+    pool, conns = pool
+    conn = pool.checkout()
+    proxy = offload.offloaded(conn)
+    with pytest.raises(offload.CallTimeout) as e:
+        proxy.hang()
+    assert e.value.code == 504
+    assert not e.value.pending.is_set()
+    conns[0].release.set()
+    assert e.value.pending.wait(2)
+    assert proxy.getHostname() == "node"
+    assert proxy.pending == [e.value.pending]
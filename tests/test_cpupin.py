@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+pytest.importorskip("eventlet")
+pytest.importorskip("libvirt")
+
+from libvirtapi.libvirtoperations.cpupin import CpuAllocator  # noqa: E402
+
+
+def vm(uuid, name, pinned):
+    return {"uuid": uuid, "name": name, "pinned_cpus": pinned}
+
+
+@pytest.fixture
+def cpus():
+    cpus = CpuAllocator()
+    cpus.configure("2-7", "0")
+    return cpus
+
+
+def test_claim_prefers_node_and_never_double_allocates(cpus):
+    assert cpus.claim("a", 2, prefer=[4, 5, 6, 7]) == [4, 5]
+    assert cpus.claim("b", 3) == [2, 3, 6]
+    assert cpus.free() == [7]
+    assert cpus.claim("c", 2) is None
+
+    cpus.unclaim("b")
+    assert cpus.free() == [2, 3, 6, 7]
+
+
+def test_pinned_vms_tracked_from_inventory(cpus):
+    # 只有隔离 CPU 计入
+    cpus(None, vm("u1", "a", [0, 2, 3]))
+    assert cpus.free() == [4, 5, 6, 7]
+    assert cpus.to_dict()["pinned"] == {"a": "2-3"}
+
+    # 虚拟机创建成功后 claim 由 inventory 中的绑定代替
+    assert cpus.claim("k", 2) == [4, 5]
+    cpus(None, vm("u2", "b", [4, 5]))
+    cpus.unclaim("k")
+    assert cpus.free() == [6, 7]
+
+    cpus(vm("u1", "a", [0, 2, 3]), None)
+    assert cpus.free() == [2, 3, 6, 7]
+
+
+def test_cputune_pins_each_vcpu(cpus):
+    xml = cpus.cputune_xml([4, 5])
+    assert "<vcpupin vcpu='0' cpuset='4'/>" in xml
+    assert "<vcpupin vcpu='1' cpuset='5'/>" in xml
+    assert "<emulatorpin cpuset='0'/>" in xml
+
+    cpus.configure("2-7")
+    assert "<emulatorpin cpuset='4-5'/>" in cpus.cputune_xml([4, 5])
+    assert not CpuAllocator().enabled
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import time
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from libvirtapi.libvirtoperations.hugepages import HugePagePool
+from libvirtapi.libvirtoperations.hugepages import page_size_kib
+
+CAPS = """
+<capabilities><host><topology><cells num='2'>
+  <cell id='0'>
+    <memory unit='KiB'>16777216</memory>
+    <pages unit='KiB' size='4'>100</pages>
+    <pages unit='KiB' size='2048'>2048</pages>
+  </cell>
+  <cell id='1'>
+    <memory unit='KiB'>16777216</memory>
+    <pages unit='KiB' size='2048'>1024</pages>
+  </cell>
+</cells></topology></host></capabilities>
+"""
+
+
+class StubConnection():
+    def __init__(self, free):
+        self.free = free
+        self.calls = []
+
+    def getFreePages(self, sizes, start, count):
+        self.calls.append((sizes, start, count))
+        return self.free
+
+
+@pytest.fixture
+def pool():
+    pool = HugePagePool()
+    pool.refresh(StubConnection({0: {2048: 1000}, 1: {2048: 1024}}),
+                 ET.fromstring(CAPS))
+    return pool
+
+
+def test_refresh_reads_pools_per_node(pool):
+    assert pool.total == {2048: {0: 2048, 1: 1024}}
+    assert pool.total_mib() == 6144 and pool.total_mib(1) == 2048
+    assert pool.available(2048) == 2024
+    assert pool.available(2048, 0) == 1000
+
+
+def test_claim_fits_single_node_then_spans(pool):
+    # 放在空闲页最多的节点
+    assert pool.claim("a", 2048, 600)
+    assert pool.available(2048, 1) == 424
+    assert pool.claim("b", 2048, 900, node=0)
+    assert not pool.claim("c", 2048, 200, node=0)
+
+    # 单个节点放不下时跨节点分配
+    assert pool.claim("d", 2048, 500)
+    assert pool.available(2048) == 24
+    assert not pool.claim("e", 2048, 100)
+
+    pool.cancel("d")
+    assert pool.available(2048) == 524
+
+
+def test_unclaimed_pages_counted_until_next_refresh(pool):
+    assert pool.claim("a", 2048, 500, node=1)
+    pool.unclaim("a")
+    # 下次 refresh 之前虚拟机占用的页仍然扣除
+    assert pool.available(2048, 1) == 524
+
+    time.sleep(0.01)
+    pool.refresh(StubConnection({0: {2048: 1000}, 1: {2048: 524}}),
+                 ET.fromstring(CAPS))
+    assert pool.available(2048, 1) == 524
+
+
+def test_page_size_kib():
+    assert page_size_kib("") == 0
+    assert page_size_kib("2M") == 2048
+    assert page_size_kib("1G") == 1048576
+    with pytest.raises(ValueError):
+        page_size_kib("3M")
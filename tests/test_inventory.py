@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+pytest.importorskip("eventlet")
+libvirt = pytest.importorskip("libvirt")
+
+from libvirtapi.libvirtoperations import inventory  # noqa: E402
+from libvirtapi.libvirtoperations import offload  # noqa: E402
+
+
+class StubEventConnection():
+    """
+    记录回调的注册、注销和连接关闭，fail_at 指定第几次注册失败
+    """
+
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.registered = []
+        self.deregistered = []
+        self.close_callback = None
+        self.closed = False
+
+    def setKeepAlive(self, interval, count):
+        pass
+
+    def domainEventRegisterAny(self, dom, event_id, callback, opaque):
+        if len(self.registered) == self.fail_at:
+            raise libvirt.libvirtError("event not supported")
+        callback_id = len(self.registered) + 1
+        self.registered.append(callback_id)
+        return callback_id
+
+    def domainEventDeregisterAny(self, callback_id):
+        self.deregistered.append(callback_id)
+
+    def registerCloseCallback(self, callback, opaque):
+        self.close_callback = callback
+
+    def unregisterCloseCallback(self):
+        self.close_callback = None
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def conns(monkeypatch):
+    conns = []
+
+    def open_conn(uri):
+        conn = conns.pop(0)
+        opened.append(conn)
+        return conn
+
+    opened = []
+    monkeypatch.setattr(inventory, "start_event_loop", lambda: None)
+    monkeypatch.setattr(inventory.libvirt, "open", open_conn)
+    offload.configure(True, 4, 5)
+    yield conns, opened
+    offload.configure(True, 20, 60)
+
+
+def test_rebind_deregisters_and_closes_old_connection(conns):
+    conns, opened = conns
+    conns += [StubEventConnection(), StubEventConnection()]
+    inv = inventory.DomainInventory()
+
+    inv.ensure_bound("test:///default")
+    old = opened[0]
+    assert inv.bound
+    assert len(old.registered) == len(inv.EVENTS)
+
+    # 回调运行在事件循环线程中，不在回调里关闭连接
+    old.close_callback(old, 0, None)
+    assert not inv.bound
+    assert not old.closed and old.deregistered == []
+
+    inv.ensure_bound("test:///default")
+    assert sorted(old.deregistered) == sorted(old.registered)
+    assert old.close_callback is None and old.closed
+    new = opened[1]
+    assert inv.bound and not new.closed
+    assert len(new.registered) == len(inv.EVENTS)
+
+
+def test_failed_bind_deregisters_partial_callbacks(conns):
+    conns, opened = conns
+    conns.append(StubEventConnection(fail_at=2))
+    inv = inventory.DomainInventory()
+
+    inv.ensure_bound("test:///default")
+    conn = opened[0]
+    assert not inv.bound
+    assert conn.deregistered == [1, 2] and conn.closed
+
+    # 驱动不支持事件时不再重试
+    inv.ensure_bound("test:///default")
+    assert len(opened) == 1
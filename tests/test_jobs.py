@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("libvirt")
+
+from libvirtapi.libvirtoperations import jobs  # noqa: E402
+
+
+def wait_done(job, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if job.done:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("job %s not done" % job.id)
+
+
+def test_job_records_result_and_error():
+    manager = jobs.JobManager(workers=2)
+
+    def ok(job, value):
+        job.set_phase("working")
+        return value * 2
+
+    def fail(job):
+        raise RuntimeError("boom")
+
+    good = manager.submit("create_vm", "a", ok, 21)
+    bad = manager.submit("create_vm", "b", fail)
+    wait_done(good)
+    wait_done(bad)
+
+    assert good.status == jobs.SUCCEEDED and good.result == 42
+    assert good.phase == "done" and good.elapsed() >= 0
+    assert bad.status == jobs.FAILED and bad.error == "boom"
+    assert manager.get(good.id) is good
+    assert good.to_dict()["type"] == "create_vm"
+
+
+def test_jobs_run_on_bounded_pool():
+    manager = jobs.JobManager(workers=1)
+    release = threading.Event()
+    first = manager.submit("create_vm", "a", lambda job: release.wait(5))
+    second = manager.submit("create_vm", "b", lambda job: None)
+
+    # 只有一个线程，第二个任务排队等待
+    threading.Event().wait(0.1)
+    assert first.status == jobs.RUNNING
+    assert second.status == jobs.PENDING and second.phase == "queued"
+
+    release.set()
+    wait_done(first)
+    wait_done(second)
+    assert second.status == jobs.SUCCEEDED
+
+
+def test_history_only_trims_finished_jobs():
+    manager = jobs.JobManager(workers=1, history=2)
+    release = threading.Event()
+    running = manager.submit("create_vm", "a", lambda job: release.wait(5))
+    queued = [manager.submit("create_vm", str(i), lambda job: None)
+              for i in range(3)]
+
+    # 未结束的任务不淘汰
+    assert [job.id for job in manager.list()] == \
+        [running.id] + [job.id for job in queued]
+
+    release.set()
+    for job in queued:
+        wait_done(job)
+    last = manager.submit("create_vm", "last", lambda job: None)
+    wait_done(last)
+    assert len(manager.list()) <= 2
+    assert manager.get(last.id) is last
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("eventlet")
+pytest.importorskip("salt")
+pytest.importorskip("libvirt")
+
+from libvirtapi.exs import CustomException  # noqa: E402
+from libvirtapi.libvirtoperations import libvirtapi  # noqa: E402
+
+
+class StubInventory():
+    supported = True
+
+    def __init__(self, vms, version=1):
+        self.vms = vms
+        self.version = version
+
+    def ensure_bound(self, uri):
+        pass
+
+    def snapshot(self, lib):
+        return self.version, [dict(vm) for vm in self.vms]
+
+
+class StubManager():
+    uri = "test:///default"
+    page_vms = libvirtapi.LibvirtManager.page_vms
+
+    def __init__(self, vms):
+        self.inventory = StubInventory(vms)
+
+
+def vm(name, state="Running"):
+    return {"name": name, "state": state, "cpu": 1}
+
+
+def fleet():
+    return {"a": StubManager([vm("web-1"), vm("web-3"), vm("db-2", "Stopped"),
+                              vm("web-5")]),
+            "b": StubManager([vm("web-2"), vm("db-1"), vm("web-4")])}
+
+
+def fleet_page(hosts, limit, marker=None, **kwargs):
+    pages = dict((name, lib.page_vms(limit=limit, marker=marker, **kwargs))
+                 for name, lib in hosts.items())
+    return libvirtapi.merge_pages(pages, {}, limit=limit)
+
+
+def test_page_vms_filters_and_pages_by_name():
+    lib = fleet()["a"]
+    page = lib.page_vms(state="running", name_prefix="web", limit=2)
+    assert [v["name"] for v in page["vms"]] == ["web-1", "web-3"]
+    assert page["next_marker"] == "web-3" and page["version"] == 1
+
+    page = lib.page_vms(state="running", name_prefix="web", limit=2,
+                        marker=page["next_marker"])
+    assert [v["name"] for v in page["vms"]] == ["web-5"]
+    assert page["next_marker"] is None
+
+    page = lib.page_vms(fields=["name"], limit=10)
+    assert page["vms"][0] == {"name": "db-2"}
+
+
+def test_marker_pagination_across_hosts_visits_each_vm_once():
+    hosts = fleet()
+    names, marker = [], None
+    while True:
+        page = fleet_page(hosts, 2, marker)
+        names += [v["name"] for v in page["vms"]]
+        marker = page["next_marker"]
+        if marker is None:
+            break
+    assert names == sorted(names)
+    assert names == ["db-1", "db-2", "web-1", "web-2", "web-3", "web-4",
+                     "web-5"]
+
+
+def test_merge_pages_keeps_marker_when_a_host_has_more():
+    pages = {"a": {"vms": [vm("a-1")], "next_marker": "a-1", "version": 3},
+             "b": {"vms": [], "next_marker": None, "version": 7}}
+    page = libvirtapi.merge_pages(pages, {}, fields=["name"], limit=1)
+    assert page["vms"] == [{"name": "a-1"}]
+    assert page["next_marker"] == "a-1"
+    assert page["version"] == "a:3,b:7"
+
+    # 任一主机失败或缓存不可用时没有版本号
+    page = libvirtapi.merge_pages(pages, {"c": "down"}, limit=1)
+    assert page["version"] is None and page["errors"] == {"c": "down"}
+
+
+def test_parse_list_params():
+    assert libvirtapi.parse_list_params({}) == (None, None)
+    assert libvirtapi.parse_list_params(
+        {"limit": "20", "fields": "name, state"}) == (20, ["name", "state"])
+    for args in ({"limit": "0"}, {"limit": "-1"}, {"limit": "abc"},
+                 {"fields": "name,password"}):
+        with pytest.raises(CustomException) as e:
+            libvirtapi.parse_list_params(args)
+        assert e.value.code == 400
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+pytest.importorskip("eventlet")
+pytest.importorskip("libvirt")
+
+from libvirtapi.libvirtoperations.novnc import TokenRegistry  # noqa: E402
+
+
+def test_token_reused_while_target_unchanged():
+    registry = TokenRegistry()
+    token = registry.assign("u1", "10.0.0.1", 5900)
+    assert registry.changed.is_set()
+    registry.changed.clear()
+
+    # 重复读取虚拟机信息不生成新 token，也不重写文件
+    assert registry.assign("u1", "10.0.0.1", "5900") == token
+    assert not registry.changed.is_set()
+    assert registry.lookup(token) == ("10.0.0.1", "5900")
+
+
+def test_token_rotated_when_target_changes():
+    registry = TokenRegistry()
+    old = registry.assign("u1", "10.0.0.1", 5900)
+    # 重新开机后端口变化
+    new = registry.assign("u1", "10.0.0.1", 5901)
+    assert new != old
+    assert registry.lookup(old) is None
+    assert registry.lookup(new) == ("10.0.0.1", "5901")
+
+    # 关机后 token 失效，再次开机是新的 token
+    assert registry.assign("u1", "10.0.0.1", -1) is None
+    assert registry.lookup(new) is None
+    assert registry.assign("u1", "10.0.0.1", 5901) not in (old, new)
+
+
+def test_token_dropped_when_vm_deleted(tmp_path):
+    registry = TokenRegistry()
+    keep = registry.assign("u1", "10.0.0.1", 5900)
+    gone = registry.assign("u2", "10.0.0.1", 5901)
+    registry(None, {"uuid": "u2"})
+    assert registry.lookup(gone) is not None
+    registry({"uuid": "u2"}, None)
+    assert registry.lookup(gone) is None
+
+    registry.path = str(tmp_path / "token.conf")
+    registry.write()
+    with open(registry.path) as f:
+        assert f.read() == "%s: 10.0.0.1:5900\n" % keep
+    assert [p.name for p in tmp_path.iterdir()] == ["token.conf"]
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("eventlet")
+pytest.importorskip("salt")
+libvirt = pytest.importorskip("libvirt")
+
+from libvirtapi.exs import CustomException  # noqa: E402
+from libvirtapi.libvirtoperations import libvirtapi  # noqa: E402
+from libvirtapi.libvirtoperations.hosts import Host  # noqa: E402
+from libvirtapi.libvirtoperations.jobs import Job  # noqa: E402
+
+
+class StubDomain():
+    """
+    delay 秒后发出操作对应的事件，delay 为 None 时不发出
+    """
+
+    def __init__(self, name, state="Running", delay=0.05):
+        self.name = name
+        self.state = state
+        self.delay = delay
+
+    def UUIDString(self):
+        return "uuid-" + self.name
+
+
+class StubHosts():
+    def __init__(self, host):
+        self.host = host
+
+    def get(self, name=None):
+        return self.host
+
+    def list(self):
+        return [self.host]
+
+
+@pytest.fixture
+def fleet(monkeypatch):
+    host = Host("n1", "test:///n1")
+    inventory = host.inventory
+    monkeypatch.setattr(inventory, "ensure_bound", lambda uri: None)
+    inventory._bound = True
+    domains = {}
+    calls = []
+
+    def later(dom, func):
+        if dom.delay is not None:
+            timer = threading.Timer(dom.delay, func)
+            timer.daemon = True
+            timer.start()
+
+    class StubManager():
+        uri = "test:///n1"
+
+        def __init__(self, host=None):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def _get_dom(self, name):
+            if name not in domains:
+                raise CustomException("not found vm %s" % name, 404)
+            return domains[name]
+
+        def get_vm_state(self, name):
+            return domains[name].state
+
+        def reboot(self, name):
+            calls.append(("reboot", name))
+            dom = domains[name]
+            later(dom, lambda: inventory._reboot_cb(None, dom, None))
+
+        def hard_reboot(self, name):
+            calls.append(("hard_reboot", name))
+            dom = domains[name]
+            later(dom, lambda: inventory._lifecycle_cb(
+                None, dom, libvirt.VIR_DOMAIN_EVENT_STARTED, 0, None))
+
+        def shutdown(self, name):
+            calls.append(("shutdown", name))
+            dom = domains[name]
+
+            def stopped():
+                dom.state = "Stopped"
+                inventory._lifecycle_cb(
+                    None, dom, libvirt.VIR_DOMAIN_EVENT_STOPPED, 0, None)
+            later(dom, stopped)
+
+        def start(self, name):
+            calls.append(("start", name))
+
+    monkeypatch.setattr(libvirtapi, "HOSTS", StubHosts(host))
+    monkeypatch.setattr(libvirtapi, "LibvirtManager", StubManager)
+    return host, domains, calls
+
+
+def test_soft_reboot_waits_for_reboot_event(fleet):
+    host, domains, calls = fleet
+    domains["a"] = StubDomain("a")
+    domains["slow"] = StubDomain("slow", delay=None)
+
+    result = libvirtapi.power_action("a", "reboot", wait=True, timeout=5)
+    assert result["status"] == "done" and result["state"] == "Running"
+    assert calls == [("reboot", "a")]
+
+    # 客户机没有响应重启
+    result = libvirtapi.power_action("slow", "reboot", wait=True,
+                                     timeout=0.2)
+    assert result["status"] == "timeout"
+    assert host.inventory._waiters == {}
+
+
+def test_hard_reboot_is_a_separate_action(fleet):
+    host, domains, calls = fleet
+    domains["a"] = StubDomain("a")
+    result = libvirtapi.power_action("a", "hard_reboot", wait=True,
+                                     timeout=5)
+    assert result["status"] == "done"
+    assert calls == [("hard_reboot", "a")]
+
+
+def test_shutdown_waits_for_stopped_and_skips_target_state(fleet):
+    host, domains, calls = fleet
+    domains["a"] = StubDomain("a")
+    result = libvirtapi.power_action("a", "shutdown", wait=True, timeout=5)
+    assert result["status"] == "done" and result["state"] == "Stopped"
+
+    result = libvirtapi.power_action("a", "shutdown", wait=True, timeout=5)
+    assert result["status"] == "unchanged"
+    assert calls == [("shutdown", "a")]
+
+
+def test_vm_actions_job_reports_each_vm(fleet):
+    host, domains, calls = fleet
+    domains["a"] = StubDomain("a")
+    domains["b"] = StubDomain("b", delay=None)
+    job = Job("vm_actions", "reboot")
+
+    with pytest.raises(CustomException) as e:
+        libvirtapi.vm_actions_job(job, ["a", "b", "missing"], "reboot", 3,
+                                  wait=True, timeout=0.5)
+    assert "2 of 3" in e.value.message
+    status = dict((r["name"], r["status"]) for r in job.result)
+    assert status == {"a": "done", "b": "timeout", "missing": "failed"}
+
+
+def test_number_param_rejects_malformed_values():
+    views = pytest.importorskip(
+        "libvirtapi.blueprints.libvirtapi.vm.views")
+    assert views._number_param({}, "parallelism", 8) == 8
+    assert views._number_param({"parallelism": ""}, "parallelism", 8) == 8
+    assert views._number_param({"parallelism": "4"}, "parallelism", 8) == 4
+    assert views._number_param({"timeout": "1.5"}, "timeout", 300,
+                               float) == 1.5
+    for params, cast, minimum in (({"n": "abc"}, int, None),
+                                  ({"n": "nan"}, float, None),
+                                  ({"n": "inf"}, float, None),
+                                  ({"n": "0"}, int, 1),
+                                  ({"n": ["1"]}, int, None)):
+        with pytest.raises(CustomException) as e:
+            views._number_param(params, "n", 1, cast, minimum)
+        assert e.value.code == 400
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("eventlet")
+pytest.importorskip("salt")
+pytest.importorskip("libvirt")
+
+from libvirtapi import config as cfg  # noqa: E402
+from libvirtapi.exs import CustomException  # noqa: E402
+from libvirtapi.libvirtoperations import scheduler  # noqa: E402
+from libvirtapi.libvirtoperations.hosts import Host  # noqa: E402
+from libvirtapi.libvirtoperations.ledger import ResourceLedger  # noqa: E402
+
+GiB = 1024 ** 3
+
+
+class StubHosts():
+    """
+    只提供调度用到的接口，map 不发起同步
+    """
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+
+    def list(self):
+        return list(self.hosts)
+
+    def map(self, func, hosts=None):
+        return {}, {}
+
+
+def make_state(sched, host, vcpus, memory, disk=100 * GiB, cells=None):
+    state = sched.state(host)
+    state.total_vcpus = vcpus
+    state.total_memory = memory
+    state.pool_free = disk
+    state.cells = cells or {}
+    state.updated = time.time()
+    return state
+
+
+@pytest.fixture
+def fleet(monkeypatch):
+    hosts = [Host("n1", "test:///n1"), Host("n2", "test:///n2")]
+    monkeypatch.setattr(scheduler, "HOSTS", StubHosts(hosts))
+    sched = scheduler.Scheduler()
+    sched.load(cfg.CONF)
+    make_state(sched, hosts[0], 8, 16384)
+    make_state(sched, hosts[1], 8, 32768)
+    return sched, hosts
+
+
+def test_reserve_admits_only_what_fits():
+    ledger = ResourceLedger()
+    results = []
+
+    def reserve(index):
+        results.append(ledger.reserve("vm-%s" % index, 2, 1024, 8, 4096))
+
+    threads = [threading.Thread(target=reserve, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 检查与预留在同一把锁内，并发预留不会超额
+    assert results.count(True) == 4
+    assert ledger.reserved_vcpus == 8 and ledger.reserved_memory == 4096
+    ledger.unreserve("vm-0")
+    assert ledger.reserve("late", 2, 1024, 8, 4096)
+
+
+def test_exclusive_reserve_counts_group_reservations():
+    ledger = ResourceLedger()
+    assert ledger.reserve("a", 1, 1, 10, 10, group="web", exclusive=True)
+    assert not ledger.reserve("b", 1, 1, 10, 10, group="web", exclusive=True)
+    assert ledger.reserve("c", 1, 1, 10, 10, group="web")
+    assert ledger.reserved_in_group("web") == 2
+    ledger.unreserve("a")
+    ledger.unreserve("c")
+    assert ledger.reserve("b", 1, 1, 10, 10, group="web", exclusive=True)
+
+
+def test_disk_claims_released_on_failure_and_refresh():
+    ledger = ResourceLedger()
+    ledger.reserve("a", 1, 1, 10, 10, disk=100)
+    ledger.reserve("b", 1, 1, 10, 10, disk=60)
+    ledger.release_disk("a")
+    assert ledger.claimed_disk == 60
+    # 批量创建部分失败时按比例释放
+    ledger.release_disk("b", 0.5)
+    assert ledger.claimed_disk == 30
+    # 存储池剩余空间重新获取后预占不再扣除
+    ledger.reset_disk(time.time() + 1)
+    assert ledger.claimed_disk == 0
+
+
+def test_schedule_prefers_free_memory_and_reserves(fleet):
+    sched, hosts = fleet
+    result = sched.schedule(scheduler.RequestSpec(2, 4096, disk=10 * GiB))
+    assert result["host"] == "n2"
+    ledger = hosts[1].ledger
+    assert ledger.reserved_vcpus == 2 and ledger.reserved_memory == 4096
+    assert ledger.claimed_disk == 10 * GiB
+
+
+def test_filters_reject_hosts_without_room(fleet):
+    sched, hosts = fleet
+    # n2 的磁盘不足，只能放在 n1
+    sched.state(hosts[1]).pool_free = GiB
+    result = sched.schedule(scheduler.RequestSpec(2, 4096, disk=10 * GiB))
+    assert result["host"] == "n1"
+
+    with pytest.raises(CustomException) as e:
+        sched.schedule(scheduler.RequestSpec(16, 1024))
+    assert e.value.code == 400
+    assert "n1" in e.value.message and "n2" in e.value.message
+
+
+def test_anti_affinity_counts_pending_group_members(fleet):
+    sched, hosts = fleet
+    spec = dict(group="web", group_policy="anti-affinity")
+    first = sched.schedule(scheduler.RequestSpec(1, 1024, **spec))
+    # 第一台还在创建中，第二台放到另一台主机
+    second = sched.schedule(scheduler.RequestSpec(1, 1024, **spec))
+    assert set([first["host"], second["host"]]) == set(["n1", "n2"])
+    with pytest.raises(CustomException):
+        sched.schedule(scheduler.RequestSpec(1, 1024, **spec))
+
+
+def test_numa_node_fit(fleet):
+    sched, hosts = fleet
+    state = make_state(sched, hosts[0], 8, 16384, cells={
+        0: {"cpus": [0, 1, 2, 3], "memory": 8192},
+        1: {"cpus": [4, 5, 6, 7], "memory": 6144}})
+    hosts[0].ledger.reserve("a", 1, 4096, 8, 16384, node=0)
+    assert state.fit_node(scheduler.RequestSpec(2, 4096)) == 1
+    assert state.fit_node(scheduler.RequestSpec(2, 7000)) is None
+    assert state.fit_node(scheduler.RequestSpec(6, 1024)) is None
+    assert "nodeset='1'" in state.placement_xml(1, 2)
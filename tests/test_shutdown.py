@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("eventlet")
+pytest.importorskip("salt")
+libvirt = pytest.importorskip("libvirt")
+
+from libvirtapi.exs import CustomException  # noqa: E402
+from libvirtapi.libvirtoperations import libvirtapi  # noqa: E402
+from libvirtapi.libvirtoperations.hosts import Host  # noqa: E402
+from libvirtapi.libvirtoperations.jobs import Job  # noqa: E402
+
+
+class StubDomain():
+    """
+    stops_by 为响应关机的方式，None 表示只有强制关机有效
+    """
+
+    def __init__(self, name, stops_by=None, state="Running"):
+        self.name = name
+        self.stops_by = stops_by
+        self.state = state
+
+    def UUIDString(self):
+        return "uuid-" + self.name
+
+
+class StubHosts():
+    def __init__(self, host):
+        self.host = host
+
+    def get(self, name=None):
+        return self.host
+
+    def list(self):
+        return [self.host]
+
+
+@pytest.fixture
+def fleet(monkeypatch):
+    host = Host("n1", "test:///n1")
+    inventory = host.inventory
+    monkeypatch.setattr(inventory, "ensure_bound", lambda uri: None)
+    inventory._bound = True
+    domains = {}
+    calls = []
+
+    def stop(dom):
+        dom.state = "Stopped"
+        inventory._lifecycle_cb(
+            None, dom, libvirt.VIR_DOMAIN_EVENT_STOPPED, 0, None)
+
+    class StubManager():
+        uri = "test:///n1"
+
+        def __init__(self, host=None):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def _get_dom(self, name):
+            return domains[name]
+
+        def get_vm_state(self, name):
+            return domains[name].state
+
+        def shutdown(self, name, mode=None):
+            calls.append((name, mode))
+            dom = domains[name]
+            if mode == "agent" and dom.stops_by != "agent":
+                raise libvirt.libvirtError("guest agent is not responding")
+            if dom.stops_by == mode:
+                timer = threading.Timer(0.05, stop, args=(dom,))
+                timer.daemon = True
+                timer.start()
+
+        def destroy(self, name):
+            calls.append((name, "destroy"))
+            domains[name].state = "Stopped"
+
+    monkeypatch.setattr(libvirtapi, "HOSTS", StubHosts(host))
+    monkeypatch.setattr(libvirtapi, "LibvirtManager", StubManager)
+    return host, domains, calls
+
+
+def test_graceful_shutdown_escalates(fleet):
+    host, domains, calls = fleet
+    domains["acpi"] = StubDomain("acpi", "acpi")
+    domains["agent"] = StubDomain("agent", "agent")
+    domains["hung"] = StubDomain("hung")
+    domains["off"] = StubDomain("off", state="Stopped")
+
+    methods = dict(
+        (name, libvirtapi.graceful_shutdown(name, None, 0.5, 2)["method"])
+        for name in ("acpi", "agent"))
+    assert methods == {"acpi": "acpi", "agent": "agent"}
+
+    result = libvirtapi.graceful_shutdown("hung", None, 0.1, 0.1)
+    assert result["method"] == "destroy" and result["state"] == "Stopped"
+    # guest agent 失败时直接进入下一步
+    assert [c for c in calls if c[0] == "hung"] == \
+        [("hung", "acpi"), ("hung", "agent"), ("hung", "destroy")]
+
+    assert libvirtapi.graceful_shutdown("off")["status"] == "unchanged"
+    assert host.inventory._waiters == {}
+
+
+def test_shutdown_waves_run_in_priority_order(monkeypatch):
+    lock = threading.Lock()
+    running = []
+    spans = {}
+    peak = [0]
+
+    def shutdown(name, host, acpi_timeout, agent_timeout):
+        with lock:
+            running.append(name)
+            peak[0] = max(peak[0], len(running))
+        start = time.time()
+        time.sleep(0.05)
+        with lock:
+            running.remove(name)
+        spans[name] = (start, time.time())
+        if name == "db-2":
+            raise CustomException("not found vm db-2", 404)
+        return {"status": "done", "method": "acpi", "state": "Stopped"}
+
+    monkeypatch.setattr(libvirtapi, "graceful_shutdown", shutdown)
+    priorities = {"web-1": 0, "web-2": 0, "web-3": 0, "app-1": 5,
+                  "db-1": 10, "db-2": 10}
+    job = Job("shutdown_vms", "shutdown")
+    with pytest.raises(CustomException) as e:
+        libvirtapi.shutdown_vms_job(job, list(reversed(sorted(priorities))),
+                                    None, priorities, parallelism=2)
+    assert "1 of 6" in e.value.message
+
+    # 上一批全部结束后才开始下一批，批内并发不超过 parallelism
+    def wave(priority):
+        return [name for name, p in priorities.items() if p == priority]
+    for first, second in ((0, 5), (5, 10)):
+        assert max(spans[n][1] for n in wave(first)) <= \
+            min(spans[n][0] for n in wave(second))
+    assert peak[0] == 2
+
+    assert [r["priority"] for r in job.result] == [0, 0, 0, 5, 10, 10]
+    status = dict((r["name"], r["status"]) for r in job.result)
+    assert status["db-2"] == "failed" and status["db-1"] == "done"